@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the hot paths of the Falcon-Marshmallow middleware
+
+A Falcon app with the ``JSONEnforcer``, ``EmptyRequestDropper``, and
+``Marshmallow`` middleware is driven in-process through
+``falcon.testing``, with GET and POST requests for collections of
+various sizes and schemas of various complexity, using each installed
+JSON backend. Each case reports its throughput in requests per second,
+and the mean time spent per request in each middleware method.
+
+Results are written as JSON, so that they may be stored as a baseline
+and compared with later runs::
+
+    python benchmarks/bench_middleware.py --output baseline.json
+    python benchmarks/bench_middleware.py --compare baseline.json
+
+When comparing, the exit status is 1 if any case's throughput dropped
+by more than ``--threshold`` (default 10%) relative to the baseline.
+Baselines are only meaningful on the machine on which they were taken.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import argparse
+import io
+import itertools
+import json
+import platform
+import sys
+import types
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from timeit import default_timer
+from typing import (
+    Any, Callable, Dict, Iterator, List, Optional, Sequence
+)
+
+# Third party
+import falcon
+import marshmallow
+from falcon import API, testing
+from marshmallow import fields, Schema
+
+# Local
+import falcon_marshmallow
+from falcon_marshmallow.backends import BACKENDS, get_backend
+from falcon_marshmallow.middleware import (
+    EmptyRequestDropper,
+    JSONEnforcer,
+    Marshmallow,
+)
+
+
+SIZES = (1, 100, 1000)
+QUICK_SIZES = (1, 10)
+METHODS = ('GET', 'POST')
+STAGES = ('process_request', 'process_resource', 'process_response')
+
+
+class Flat(Schema):
+    """A schema of scalar fields"""
+    id = fields.Integer()
+    name = fields.String()
+    email = fields.String()
+    active = fields.Boolean()
+    score = fields.Float()
+    created = fields.DateTime()
+
+
+class Address(Schema):
+    """A schema to nest"""
+    street = fields.String()
+    city = fields.String()
+    country = fields.String()
+
+
+class Nested(Flat):
+    """A schema with a nested object and a nested collection"""
+    address = fields.Nested(Address)
+    friends = fields.Nested(Flat, many=True)
+
+
+class Lists(Schema):
+    """A schema with lists of scalars"""
+    id = fields.Integer()
+    tags = fields.List(fields.String())
+    scores = fields.List(fields.Float())
+
+
+def make_flat(index):
+    # type: (int) -> dict
+    """Return an object for the ``Flat`` schema"""
+    return {
+        'id': index,
+        'name': 'Name %d' % index,
+        'email': 'user%d@example.com' % index,
+        'active': index % 2 == 0,
+        'score': index / 7.0,
+        'created': datetime(2018, 1, 1) + timedelta(seconds=index),
+    }
+
+
+def make_nested(index):
+    # type: (int) -> dict
+    """Return an object for the ``Nested`` schema"""
+    obj = make_flat(index)
+    obj['address'] = {
+        'street': '%d Main Street' % index,
+        'city': 'Springfield',
+        'country': 'US',
+    }
+    obj['friends'] = [make_flat(index * 10 + i) for i in range(3)]
+    return obj
+
+
+def make_lists(index):
+    # type: (int) -> dict
+    """Return an object for the ``Lists`` schema"""
+    return {
+        'id': index,
+        'tags': ['tag%d' % i for i in range(10)],
+        'scores': [index / (i + 1.0) for i in range(10)],
+    }
+
+
+# Schema name -> (schema class, or None for no schema, object factory)
+SCHEMAS = OrderedDict([
+    ('flat', (Flat, make_flat)),
+    ('nested', (Nested, make_nested)),
+    ('lists', (Lists, make_lists)),
+    ('none', (None, make_flat)),
+])
+
+
+class StageTimer:
+    """A proxy for a middleware object, timing each of its methods"""
+
+    def __init__(self, middleware, timings):
+        # type: (object, Dict[str, float]) -> None
+        """Instantiate the proxy
+
+        :param middleware: the middleware object to time
+        :param timings: the dict in which to accumulate the seconds
+            spent in each method, keyed on ``<class>.<method>``
+        """
+        for stage in STAGES:
+            method = getattr(middleware, stage, None)
+            if method is not None:
+                name = '%s.%s' % (middleware.__class__.__name__, stage)
+                # Falcon requires middleware methods to be bound
+                setattr(self, stage, types.MethodType(
+                    self._timed(name, method, timings), self
+                ))
+
+    @staticmethod
+    def _timed(name, method, timings):
+        # type: (str, Callable, Dict[str, float]) -> Callable
+        """Return a function calling ``method`` and timing it"""
+        timings[name] = 0.0
+
+        def timed(self, *args):
+            start = default_timer()
+            try:
+                return method(*args)
+            finally:
+                timings[name] += default_timer() - start
+
+        return timed
+
+
+class Resource:
+    """A resource returning and accepting collections"""
+
+    def __init__(self, schema, result, backend, raw):
+        # type: (Optional[Schema], list, Any, bool) -> None
+        """Instantiate the resource
+
+        :param schema: the schema for requests and responses, if any
+        :param result: the result of GET requests
+        :param backend: the JSON backend with which to (de)serialize
+            bodies if ``raw`` is true
+        :param raw: whether to (de)serialize bodies in the resource,
+            rather than in the middleware
+        """
+        self.schema = schema
+        self.result = result
+        self.backend = backend
+        self.raw = raw
+
+    def _respond(self, req, resp, result):
+        # type: (falcon.Request, falcon.Response, Any) -> None
+        """Set the result of a request"""
+        if self.raw:
+            resp.body = self.backend.dumps(result)
+        else:
+            req.context['result'] = result
+
+    def on_get(self, req, resp):
+        """Return the collection"""
+        self._respond(req, resp, self.result)
+
+    def on_post(self, req, resp):
+        """Echo the posted collection"""
+        if self.raw:
+            data = self.backend.loads(req.bounded_stream.read())
+        else:
+            data = req.context['json']
+        self._respond(req, resp, data)
+
+
+def get_backends(names=None):
+    # type: (Optional[Sequence[str]]) -> List[str]
+    """Return the names of the JSON backends which are installed"""
+    available = []
+    for name in names or sorted(BACKENDS):
+        try:
+            get_backend(name)
+        except ImportError:
+            print('Skipping %s, which is not installed' % name,
+                  file=sys.stderr)
+            continue
+        available.append(name)
+    return available
+
+
+def iter_cases(schemas,  # type: Sequence[str]
+               sizes,  # type: Sequence[int]
+               backends,  # type: Sequence[str]
+               force_json,  # type: Sequence[bool]
+               ):
+    # type: (...) -> Iterator[tuple]
+    """Yield ``(name, schema, size, backend, force_json, method)``
+
+    ``force_json`` only affects resources without schemas, so it is
+    only varied for those.
+    """
+    for schema, size, backend, method in itertools.product(
+            schemas, sizes, backends, METHODS):
+        for force in force_json if schema == 'none' else (True,):
+            name = '%s %s n=%d %s force_json=%s' % (
+                method, schema, size, backend, 'on' if force else 'off'
+            )
+            yield name, schema, size, backend, force, method
+
+
+def run_case(schema_name, size, backend, force_json, method, min_time,
+             repeat):
+    # type: (str, int, str, bool, str, float, int) -> Dict[str, Any]
+    """Benchmark one case, returning its results
+
+    Requests are sent for at least ``min_time`` seconds, ``repeat``
+    times, and the best throughput is reported. Stage timings are
+    averaged over all requests.
+    """
+    schema_cls, factory = SCHEMAS[schema_name]
+    objs = [factory(index) for index in range(size)]
+    schema = None if schema_cls is None else schema_cls(many=True)
+    if schema is None:
+        # Without a schema, results must be JSON serializable as they are
+        objs = Flat(many=True).dump(objs).data
+        body = json.dumps(objs)
+    else:
+        body = json.dumps(schema.dump(objs).data)
+
+    timings = OrderedDict()  # type: Dict[str, float]
+    middleware = [
+        JSONEnforcer(),
+        EmptyRequestDropper(),
+        Marshmallow(force_json=force_json, json_backend=backend),
+    ]
+    app = API(middleware=[StageTimer(mw, timings) for mw in middleware])
+    app.add_route('/items', Resource(
+        schema, objs, get_backend(backend),
+        raw=schema is None and not force_json,
+    ))
+
+    environ = testing.create_environ(
+        '/items', method=method,
+        body=body if method == 'POST' else '',
+        headers={
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        },
+    )
+    content = body.encode('utf-8') if method == 'POST' else b''
+
+    def request():
+        env = dict(environ)
+        env['wsgi.input'] = io.BytesIO(content)
+        start_response = testing.StartResponseMock()
+        for _ in app(env, start_response):
+            pass
+        if not start_response.status.startswith('200'):
+            raise RuntimeError(
+                'Benchmark request failed: %s' % start_response.status
+            )
+
+    # Warm up caches, e.g. of schema lookups
+    request()
+    for name in timings:
+        timings[name] = 0.0
+
+    best = 0.0
+    count = 0
+    for _ in range(repeat):
+        iterations = 0
+        start = default_timer()
+        elapsed = 0.0
+        while elapsed < min_time:
+            request()
+            iterations += 1
+            elapsed = default_timer() - start
+        best = max(best, iterations / elapsed)
+        count += iterations
+
+    return OrderedDict([
+        ('requests_per_second', best),
+        ('stages_us', OrderedDict(
+            (name, seconds / count * 1e6) for name, seconds in timings.items()
+        )),
+    ])
+
+
+def compare(results, baseline, threshold):
+    # type: (Dict[str, Any], Dict[str, Any], float) -> bool
+    """Print the change in throughput of each case against a baseline
+
+    :return: whether no case regressed by more than ``threshold``
+    """
+    ok = True
+    for name, result in results.items():
+        if name not in baseline:
+            print('%-50s (not in baseline)' % name, file=sys.stderr)
+            continue
+        ratio = (
+            result['requests_per_second'] /
+            baseline[name]['requests_per_second']
+        )
+        regressed = ratio < 1 - threshold
+        ok = ok and not regressed
+        print('%-50s %+7.1f%%%s' % (
+            name, (ratio - 1) * 100, '  REGRESSION' if regressed else ''
+        ), file=sys.stderr)
+    return ok
+
+
+def parse_args(argv=None):
+    # type: (Optional[Sequence[str]]) -> argparse.Namespace
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Falcon-Marshmallow middleware'
+    )
+    parser.add_argument(
+        '--schemas', nargs='+', choices=list(SCHEMAS), default=list(SCHEMAS),
+        help='the schemas to benchmark (default: all)'
+    )
+    parser.add_argument(
+        '--sizes', nargs='+', type=int,
+        help='the collection sizes to benchmark (default: %s)' % (
+            ' '.join(str(size) for size in SIZES)
+        )
+    )
+    parser.add_argument(
+        '--backends', nargs='+', choices=sorted(BACKENDS),
+        help='the JSON backends to benchmark (default: all installed)'
+    )
+    parser.add_argument(
+        '--force-json', nargs='+', choices=('on', 'off'),
+        default=['on', 'off'],
+        help='the force_json settings to benchmark (default: both)'
+    )
+    parser.add_argument(
+        '--min-time', type=float, default=0.2,
+        help='the minimum number of seconds per round (default: 0.2)'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='the number of rounds per case (default: 3)'
+    )
+    parser.add_argument(
+        '--quick', action='store_true',
+        help='run small collections, one short round per case'
+    )
+    parser.add_argument(
+        '--output', help='the file to which to write results as JSON '
+                         '(default: standard output)'
+    )
+    parser.add_argument(
+        '--compare', metavar='BASELINE',
+        help='a results file to compare throughput against'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='the drop in throughput, relative to the baseline, above '
+             'which a case counts as a regression (default: 0.1)'
+    )
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.min_time = min(args.min_time, 0.05)
+        args.repeat = 1
+        args.sizes = args.sizes or list(QUICK_SIZES)
+    args.sizes = args.sizes or list(SIZES)
+    return args
+
+
+def main(argv=None):
+    # type: (Optional[Sequence[str]]) -> int
+    """Run the benchmarks, returning the exit status"""
+    args = parse_args(argv)
+    results = OrderedDict()  # type: Dict[str, Any]
+    cases = iter_cases(
+        args.schemas, args.sizes, get_backends(args.backends),
+        [setting == 'on' for setting in args.force_json],
+    )
+    for name, schema, size, backend, force, method in cases:
+        results[name] = run_case(
+            schema, size, backend, force, method, args.min_time, args.repeat
+        )
+        print('%-50s %10.1f req/s' % (
+            name, results[name]['requests_per_second']
+        ), file=sys.stderr)
+
+    report = OrderedDict([
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('implementation', platform.python_implementation()),
+            ('falcon', falcon.__version__),
+            ('marshmallow', marshmallow.__version__),
+            ('falcon_marshmallow', falcon_marshmallow.__version__),
+        ])),
+        ('results', results),
+    ])
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)['results']
+        print('\nThroughput relative to %s:' % args.compare, file=sys.stderr)
+        if not compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,4 +5,9 @@ Middleware to integrate Marshmallow with Falcon
 
 from ._version import __version__, __version_info__
 
-from .middleware import EmptyRequestDropper, JSONEnforcer, Marshmallow
+from .middleware import (
+    Compressor,
+    EmptyRequestDropper,
+    JSONEnforcer,
+    Marshmallow,
+)
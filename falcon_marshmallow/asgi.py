@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Middleware variants for Falcon's ASGI app
+
+The classes in this module extend those in ``falcon_marshmallow.middleware``
+with the ``*_async`` hooks used by ``falcon.asgi.App``, so the same
+instances may be used with both WSGI and ASGI apps. The request body is
+read with ``await req.stream.read()`` and stashed where the synchronous
+helpers find it. Deserialization and serialization of large payloads is
+moved to an executor, so that one big payload does not stall the event
+loop for every other connection.
+
+There is no ASGI variant of ``falcon_marshmallow.middleware.Compressor``,
+which only works with WSGI apps: compression of ASGI responses and
+decompression of ASGI requests is best left to the ASGI server or a
+proxy.
+
+This module requires Python 3.7 or above.
+"""
+
+# Std lib
+import asyncio
+import logging
+import mmap
+import tempfile
+from collections.abc import Iterator, Sized
+from concurrent.futures import Executor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Optional
+
+# Third party
+from falcon import Request, Response
+
+# Local
+from . import middleware
+from .body import (
+    CONTENT_KEY,
+    STREAM_KEY,
+    BodyContent,
+    RewindableBody,
+    check_content_length,
+    get_max_body_size,
+)
+from .metrics import NULL_REQUEST_METRICS
+from .streaming import DEFAULT_CHUNK_SIZE
+
+
+log = logging.getLogger(__name__)
+
+
+#: Request bodies larger than this many bytes are deserialized in an
+#: executor by default
+DEFAULT_OFFLOAD_THRESHOLD = 64 * 1024
+#: Results with more than this many items are serialized in an executor
+#: by default
+DEFAULT_OFFLOAD_ITEMS = 1000
+
+
+async def get_stashed_content_async(req, spool_threshold=None, max_size=None,
+                                    chunk_size=DEFAULT_CHUNK_SIZE):
+    # type: (Request, Optional[int], Optional[int], int) -> BodyContent
+    """Read and stash the body of an ASGI request
+
+    This is the asynchronous counterpart of
+    ``falcon_marshmallow.body.get_stashed_content``, which returns the
+    stashed content without reading anything once this has been
+    awaited. Since ASGI requests do not allow replacing ``req.stream``,
+    the seekable ``RewindableBody`` over the content is only available
+    from ``get_stashed_stream``.
+
+    :param req: the request
+    :param spool_threshold: the Content-Length, in bytes, above which
+        the body is spooled to disk, or ``None`` to always read the
+        body into memory
+    :param max_size: the maximum Content-Length, in bytes, or ``None``
+        for no limit. This is checked before any of the body is read.
+    :param chunk_size: the number of bytes to read at a time when
+        spooling the body
+
+    :raises HTTPPayloadTooLarge: if the Content-Length of the request
+        exceeds ``max_size``
+    """
+    if req.context.get(CONTENT_KEY) is None:
+        check_content_length(req, max_size)
+        if (spool_threshold is not None and
+                (req.content_length or 0) > spool_threshold):
+            content = await _spool_to_mmap_async(req.stream, chunk_size)
+        else:
+            content = await req.stream.read()
+        req.context[CONTENT_KEY] = content
+        req.context[STREAM_KEY] = RewindableBody(content)
+
+    return req.context[CONTENT_KEY]
+
+
+async def _spool_to_mmap_async(stream, chunk_size):
+    # type: (Any, int) -> BodyContent
+    """Copy an ASGI stream to a memory-mapped temporary file"""
+    with tempfile.TemporaryFile() as spool:
+        while True:
+            chunk = await stream.read(chunk_size)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.flush()
+        if not spool.tell():
+            return b''
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class JSONEnforcer(middleware.JSONEnforcer):
+    """Enforce that requests are JSON compatible, for WSGI and ASGI"""
+
+    async def process_request_async(self, req, resp):
+        # type: (Request, Response) -> None
+        """Ensure requests accept JSON or specify JSON as content type
+
+        See ``process_request``.
+        """
+        self.process_request(req, resp)
+
+
+class EmptyRequestDropper(middleware.EmptyRequestDropper):
+    """Check and drop empty requests, for WSGI and ASGI"""
+
+    async def process_request_async(self, req, resp):
+        # type: (Request, Response) -> None
+        """Ensure that a request does not contain an empty body
+
+        The body is read without blocking, then checked as in
+        ``process_request``. Since ASGI requests do not allow replacing
+        ``req.stream``, bodies without a Content-Length are not
+        bounded.
+        """
+        log.debug(
+            'EmptyRequestDropper.process_request_async(%s, %s)', req, resp
+        )
+        if not self._resource_limits:
+            await self._check_body_async(req, self._max_body_size)
+
+    async def process_resource_async(self, req, resp, resource, params):
+        # type: (Request, Response, object, dict) -> None
+        """Ensure that a request does not contain an empty body
+
+        See ``process_resource``.
+        """
+        log.debug(
+            'EmptyRequestDropper.process_resource_async(%s, %s, %s, %s)',
+            req, resp, resource, params
+        )
+        if self._resource_limits:
+            await self._check_body_async(req, get_max_body_size(
+                resource, req.method, self._max_body_size
+            ))
+
+    async def _check_body_async(self, req, max_size):
+        # type: (Request, Optional[int]) -> None
+        """Read the body of a request without blocking, then check it"""
+        if req.content_length in (None, 0):
+            return
+        await get_stashed_content_async(req, self._spool_threshold, max_size)
+        self._check_body(req, max_size)
+
+
+class Marshmallow(middleware.Marshmallow):
+    """Attempt to (de)serialize objects with schemas, for WSGI and ASGI"""
+
+    def __init__(self,
+                 executor=None,  # type: Optional[Executor]
+                 offload_threshold=DEFAULT_OFFLOAD_THRESHOLD,  # type: int
+                 offload_item_threshold=DEFAULT_OFFLOAD_ITEMS,  # type: int
+                 **kwargs  # type: Any
+                 ):
+        # type: (...) -> None
+        """Instantiate the middleware object
+
+        Any keyword arguments not listed below are passed to
+        ``falcon_marshmallow.middleware.Marshmallow``.
+
+        :param executor: (default ``None``) the executor in which to
+            (de)serialize large payloads. If ``None``, the event loop's
+            default executor is used.
+        :param offload_threshold: (default 64 KiB) the size, in bytes,
+            above which request bodies are parsed and loaded in the
+            executor
+        :param offload_item_threshold: (default 1000) the number of
+            items above which results are dumped in the executor.
+            Iterator results, which are streamed, are always dumped in
+            the executor, one batch at a time.
+        """
+        log.debug(
+            'Marshmallow.__init__(%s, %s, %s, %s)',
+            executor, offload_threshold, offload_item_threshold, kwargs
+        )
+        middleware.Marshmallow.__init__(self, **kwargs)
+        self._executor = executor
+        self._offload_threshold = offload_threshold
+        self._offload_item_threshold = offload_item_threshold
+
+    async def _run(self, offload, func, *args):
+        # type: (bool, Callable, *Any) -> Any
+        """Call ``func``, in the executor if ``offload`` is true
+
+        If ``func`` profiles the request, its profile is enabled and
+        disabled within the call, and so on a single thread, but that
+        is an executor thread for offloaded calls. Since Python 3.12, a
+        profile sees every thread, so the profile of an offloaded call
+        may include work done meanwhile for other requests.
+        """
+        if not offload:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(func, *args)
+        )
+
+    async def process_resource_async(self, req, resp, resource, params):
+        # type: (Request, Response, object, dict) -> None
+        """Deserialize the request body with any resource-specific schemas
+
+        The body is read without blocking. It is then processed as in
+        ``process_resource``, in the executor if it is larger than
+        ``offload_threshold``.
+        """
+        log.debug(
+            'Marshmallow.process_resource_async(%s, %s, %s, %s)',
+            req, resp, resource, params
+        )
+        if req.content_length in (None, 0):
+            if self._profiler is not None:
+                # There is nothing to load, but the request may still be
+                # profiled, from ``process_response`` on
+                self._profiler.start(req)
+            return
+
+        metrics = NULL_REQUEST_METRICS
+        if req.context.get(CONTENT_KEY) is None:
+            # The body is stashed by the time ``process_resource`` parses
+            # it, so reading it is timed here
+            metrics = self._metrics.request(resource, req.method)
+        with metrics.time('read'):
+            content = await get_stashed_content_async(
+                req, self._spool_threshold,
+                get_max_body_size(resource, req.method, self._max_body_size),
+                self._stream_chunk_size
+            )
+        await self._run(
+            len(content) > self._offload_threshold,
+            self.process_resource, req, resp, resource, params
+        )
+
+    async def process_response_async(self, req, resp, resource,
+                                     req_succeeded):
+        # type: (Request, Response, object, bool) -> None
+        """Serialize the result and dump it in the response
+
+        The result is processed as in ``process_response``, in the
+        executor if it has more than ``offload_item_threshold`` items.
+        Iterator results are streamed as an asynchronous iterator, each
+        chunk of which is serialized in the executor.
+        """
+        log.debug(
+            'Marshmallow.process_response_async(%s, %s, %s, %s)',
+            req, resp, resource, req_succeeded
+        )
+        if self._resp_key not in req.context:
+            # There is nothing to serialize, but any profile of the
+            # request is still written by ``process_response``
+            if self._profiler is not None:
+                self.process_response(req, resp, resource, req_succeeded)
+            return
+
+        result = req.context[self._resp_key]
+        offload = (
+            isinstance(result, Iterator) or (
+                isinstance(result, Sized) and
+                len(result) > self._offload_item_threshold
+            )
+        )
+        await self._run(
+            offload, self.process_response, req, resp, resource,
+            req_succeeded
+        )
+        if isinstance(resp.stream, Iterator):
+            resp.stream = self._iter_async(resp.stream)
+
+    async def _iter_async(self, chunks):
+        # type: (Iterator[bytes]) -> AsyncIterator[bytes]
+        """Yield the chunks of a streamed response from the executor"""
+        loop = asyncio.get_running_loop()
+        done = object()
+        while True:
+            chunk = await loop.run_in_executor(
+                self._executor, next, chunks, done
+            )
+            if chunk is done:
+                return
+            yield chunk
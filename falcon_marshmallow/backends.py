@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+JSON backends for Falcon-Marshmallow
+
+A backend wraps a JSON library behind a minimal ``loads``/``dumps``
+interface. Backends whose ``dumps`` returns ``bytes`` (``binary = True``)
+have their output written directly to ``resp.data``, avoiding a round
+trip through ``str``.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import json as std_json
+import logging
+from typing import Any, Optional, Union
+
+# Third party
+import simplejson
+
+
+log = logging.getLogger(__name__)
+
+try:
+    # Backend names may be byte or unicode strings on Python 2
+    _STRING_TYPES = (basestring,)  # type: tuple  # noqa: F821
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+class JSONBackend:
+    """Base class for JSON backends"""
+
+    #: Whether ``dumps`` returns ``bytes`` rather than ``str``
+    binary = False
+
+    #: A module implementing the public interface of the stdlib ``json``
+    #: module, producing results equivalent to this backend. It is used
+    #: where that interface is required, e.g. for incremental parsing.
+    module = std_json
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        """Deserialize a JSON document
+
+        :raises ValueError: if the document is invalid
+        """
+        raise NotImplementedError
+
+    def dumps(self, obj):
+        # type: (Any) -> Union[bytes, str]
+        """Serialize an object to a JSON document
+
+        :raises TypeError: if the object cannot be serialized
+        """
+        raise NotImplementedError
+
+
+class ModuleBackend(JSONBackend):
+    """Backend for any module with the interface of the ``json`` module"""
+
+    def __init__(self, module):
+        # type: (Any) -> None
+        """Instantiate the backend
+
+        :param module: the module (or object) to use, e.g. ``json``
+        """
+        self.module = module
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.module)
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        return self.module.loads(data)
+
+    def dumps(self, obj):
+        # type: (Any) -> str
+        return self.module.dumps(obj)
+
+
+class StdlibJSONBackend(ModuleBackend):
+    """Backend using the standard library ``json`` module"""
+
+    def __init__(self):
+        ModuleBackend.__init__(self, std_json)
+
+
+class SimpleJSONBackend(ModuleBackend):
+    """Backend using ``simplejson``"""
+
+    def __init__(self):
+        ModuleBackend.__init__(self, simplejson)
+
+
+class OrjsonBackend(JSONBackend):
+    """Backend using ``orjson``, which serializes directly to bytes
+
+    Requires the optional ``orjson`` dependency.
+    """
+
+    binary = True
+
+    def __init__(self, option=None):
+        # type: (Optional[int]) -> None
+        """Instantiate the backend
+
+        :param option: any ``orjson.OPT_*`` flags to pass to
+            ``orjson.dumps``
+
+        :raises ImportError: if ``orjson`` is not installed
+        """
+        import orjson
+        self._orjson = orjson
+        self._option = option
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        return self._orjson.loads(data)
+
+    def dumps(self, obj):
+        # type: (Any) -> bytes
+        if self._option is None:
+            return self._orjson.dumps(obj)
+        return self._orjson.dumps(obj, option=self._option)
+
+
+class UjsonBackend(JSONBackend):
+    """Backend using ``ujson``
+
+    Requires the optional ``ujson`` dependency.
+    """
+
+    def __init__(self):
+        """Instantiate the backend
+
+        :raises ImportError: if ``ujson`` is not installed
+        """
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        return self._ujson.loads(data)
+
+    def dumps(self, obj):
+        # type: (Any) -> str
+        return self._ujson.dumps(obj, escape_forward_slashes=False)
+
+
+BACKENDS = {
+    'json': StdlibJSONBackend,
+    'simplejson': SimpleJSONBackend,
+    'orjson': OrjsonBackend,
+    'ujson': UjsonBackend,
+}
+
+
+def get_backend(backend):
+    # type: (Any) -> JSONBackend
+    """Return a JSON backend
+
+    :param backend: one of the names in ``BACKENDS`` (e.g. ``'orjson'``),
+        a ``JSONBackend`` instance, or a module implementing the
+        interface of the ``json`` module
+
+    :raises ValueError: if the backend name is unknown
+    :raises ImportError: if the library for a named backend is not
+        installed
+    """
+    if isinstance(backend, JSONBackend):
+        return backend
+    if isinstance(backend, _STRING_TYPES):
+        try:
+            backend_cls = BACKENDS[backend]
+        except KeyError:
+            raise ValueError(
+                'Unknown JSON backend %r. Available backends are: %s' % (
+                    backend, ', '.join(sorted(BACKENDS))
+                )
+            )
+        return backend_cls()
+    return ModuleBackend(backend)
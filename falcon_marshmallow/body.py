@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for sharing the request body between middlewares
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import io
+import logging
+import mmap
+import tempfile
+from typing import IO, Optional, Union
+
+# Third party
+from falcon import Request
+try:
+    from falcon.errors import HTTPPayloadTooLarge
+except ImportError:  # pragma: no cover
+    # Falcon < 1.4
+    from falcon.errors import (
+        HTTPRequestEntityTooLarge as HTTPPayloadTooLarge
+    )
+
+# Local
+from .streaming import DEFAULT_CHUNK_SIZE
+
+
+log = logging.getLogger(__name__)
+
+
+CONTENT_KEY = 'content'
+STREAM_KEY = 'content_stream'
+
+BodyContent = Union[bytes, mmap.mmap]
+
+
+class RewindableBody(io.RawIOBase):
+    """A seekable, read-only stream over an already-read request body
+
+    The body is held once, as the ``bytes`` object originally read from
+    the request (or the ``mmap`` of a spooled body), and exposed through
+    a ``memoryview``, so that slices may be taken with ``view()`` without
+    copying. Reading the whole of an in-memory body from the start
+    returns the original ``bytes`` object itself.
+    """
+
+    def __init__(self, data):
+        # type: (BodyContent) -> None
+        """Wrap the request body
+
+        :param data: the request body, as ``bytes`` or any other object
+            supporting the buffer protocol
+        """
+        io.RawIOBase.__init__(self)
+        self._data = data
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    @property
+    def is_exhausted(self):
+        # type: () -> bool
+        """Whether the stream has been read to the end"""
+        return self._pos >= len(self._view)
+
+    def exhaust(self):
+        # type: () -> None
+        """Move to the end of the stream"""
+        self._pos = len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # type: (int, int) -> int
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError('Invalid whence (%r)' % whence)
+        if pos < 0:
+            raise ValueError('Negative seek position %d' % pos)
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        # type: (Optional[int]) -> bytes
+        start = self._pos
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, start + size)
+        if start >= end:
+            return b''
+        self._pos = end
+        if (start == 0 and end == len(self._view) and
+                isinstance(self._data, bytes)):
+            return self._data
+        return self._view[start:end].tobytes()
+
+    def readall(self):
+        # type: () -> bytes
+        return self.read()
+
+    def readinto(self, buf):
+        # type: (Union[bytearray, memoryview]) -> int
+        chunk = self.view(self._pos, self._pos + len(buf))
+        size = len(chunk)
+        buf[:size] = chunk
+        self._pos += size
+        return size
+
+    def readline(self, size=-1):
+        # type: (Optional[int]) -> bytes
+        end = self._data.find(b'\n', self._pos)
+        end = len(self._view) if end < 0 else end + 1
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        return self.read(end - self._pos)
+
+    def getvalue(self):
+        # type: () -> BodyContent
+        """Return the underlying body object without copying it"""
+        return self._data
+
+    def view(self, start=0, stop=None):
+        # type: (int, Optional[int]) -> memoryview
+        """Return a zero-copy slice of the body
+
+        :param start: the index at which the slice starts
+        :param stop: the index at which the slice ends (default: the
+            end of the body)
+        """
+        return self._view[start:stop]
+
+
+class LimitedStream(io.RawIOBase):
+    """A request body stream which may not be read beyond a given size
+
+    Bodies sent without a Content-Length (i.e. with chunked transfer
+    encoding) cannot be rejected up front, since their size is only
+    known once they have been read. Reading more than ``max_size``
+    bytes from this stream raises a 413 instead, so that a client
+    cannot make a responder read an unbounded body into memory.
+    """
+
+    def __init__(self, stream, max_size):
+        # type: (IO, int) -> None
+        """Wrap a body stream
+
+        :param stream: the request's body stream
+        :param max_size: the maximum number of bytes which may be read
+        """
+        io.RawIOBase.__init__(self)
+        self._stream = stream
+        self.max_size = max_size
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        # type: (Optional[int]) -> bytes
+        if size is None or size < 0:
+            # Read one byte more than allowed, to tell whether the
+            # body is too large without reading all of it
+            size = self.max_size - self.bytes_read + 1
+        return self._count(self._stream.read(size))
+
+    def readall(self):
+        # type: () -> bytes
+        return self.read()
+
+    def readline(self, size=-1):
+        # type: (Optional[int]) -> bytes
+        limit = self.max_size - self.bytes_read + 1
+        if size is None or size < 0 or size > limit:
+            size = limit
+        return self._count(self._stream.readline(size))
+
+    def _count(self, data):
+        # type: (bytes) -> bytes
+        """Account for data read from the stream"""
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_size:
+            raise _too_large(self.max_size)
+        return data
+
+
+def check_content_length(req, max_size):
+    # type: (Request, Optional[int]) -> None
+    """Reject requests with a body larger than ``max_size`` bytes
+
+    The size of the body is as given by ``get_body_size``, i.e. the
+    size of the stashed body once it has been read (and e.g.
+    decompressed), and the Content-Length until then.
+
+    :param req: the request
+    :param max_size: the maximum body size in bytes, or ``None`` for
+        no limit
+
+    :raises HTTPPayloadTooLarge: if the body exceeds ``max_size``
+    """
+    if max_size is None:
+        return
+    size = get_body_size(req)
+    if size is not None and size > max_size:
+        raise _too_large(max_size)
+
+
+def get_body_size(req):
+    # type: (Request) -> Optional[int]
+    """Return the size of a request body in bytes, if it is known
+
+    If the body has been stashed, this is the size of the stashed body,
+    which differs from the Content-Length if a middleware decompressed
+    it. Otherwise, it is the Content-Length, or ``None`` if the request
+    has none.
+    """
+    content = req.context.get(CONTENT_KEY)
+    if content is None:
+        return req.content_length
+    return len(content)
+
+
+def get_max_body_size(resource, method, default=None):
+    # type: (object, str, Optional[int]) -> Optional[int]
+    """Return the maximum body size for a resource's requests
+
+    Resources may set a limit for requests with a given method, or for
+    all of their requests, e.g. with ``post_max_body`` or
+    ``max_body``, which takes precedence over the global ``default``
+    (in either direction, so that e.g. an upload endpoint may accept
+    larger bodies than the rest of the API).
+
+    :param resource: the resource handling the request
+    :param method: the (case-insensitive) HTTP method of the request
+    :param default: the limit for resources which do not set one, in
+        bytes, or ``None`` for no limit
+    """
+    for attr in ('%s_max_body' % method.lower(), 'max_body'):
+        max_size = getattr(resource, attr, None)
+        if max_size is not None:
+            return max_size
+    return default
+
+
+def limit_stream(req, max_size):
+    # type: (Request, Optional[int]) -> None
+    """Bound the body of a request without a Content-Length
+
+    ``req.stream`` is replaced with a ``LimitedStream``, so that reading
+    more than ``max_size`` bytes of the body raises a 413. If the stream
+    is already limited, the lower of the two limits applies. Requests
+    with a Content-Length, whose bodies Falcon already bounds, and
+    those whose body has been stashed, are left alone.
+
+    :param req: the request
+    :param max_size: the maximum body size in bytes, or ``None`` for
+        no limit
+    """
+    if (max_size is None or req.content_length is not None or
+            req.context.get(CONTENT_KEY) is not None):
+        return
+    stream = req.stream
+    if isinstance(stream, LimitedStream):
+        # Each middleware's limit applies, so the tightest one wins
+        stream.max_size = min(stream.max_size, max_size)
+        return
+    req.stream = LimitedStream(stream, max_size)
+
+
+def _too_large(max_size):
+    # type: (int) -> HTTPPayloadTooLarge
+    """Return the error for a body larger than ``max_size`` bytes"""
+    return HTTPPayloadTooLarge(
+        description=(
+            'The request body may not be larger than %d bytes.' % max_size
+        )
+    )
+
+
+def get_stashed_content(req, spool_threshold=None, max_size=None):
+    # type: (Request, Optional[int], Optional[int]) -> BodyContent
+    """
+    A helper to have multiple middlewares acting on data in the request
+    stream.
+
+    The first call reads the body from ``req.bounded_stream`` and stores
+    it on ``req.context``. Bodies with a Content-Length greater than
+    ``spool_threshold`` are not read into memory, but spooled to a
+    temporary file, which is memory-mapped; for those, the stashed
+    content is a read-only ``mmap`` rather than ``bytes``.
+
+    The body is also wrapped in a seekable ``RewindableBody``, which
+    replaces ``req.stream`` and ``req.bounded_stream``, so that later
+    middleware and responders may read the body again (after seeking
+    to the start) from the request itself, rather than getting ``EOF``
+    (``b''``).
+
+    Other middleware should nonetheless prefer this function, or
+    ``get_stashed_stream`` and ``get_stashed_view``, to reading the
+    stream directly, since the stream cannot be rewound until one of
+    them has been called.
+
+    :param req: the request
+    :param spool_threshold: the Content-Length, in bytes, above which
+        the body is spooled to disk, or ``None`` to always read the
+        body into memory
+    :param max_size: the maximum Content-Length, in bytes, or ``None``
+        for no limit. This is checked before any of the body is read.
+
+    :raises HTTPPayloadTooLarge: if the Content-Length of the request
+        exceeds ``max_size``
+    """
+    # This is the key which will hold the already-read content.
+    if req.context.get(CONTENT_KEY) is None:
+        check_content_length(req, max_size)
+        if (spool_threshold is not None and
+                (req.content_length or 0) > spool_threshold):
+            content = spool_to_mmap(req.bounded_stream)
+        else:
+            content = req.bounded_stream.read()
+        stash_content(req, content)
+
+    return req.context[CONTENT_KEY]
+
+
+def stash_content(req, content):
+    # type: (Request, BodyContent) -> None
+    """Stash a request body which has already been read
+
+    Middleware which reads (and e.g. decompresses) the body itself
+    should call this, so that ``get_stashed_content`` and the other
+    helpers return ``content`` rather than reading the body again.
+
+    :param req: the request
+    :param content: the request body
+    """
+    req.context[CONTENT_KEY] = content
+    if isinstance(content, (bytes, mmap.mmap)):
+        _install_stream(req, RewindableBody(content))
+
+
+def is_spooled(content):
+    # type: (object) -> bool
+    """Return whether stashed content was spooled to disk"""
+    return isinstance(content, mmap.mmap)
+
+
+def spool_to_mmap(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    # type: (IO, int) -> BodyContent
+    """Copy a stream to a temporary file and memory-map it
+
+    The temporary file is deleted once the returned map is closed or
+    garbage collected. An empty stream returns ``b''``, since empty
+    files cannot be mapped.
+
+    :param stream: the stream to read
+    :param chunk_size: the number of bytes to copy at a time
+    """
+    with tempfile.TemporaryFile() as spool:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.flush()
+        if not spool.tell():
+            return b''
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def get_stashed_stream(req):
+    # type: (Request) -> RewindableBody
+    """Return a rewound, seekable stream over the request body
+
+    The body is read and stashed with ``get_stashed_content`` first,
+    if that has not happened yet. The same stream is shared by all
+    callers, and is also available as ``req.stream``.
+    """
+    if req.context.get(STREAM_KEY) is None:
+        content = get_stashed_content(req)
+        if req.context.get(STREAM_KEY) is None:
+            # The body was stashed by something other than
+            # ``get_stashed_content``
+            _install_stream(req, RewindableBody(content))
+
+    stream = req.context[STREAM_KEY]
+    stream.seek(0)
+    return stream
+
+
+def get_stashed_view(req, start=0, stop=None):
+    # type: (Request, int, Optional[int]) -> memoryview
+    """Return a zero-copy slice of the request body
+
+    :param req: the request
+    :param start: the index at which the slice starts
+    :param stop: the index at which the slice ends (default: the end
+        of the body)
+    """
+    return get_stashed_stream(req).view(start, stop)
+
+
+def _install_stream(req, stream):
+    # type: (Request, RewindableBody) -> None
+    """Make a stream the request's body stream"""
+    req.context[STREAM_KEY] = stream
+    req.stream = stream
+    if hasattr(req, '_bounded_stream'):
+        # Falcon wraps ``req.stream`` lazily; we have already consumed
+        # the original wrapper, so replace it as well
+        req._bounded_stream = stream
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Caching of serialized responses
+
+Many GET results are the same objects serialized over and over. A
+``ResponseCache`` keeps the serialized bodies of such results, keyed
+on the schema which dumped them and a key provided by the responder,
+typically identifying the object and its version. Entries are evicted
+least recently used first once the cache is full, and after an
+optional time to live.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Type, Union
+
+# Third party
+from marshmallow import Schema
+
+
+log = logging.getLogger(__name__)
+
+
+#: The default maximum number of cached responses
+DEFAULT_CACHE_SIZE = 1024
+
+
+_timer = getattr(time, 'monotonic', time.time)  # type: Callable[[], float]
+
+
+class ResponseCache:
+    """A thread-safe LRU cache of serialized responses
+
+    Entries are keyed on ``(schema, key)``, where ``schema`` is the
+    schema used to serialize the result (or ``None`` if it was
+    serialized without one) and ``key`` is any hashable value provided
+    by the responder. Keys should change whenever the result does (e.g.
+    by including an object's version), or the entries for a key should
+    be invalidated after writes. Different representations of the same
+    result (e.g. in different media types) are cached separately, as
+    variants of the same entry.
+    """
+
+    def __init__(self,
+                 max_size=DEFAULT_CACHE_SIZE,  # type: int
+                 ttl=None,  # type: Optional[float]
+                 timer=_timer,  # type: Callable[[], float]
+                 ):
+        # type: (...) -> None
+        """Instantiate the cache
+
+        :param max_size: the maximum number of responses to keep. Once
+            the cache is full, the least recently used response is
+            evicted to make room for a new one.
+        :param ttl: the number of seconds for which responses are kept,
+            or ``None`` to keep them until they are evicted
+        :param timer: the clock against which the ``ttl`` is measured
+        """
+        log.debug('ResponseCache.__init__(%s, %s, %s)', max_size, ttl, timer)
+        if max_size < 1:
+            raise ValueError(
+                'The cache size must be positive, not %r' % max_size
+            )
+        self.max_size = max_size
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        # (schema, key, variant) -> (expiry, data), least recently used
+        # first
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+        self._expired = 0
+
+    def get(self, schema, key, variant=None):
+        # type: (Optional[Schema], Hashable, Hashable) -> Optional[Any]
+        """Return a cached response, or ``None`` if there is none"""
+        with self._lock:
+            entry = self._entries.pop((schema, key, variant), None)
+            if entry is None:
+                self._misses += 1
+                return None
+            expiry, data = entry
+            if expiry is not None and expiry <= self._timer():
+                self._expired += 1
+                self._misses += 1
+                return None
+            # Re-insert the entry as the most recently used
+            self._entries[(schema, key, variant)] = entry
+            self._hits += 1
+            return data
+
+    def set(self, schema, key, data, variant=None):
+        # type: (Optional[Schema], Hashable, Any, Hashable) -> None
+        """Cache a serialized response
+
+        :param schema: the schema with which the response was serialized
+        :param key: the key provided by the responder
+        :param data: the serialized response
+        :param variant: what distinguishes this representation from
+            others of the same result (e.g. its media type), if any
+        """
+        expiry = None if self.ttl is None else self._timer() + self.ttl
+        with self._lock:
+            self._entries.pop((schema, key, variant), None)
+            self._entries[(schema, key, variant)] = (expiry, data)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evicted += 1
+
+    def invalidate(self,
+                   key=None,  # type: Optional[Hashable]
+                   schema=None,  # type: Optional[Union[Schema, Type[Schema]]]
+                   ):
+        # type: (...) -> None
+        """Drop cached responses
+
+        Responders should call this after writing to an object whose
+        cache key does not change with its version.
+
+        :param key: if provided, only drop responses cached under this
+            key, in all their variants
+        :param schema: if provided, only drop responses serialized with
+            a schema of this class (or of the class of this schema),
+            including copies of it, such as those derived for sparse
+            fieldsets or pooled for concurrent use
+        """
+        log.debug('ResponseCache.invalidate(%s, %s)', key, schema)
+        if schema is not None and not isinstance(schema, type):
+            schema = type(schema)
+        with self._lock:
+            if key is None and schema is None:
+                self._entries.clear()
+                return
+            for entry in list(self._entries):
+                entry_schema, entry_key, _ = entry
+                if ((key is None or entry_key == key) and
+                        (schema is None or
+                         isinstance(entry_schema, schema))):
+                    del self._entries[entry]
+
+    def stats(self):
+        # type: () -> Dict[str, int]
+        """Return counters describing the use of the cache
+
+        * ``hits``: lookups served from the cache
+        * ``misses``: lookups which found no live entry
+        * ``evicted``: entries dropped because the cache was full
+        * ``expired``: entries dropped because their ``ttl`` had passed
+        * ``size``: entries currently cached
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evicted': self._evicted,
+                'expired': self._expired,
+                'size': len(self._entries),
+            }
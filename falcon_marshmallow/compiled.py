@@ -0,0 +1,727 @@
+# -*- coding: utf-8 -*-
+"""
+Code-generated (de)serializers for Marshmallow schemas
+
+Marshmallow's generic machinery does a fair amount of work per field
+and per object: field lookups go through several layers of accessors,
+and every value is passed through ``Field.serialize`` or
+``Field.deserialize``. For schemas made up of simple fields, the
+functions generated here fetch, check, and convert each value inline,
+falling back to the field's own methods for any field type that is not
+supported.
+
+Any object which the generated code cannot handle (including anything
+that would produce errors) is passed to the schema itself, so results
+and errors are always those of Marshmallow.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import logging
+import threading
+from collections import OrderedDict
+from types import CodeType
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Third party
+from marshmallow import fields, Schema
+from marshmallow.utils import ensure_text_type, get_value, missing, set_value
+
+
+log = logging.getLogger(__name__)
+
+
+#: The number of dumps to double-check against ``Schema.dump`` before
+#: trusting a compiled serializer
+DEFAULT_VERIFY_COUNT = 1
+#: The maximum number of generated code objects kept for reuse
+CODE_CACHE_SIZE = 512
+
+_TEXT_TYPE = type('')
+
+# The attributes of a schema holding its compiled functions, as
+# ``(signature, compiled or False)``. Keeping them on the schema itself
+# means that they are dropped along with it.
+_SERIALIZER_ATTR = '_compiled_serializer'
+_LOADER_ATTR = '_compiled_loader'
+
+# (schema class, generated source) -> code object, least recently used
+# first. Instances of a schema with the same configuration (e.g. pooled
+# clones) generate the same source, which is then only compiled once.
+_code = OrderedDict()  # type: OrderedDict
+_code_lock = threading.Lock()
+
+
+class _FallbackError(Exception):
+    """Raised by generated code for input it does not handle"""
+
+
+def _fail():
+    """Raise a ``_FallbackError`` from within an expression"""
+    raise _FallbackError()
+
+
+def _validated(field, value):
+    # type: (fields.Field, Any) -> Any
+    """Run a field's validators from within an expression"""
+    field._validate(value)
+    return value
+
+
+class _Compiled:
+    """Base class for generated stand-ins for schema methods"""
+
+    def __init__(self, schema, func, source,
+                 verify_count=DEFAULT_VERIFY_COUNT):
+        # type: (Schema, Callable[[Any], dict], str, int) -> None
+        """Instantiate the compiled function
+
+        :param schema: the schema from which the function was generated
+        :param func: the generated function, which handles a single
+            object or raises if it cannot
+        :param source: the source code of the generated function
+        :param verify_count: the number of calls for which to compare
+            results with those of the schema. If any differ, the
+            compiled function disables itself and defers to the schema.
+        """
+        self.schema = schema
+        self.func = func
+        self.source = source
+        self.disabled = False
+        self._verify_remaining = verify_count
+
+    def __repr__(self):
+        return '<%s for %r>' % (self.__class__.__name__, self.schema)
+
+    def _checked(self, result, reference):
+        # type: (Any, Callable[[], Tuple[Any, dict]]) -> Tuple[Any, dict]
+        """Return ``(result, {})``, checking it against the schema
+
+        While verifying, ``reference`` is called to get the schema's
+        own result, which is returned instead if it differs.
+        """
+        if self._verify_remaining <= 0:
+            return result, {}
+
+        self._verify_remaining -= 1
+        expected, errors = reference()
+        if errors or expected != result:
+            log.warning(
+                '%r output does not match that of the schema; falling '
+                'back to the schema', self
+            )
+            self.disabled = True
+            return expected, errors
+        return result, {}
+
+
+class CompiledSerializer(_Compiled):
+    """A generated serializer standing in for ``Schema.dump``"""
+
+    def __init__(self, schema, dump_one, source,
+                 verify_count=DEFAULT_VERIFY_COUNT):
+        # type: (Schema, Callable[[Any], dict], str, int) -> None
+        _Compiled.__init__(self, schema, dump_one, source, verify_count)
+        self.dump_one = dump_one
+
+    def dump(self, obj, many=None):
+        # type: (Any, Optional[bool]) -> Tuple[Any, dict]
+        """Serialize an object, returning ``(data, errors)``
+
+        This has the same semantics as ``Schema.dump``.
+        """
+        sch = self.schema
+        many = sch.many if many is None else bool(many)
+        if many and not isinstance(obj, (list, tuple)) and obj is not None:
+            # Like Schema.dump, and so that we may verify the result
+            obj = list(obj)
+
+        if self.disabled or obj is None:
+            return sch.dump(obj, many=many)
+
+        dump_one = self.dump_one
+        try:
+            if many:
+                data = [dump_one(each) for each in obj]
+            else:
+                data = dump_one(obj)
+        except Exception:
+            # Let marshmallow produce the error messages (or succeed
+            # where we could not)
+            return sch.dump(obj, many=many)
+
+        return self._checked(data, lambda: sch.dump(obj, many=many))
+
+
+class CompiledLoader(_Compiled):
+    """A generated loader standing in for ``Schema.load``"""
+
+    def __init__(self, schema, load_one, source,
+                 verify_count=DEFAULT_VERIFY_COUNT):
+        # type: (Schema, Callable[[Any], dict], str, int) -> None
+        _Compiled.__init__(self, schema, load_one, source, verify_count)
+        self.load_one = load_one
+
+    def load(self, data, many=None, partial=None):
+        # type: (Any, Optional[bool], Any) -> Tuple[Any, dict]
+        """Deserialize and validate data, returning ``(data, errors)``
+
+        This has the same semantics as ``Schema.load``. Partial loading
+        is always left to the schema.
+        """
+        sch = self.schema
+        many = sch.many if many is None else bool(many)
+        if partial is None:
+            partial = sch.partial
+
+        if self.disabled or partial or not isinstance(data, (dict, list)):
+            return sch.load(data, many=many, partial=partial)
+
+        load_one = self.load_one
+        try:
+            if many:
+                if type(data) is not list:
+                    raise _FallbackError()
+                result = [load_one(each) for each in data]
+            else:
+                result = load_one(data)
+        except Exception:
+            # Let marshmallow produce the error messages
+            return sch.load(data, many=many, partial=partial)
+
+        return self._checked(
+            result, lambda: sch.load(data, many=many, partial=partial)
+        )
+
+
+def get_compiled_serializer(schema, verify_count=DEFAULT_VERIFY_COUNT):
+    # type: (Schema, int) -> Optional[CompiledSerializer]
+    """Return a compiled serializer for a schema, or None
+
+    Serializers are generated once per schema instance and cached for
+    as long as the schema exists, or until its configuration (e.g. its
+    fields, ``only`` or ``exclude``) changes. The generated code is
+    shared by instances of the same class with the same configuration,
+    such as clones. ``None`` is returned for schemas that cannot be
+    compiled, e.g. because they have pre- or post-dump processors,
+    implicit fields, or a custom ``get_attribute``.
+
+    :param schema: an instantiated Marshmallow schema
+    :param verify_count: the number of dumps for which a newly compiled
+        serializer double-checks its results against ``schema.dump``
+    """
+    return _get_compiled(
+        _SERIALIZER_ATTR, _SerializerBuilder, CompiledSerializer, schema,
+        verify_count
+    )
+
+
+def get_compiled_loader(schema, verify_count=DEFAULT_VERIFY_COUNT):
+    # type: (Schema, int) -> Optional[CompiledLoader]
+    """Return a compiled loader for a schema, or None
+
+    Loaders are generated and cached as serializers are (see
+    ``get_compiled_serializer``). ``None`` is returned for schemas that
+    cannot be compiled, e.g. because they have pre- or post-load
+    processors, validation methods, or implicit fields.
+
+    :param schema: an instantiated Marshmallow schema
+    :param verify_count: the number of loads for which a newly compiled
+        loader double-checks its results against ``schema.load``
+    """
+    return _get_compiled(
+        _LOADER_ATTR, _LoaderBuilder, CompiledLoader, schema, verify_count
+    )
+
+
+def _get_compiled(attr, builder_cls, compiled_cls, schema, verify_count):
+    # type: (str, type, type, Schema, int) -> Any
+    """Return a cached compiled function, compiling it if necessary
+
+    Functions compiled for a schema whose configuration has changed
+    since are compiled (and so verified) again.
+    """
+    signature = _signature(schema)
+    cached = schema.__dict__.get(attr)
+    if cached is not None and cached[0] == signature:
+        return cached[1] or None
+
+    result = None
+    try:
+        result = _compile(builder_cls, compiled_cls, schema, verify_count)
+    except Exception:
+        log.exception('Could not compile %s for %r', builder_cls, schema)
+
+    setattr(schema, attr, (signature, result or False))
+    return result
+
+
+def _signature(schema):
+    # type: (Schema) -> Hashable
+    """Return what the functions compiled for a schema depend on
+
+    This identifies the schema instance, since copies of it (which
+    copy its attributes) have functions of their own, and the options
+    and fields which the generated code relies on.
+    """
+    return (
+        id(schema),
+        None if schema.only is None else tuple(schema.only),
+        tuple(schema.exclude),
+        schema.prefix,
+        schema.dict_class,
+        tuple((name, id(field)) for name, field in schema.fields.items()),
+    )
+
+
+def _is_compilable(schema):
+    # type: (Schema) -> bool
+    """Return whether the behavior of a schema can be generated"""
+    return bool(
+        not getattr(schema, '_has_processors', True) and
+        not schema.opts.fields and
+        not schema.opts.additional and
+        type(schema).get_attribute is Schema.get_attribute and
+        getattr(schema, '__accessor__', None) is None
+    )
+
+
+def _compile(builder_cls, compiled_cls, schema, verify_count,
+             _compiling=None):
+    # type: (type, type, Schema, int, Optional[set]) -> Optional[_Compiled]
+    """Generate a function for a schema"""
+    if not _is_compilable(schema):
+        log.debug('Schema %r cannot be compiled', schema)
+        return None
+
+    builder = builder_cls(
+        schema, set() if _compiling is None else _compiling
+    )
+    source = builder.build()
+    namespace = dict(builder.namespace)
+    exec(_get_code(schema, builder.name, source), namespace)
+    return compiled_cls(
+        schema, namespace[builder.name], source, verify_count
+    )
+
+
+def _get_code(schema, name, source):
+    # type: (Schema, str, str) -> CodeType
+    """Return the compiled code of generated source for a schema
+
+    The code only depends on the source, which is the same for all
+    instances of a schema with the same configuration, while the
+    fields each instance's functions use are bound in their namespace.
+    """
+    key = (type(schema), source)
+    with _code_lock:
+        code = _code.pop(key, None)
+        if code is not None:
+            # Re-insert the code as the most recently used
+            _code[key] = code
+            return code
+
+    code = compile(source, '<%r %s>' % (schema, name), 'exec')
+    log.debug('Compiled %s for %r:\n%s', name, schema, source)
+    with _code_lock:
+        _code[key] = code
+        while len(_code) > CODE_CACHE_SIZE:
+            _code.popitem(last=False)
+    return code
+
+
+class _Builder:
+    """Base class for generating the source of functions for a schema"""
+
+    #: The name of the generated function
+    name = ''
+
+    def __init__(self, schema, compiling):
+        # type: (Schema, set) -> None
+        """Instantiate the builder
+
+        :param schema: the schema for which to generate code
+        :param compiling: the classes of the schemas currently being
+            compiled, which is used to detect self-nesting schemas
+        """
+        self.schema = schema
+        self.compiling = compiling
+        self.namespace = {
+            'FAIL': _fail,
+            'FALLBACK': _FallbackError,
+            'MISSING': missing,
+            'TEXT_TYPE': _TEXT_TYPE,
+            'ensure_text_type': ensure_text_type,
+            'get_value': get_value,
+            'set_value': set_value,
+            'validated': _validated,
+        }  # type: Dict[str, Any]
+
+    def bind(self, value, prefix):
+        # type: (Any, str) -> str
+        """Make a value available to the generated code by name"""
+        name = '%s_%d' % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def build(self):
+        # type: () -> str
+        """Return the source of the generated function"""
+        self.compiling.add(type(self.schema))
+        try:
+            return '\n'.join(self._build())
+        finally:
+            self.compiling.discard(type(self.schema))
+
+    def _build(self):
+        # type: () -> list
+        """Return the lines of the generated source"""
+        raise NotImplementedError
+
+    def _nested(self, field, builder_cls, compiled_cls):
+        # type: (fields.Nested, type, type) -> Optional[str]
+        """Compile the schema of a nested field, returning its name"""
+        if isinstance(field.only, (type(''), bytes)):
+            # Plucked values
+            return None
+        nested = field.schema
+        if type(nested) in self.compiling:
+            # Self-referential schema, which would recurse forever
+            return None
+        compiled = _compile(
+            builder_cls, compiled_cls, nested, 0, self.compiling
+        )
+        if compiled is None:
+            return None
+        return self.bind(compiled.func, 'NESTED')
+
+
+class _SerializerBuilder(_Builder):
+    """Generate the source of a serializer for a schema"""
+
+    name = 'dump_one'
+
+    def _build(self):
+        # type: () -> list
+        lines = [
+            'def dump_one(obj):',
+            '    if type(obj) is dict:',
+            '        return dump_dict(obj)',
+            "    if not hasattr(obj, '__getitem__'):",
+            '        return dump_attrs(obj)',
+            '    return dump_generic(obj)',
+            '',
+        ]
+        for mode in ('dict', 'attrs', 'generic'):
+            lines.extend(self._build_function(mode))
+            lines.append('')
+        return lines
+
+    def _build_function(self, mode):
+        # type: (str) -> list
+        """Return the lines of a dump function for one access mode
+
+        ``dict`` functions handle exact dicts, ``attrs`` functions handle
+        objects without ``__getitem__``, and ``generic`` functions handle
+        anything else, using Marshmallow's own accessor.
+        """
+        sch = self.schema
+        if sch.dict_class is dict:
+            lines = ['def dump_%s(obj):' % mode, '    out = {}']
+        else:
+            lines = [
+                'def dump_%s(obj):' % mode,
+                '    out = %s()' % self.bind(sch.dict_class, 'DICT_CLASS'),
+            ]
+
+        for name, field in sch.fields.items():
+            if getattr(field, 'load_only', False):
+                continue
+            key = (sch.prefix or '') + (field.dump_to or name)
+            lines.extend(
+                '    ' + line for line in self._build_field(
+                    mode, name, key, field
+                )
+            )
+
+        if sch.extra:
+            lines.append('    out.update(%s)' % self.bind(sch.extra, 'EXTRA'))
+        lines.append('    return out')
+        return lines
+
+    def _build_field(self, mode, name, key, field):
+        # type: (str, str, str, fields.Field) -> list
+        """Return the lines that serialize one field into ``out``"""
+        field_var = self.bind(field, 'FIELD')
+        key_lit = repr(key)
+        name_lit = repr(name)
+
+        if not self._is_fast_accessible(field):
+            # Let the field do everything
+            return [
+                'v = %s.serialize(%s, obj, accessor=get_value)' % (
+                    field_var, name_lit
+                ),
+                'if v is not MISSING:',
+                '    out[%s] = v' % key_lit,
+            ]
+
+        attr = field.attribute or name
+        attr_lit = repr(attr)
+        if mode == 'generic' or '.' in attr:
+            lines = ['v = get_value(%s, obj, MISSING)' % attr_lit]
+        elif mode == 'dict':
+            lines = [
+                'v = obj.get(%s, MISSING)' % attr_lit,
+                'if v is MISSING:',
+                '    v = get_value(%s, obj, MISSING)' % attr_lit,
+            ]
+        else:
+            lines = [
+                'v = getattr(obj, %s, MISSING)' % attr_lit,
+                'if v is not MISSING and callable(v):',
+                '    v = v()',
+            ]
+
+        conversion = self._conversion(field, field_var, name_lit, 'v', 0)
+        lines.extend([
+            'if v is not MISSING:',
+            '    out[%s] = %s' % (key_lit, conversion),
+        ])
+
+        default = getattr(field, 'default', missing)
+        if default is not missing:
+            default_var = self.bind(default, 'DEFAULT')
+            lines.extend([
+                'else:',
+                '    out[%s] = %s%s' % (
+                    key_lit, default_var, '()' if callable(default) else ''
+                ),
+            ])
+        return lines
+
+    @staticmethod
+    def _is_fast_accessible(field):
+        # type: (fields.Field) -> bool
+        """Whether values for a field may be fetched by the generated code
+
+        This is the case if the field uses the stock ``serialize`` and
+        ``get_value`` implementations (or equivalents).
+        """
+        field_cls = type(field)
+        if not field._CHECK_ATTRIBUTE:
+            return False
+        if field_cls.serialize is not fields.Field.serialize:
+            return False
+        if field_cls.get_value is fields.Field.get_value:
+            return True
+        return (
+            isinstance(field, fields.List) and
+            field_cls.get_value is fields.List.get_value and
+            not field.container.attribute
+        )
+
+    def _conversion(self, field, field_var, name_lit, var, depth):
+        # type: (fields.Field, str, str, str, int) -> str
+        """Return an expression serializing ``var`` like ``field``"""
+        field_cls = type(field)
+        fallback = '%s._serialize(%s, %s, obj)' % (field_var, var, name_lit)
+
+        if field_cls in (fields.Field, fields.Raw):
+            return var
+
+        if field_cls is fields.String:
+            return (
+                '({v} if type({v}) is TEXT_TYPE else '
+                'ensure_text_type({v}) if {v} is not None else None)'
+            ).format(v=var)
+
+        if field_cls in (fields.Integer, fields.Float):
+            num = self.bind(field.num_type, 'NUM')
+            if field.as_string:
+                return '(str({n}({v})) if {v} is not None else None)'.format(
+                    n=num, v=var
+                )
+            return (
+                '({v} if type({v}) is {n} else '
+                '{n}({v}) if {v} is not None else None)'
+            ).format(n=num, v=var)
+
+        if field_cls is fields.Boolean:
+            return '({v} if {v} is True or {v} is False else {f})'.format(
+                v=var, f=fallback
+            )
+
+        if field_cls is fields.Date:
+            return '({v}.isoformat() if {v} is not None else None)'.format(
+                v=var
+            )
+
+        if field_cls is fields.List and not field.container.attribute:
+            item_var = 'x%d' % depth
+            container_var = self.bind(field.container, 'FIELD')
+            item = self._conversion(
+                field.container, container_var, name_lit, item_var, depth + 1
+            )
+            return (
+                '(None if {v} is None else '
+                '[{item} for {x} in {v}] if type({v}) in (list, tuple) '
+                'else {fallback})'
+            ).format(v=var, item=item, x=item_var, fallback=fallback)
+
+        if field_cls is fields.Nested:
+            nested_dump = self._nested(
+                field, _SerializerBuilder, CompiledSerializer
+            )
+            if nested_dump is not None:
+                if field.many:
+                    return (
+                        '(None if {v} is None else '
+                        '[{d}(x) for x in {v}])'
+                    ).format(v=var, d=nested_dump)
+                return '(None if {v} is None else {d}({v}))'.format(
+                    v=var, d=nested_dump
+                )
+
+        return fallback
+
+
+class _LoaderBuilder(_Builder):
+    """Generate the source of a loader for a schema"""
+
+    name = 'load_one'
+
+    def _build(self):
+        # type: () -> list
+        sch = self.schema
+        lines = [
+            'def load_one(data):',
+            '    if type(data) is not dict:',
+            '        raise FALLBACK()',
+            '    out = {}' if sch.dict_class is dict else
+            '    out = %s()' % self.bind(sch.dict_class, 'DICT_CLASS'),
+        ]
+        for name, field in sch.fields.items():
+            if getattr(field, 'dump_only', False):
+                continue
+            lines.extend(
+                '    ' + line for line in self._build_field(name, field)
+            )
+        lines.append('    return out')
+        return lines
+
+    def _build_field(self, name, field):
+        # type: (str, fields.Field) -> list
+        """Return the lines that deserialize one field into ``out``"""
+        field_var = self.bind(field, 'FIELD')
+        key = field.attribute or name
+        source = field.load_from or name
+
+        lines = ['v = data.get(%r, MISSING)' % name]
+        if field.load_from:
+            lines.extend([
+                'if v is MISSING:',
+                '    v = data.get(%r, MISSING)' % field.load_from,
+            ])
+        if field.missing is not missing:
+            lines.extend([
+                'if v is MISSING:',
+                '    v = %s%s' % (
+                    self.bind(field.missing, 'MISS'),
+                    '()' if callable(field.missing) else ''
+                ),
+            ])
+
+        if '.' in key:
+            store = 'set_value(out, %r, %%s)' % key
+        else:
+            store = 'out[%r] = %%s' % key
+
+        lines.append('if v is not MISSING:')
+        if type(field).deserialize is not fields.Field.deserialize:
+            # Let the field do everything
+            lines.append('    ' + store % '%s.deserialize(v, %r, data)' % (
+                field_var, source
+            ))
+        else:
+            conversion = self._conversion(field, field_var, source, 'v', 0)
+            if field.validators:
+                conversion = 'validated(%s, %s)' % (field_var, conversion)
+            lines.extend([
+                '    if v is None:',
+                '        ' + (
+                    store % 'None' if field.allow_none is True
+                    else 'raise FALLBACK()'
+                ),
+                '    else:',
+                '        ' + store % conversion,
+            ])
+        if field.required:
+            lines.extend(['else:', '    raise FALLBACK()'])
+        return lines
+
+    def _item(self, field, field_var, source, var, depth):
+        # type: (fields.Field, str, str, str, int) -> str
+        """Return an expression deserializing ``var`` like ``field``
+
+        Unlike ``_conversion``, this also handles ``None`` and runs the
+        field's validators, as ``Field.deserialize`` does.
+        """
+        if type(field).deserialize is not fields.Field.deserialize:
+            return '%s.deserialize(%s)' % (field_var, var)
+        conversion = self._conversion(field, field_var, source, var, depth)
+        if field.validators:
+            conversion = 'validated(%s, %s)' % (field_var, conversion)
+        return '({c} if {v} is not None else {none})'.format(
+            c=conversion, v=var,
+            none='None' if field.allow_none is True else 'FAIL()'
+        )
+
+    def _conversion(self, field, field_var, source, var, depth):
+        # type: (fields.Field, str, str, str, int) -> str
+        """Return an expression deserializing a non-null ``var``"""
+        field_cls = type(field)
+        fallback = '%s._deserialize(%s, %r, data)' % (field_var, var, source)
+
+        if field_cls in (fields.Field, fields.Raw):
+            return var
+
+        if field_cls is fields.String:
+            return '({v} if type({v}) is TEXT_TYPE else {f})'.format(
+                v=var, f=fallback
+            )
+
+        if field_cls in (fields.Integer, fields.Float):
+            return '({v} if type({v}) is {n} else {f})'.format(
+                v=var, n=self.bind(field.num_type, 'NUM'), f=fallback
+            )
+
+        if (field_cls is fields.Boolean and True in field.truthy and
+                False in field.falsy):
+            return (
+                '({v} if {v} is True or {v} is False else {f})'
+            ).format(v=var, f=fallback)
+
+        if field_cls is fields.List:
+            item_var = 'x%d' % depth
+            item = self._item(
+                field.container, self.bind(field.container, 'FIELD'),
+                source, item_var, depth + 1
+            )
+            return (
+                '([{item} for {x} in {v}] if type({v}) is list else {f})'
+            ).format(v=var, item=item, x=item_var, f=fallback)
+
+        if field_cls is fields.Nested and not field.schema.partial:
+            nested_load = self._nested(field, _LoaderBuilder, CompiledLoader)
+            if nested_load is not None:
+                if field.many:
+                    return (
+                        '([{n}(x) for x in {v}] if type({v}) is list '
+                        'else FAIL())'
+                    ).format(v=var, n=nested_load)
+                return '%s(%s)' % (nested_load, var)
+
+        return fallback
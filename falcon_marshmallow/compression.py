@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for compressing responses and decompressing requests
+
+Responses are compressed with one of the content codings accepted by the
+client, as negotiated from its ``Accept-Encoding`` header. Request
+bodies sent with a ``Content-Encoding`` are decompressed incrementally,
+so that a small compressed body which expands to an enormous one (a
+"decompression bomb") is rejected as soon as it exceeds a limit, rather
+than after it has filled memory.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import logging
+import mmap
+import tempfile
+import zlib
+from typing import IO, Iterable, Iterator, List, Optional, Sequence
+
+# Third party
+from falcon.errors import HTTPBadRequest, HTTPUnsupportedMediaType
+try:
+    from falcon.errors import HTTPPayloadTooLarge
+except ImportError:  # pragma: no cover
+    # Falcon < 1.4
+    from falcon.errors import (
+        HTTPRequestEntityTooLarge as HTTPPayloadTooLarge
+    )
+
+# Local
+from .body import BodyContent
+from .streaming import DEFAULT_CHUNK_SIZE
+
+
+log = logging.getLogger(__name__)
+
+
+#: Responses smaller than this many bytes are not compressed by default
+DEFAULT_MIN_SIZE = 1024
+#: The default zlib compression level, trading speed for size
+DEFAULT_LEVEL = 6
+#: The default maximum size, in bytes, of decompressed request bodies
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+#: The content codings used for responses, by order of preference
+DEFAULT_ENCODINGS = ('gzip', 'deflate')
+
+# Content coding -> zlib ``wbits`` selecting its container format
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+# Content codings whose bodies may be several concatenated streams
+_MULTI_MEMBER = frozenset(('gzip', 'x-gzip'))
+
+
+def choose_encoding(header, encodings=DEFAULT_ENCODINGS):
+    # type: (Optional[str], Sequence[str]) -> Optional[str]
+    """Return the content coding to use for a response, if any
+
+    The coding with the highest quality value in the ``Accept-Encoding``
+    header is chosen, ties being broken by the order of ``encodings``.
+    Codings with a quality value of 0 are never chosen, and a wildcard
+    applies to any coding not listed explicitly.
+
+    :param header: the value of the Accept-Encoding header, if any
+    :param encodings: the supported content codings, by order of
+        preference
+
+    :return: the chosen content coding, or ``None`` if the response
+        should not be compressed
+    """
+    if not header:
+        return None
+    qualities = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            qualities[name] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level=DEFAULT_LEVEL):
+    # type: (bytes, str, int) -> bytes
+    """Compress a response body with a content coding"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level=DEFAULT_LEVEL):
+    # type: (Iterable[bytes], str, int) -> Iterator[bytes]
+    """Compress a streamed response body with a content coding
+
+    Chunks are compressed as they are produced, and only non-empty
+    compressed chunks are yielded, so that the whole body is never held
+    in memory.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def decompress_stream(stream,  # type: IO
+                      encoding,  # type: str
+                      max_size=DEFAULT_MAX_SIZE,  # type: Optional[int]
+                      chunk_size=DEFAULT_CHUNK_SIZE,  # type: int
+                      spool_threshold=None,  # type: Optional[int]
+                      ):
+    # type: (...) -> BodyContent
+    """Read and decompress a request body with a content coding
+
+    The body is decompressed ``chunk_size`` bytes at a time, and never
+    more than one byte past ``max_size`` is decompressed. As with the
+    ``gzip`` module, gzip bodies made of several members are
+    decompressed to the concatenation of the members.
+
+    :param stream: the request body stream
+    :param encoding: the request's content coding
+    :param max_size: the maximum size of the decompressed body, in
+        bytes, or ``None`` for no limit
+    :param chunk_size: the number of bytes to read at a time
+    :param spool_threshold: the decompressed size, in bytes, above
+        which the body is spooled to a memory-mapped temporary file
+        rather than held in memory, or ``None`` to never spool it
+
+    :raises HTTPUnsupportedMediaType: if the content coding is not
+        supported
+    :raises HTTPBadRequest: if the body is not validly encoded, is
+        truncated, or has data past the end of a deflate stream
+    :raises HTTPPayloadTooLarge: if the decompressed body exceeds
+        ``max_size``
+    """
+    parts = []  # type: List[bytes]
+    size = 0
+    spool = None  # type: Optional[IO]
+    try:
+        for part in _iter_decompressed(
+                stream, encoding, max_size, chunk_size):
+            size += len(part)
+            if (spool is None and spool_threshold is not None and
+                    size > spool_threshold):
+                spool = tempfile.TemporaryFile()
+                spool.writelines(parts)
+                parts = []
+            if spool is None:
+                parts.append(part)
+            else:
+                spool.write(part)
+        if spool is None:
+            return b''.join(parts)
+        spool.flush()
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        # The map, if any, keeps the file's contents alive
+        if spool is not None:
+            spool.close()
+
+
+def _iter_decompressed(stream, encoding, max_size, chunk_size):
+    # type: (IO, str, Optional[int], int) -> Iterator[bytes]
+    """Yield the decompressed parts of a request body
+
+    See ``decompress_stream`` for the parameters and errors.
+    """
+    if encoding not in _WBITS:
+        raise HTTPUnsupportedMediaType(
+            description=(
+                'Unsupported Content-Encoding %r. Supported encodings '
+                'are: %s.' % (encoding, ', '.join(sorted(_WBITS)))
+            )
+        )
+    wbits = _WBITS[encoding]
+    decompressor = zlib.decompressobj(wbits)
+    size = 0
+    try:
+        while True:
+            pending = stream.read(chunk_size)
+            if not pending:
+                break
+            while pending:
+                limit = 0 if max_size is None else max_size - size + 1
+                part = decompressor.decompress(pending, limit)
+                size += len(part)
+                _check_size(size, max_size)
+                yield part
+                pending = decompressor.unconsumed_tail
+                if decompressor.unused_data:
+                    # There is data past the end of the stream, which
+                    # may only be another member of a gzip body
+                    if encoding not in _MULTI_MEMBER:
+                        raise HTTPBadRequest(
+                            description='Body has data past the end of '
+                                        'its %s stream' % encoding
+                        )
+                    pending = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits)
+        part = decompressor.flush()
+    except zlib.error as exc:
+        raise HTTPBadRequest(
+            description='Body was not validly %s-encoded: %s' % (
+                encoding, exc
+            )
+        )
+    if not getattr(decompressor, 'eof', True):
+        raise HTTPBadRequest(
+            description='Body was truncated before the end of its %s '
+                        'stream' % encoding
+        )
+    _check_size(size + len(part), max_size)
+    yield part
+
+
+def _check_size(size, max_size):
+    # type: (int, Optional[int]) -> None
+    """Reject decompressed bodies larger than ``max_size`` bytes"""
+    if max_size is not None and size > max_size:
+        raise HTTPPayloadTooLarge(
+            description=(
+                'The decompressed request body may not be larger than '
+                '%d bytes.' % max_size
+            )
+        )
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for entity tags and conditional requests
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import hashlib
+from typing import List, Optional, Union
+
+
+def make_etag(data):
+    # type: (Union[bytes, str]) -> str
+    """Return a strong, quoted entity tag for a representation
+
+    :param data: the serialized representation, or any other value
+        identifying its version
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return '"%s"' % hashlib.sha1(data).hexdigest()
+
+
+def parse_etags(header):
+    # type: (Optional[str]) -> List[str]
+    """Return the opaque tags listed in an If-None-Match header
+
+    Weakness indicators are dropped, since If-None-Match uses the weak
+    comparison function. A wildcard is returned as ``'*'``.
+    """
+    if not header:
+        return []
+    tags = []
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag:
+            tags.append(tag.strip('"'))
+    return tags
+
+
+def etag_matches(header, etag):
+    # type: (Optional[str], str) -> bool
+    """Return whether an If-None-Match header matches an entity tag
+
+    :param header: the value of the If-None-Match header, if any
+    :param etag: the entity tag of the current representation, quoted
+        and optionally marked as weak
+    """
+    tags = parse_etags(header)
+    if not tags:
+        return False
+    return '*' in tags or parse_etags(etag)[0] in tags
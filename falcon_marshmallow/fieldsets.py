@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse fieldsets: dumping only the fields a client asks for
+
+Clients often need only a few of the fields declared on a response
+schema. A ``FieldsetCache`` derives schemas restricted to a selection
+of fields (as with Marshmallow's ``only`` and ``exclude`` options) from
+the schemas declared on resources, and keeps them around, so that each
+selection is only derived once rather than on every request.
+
+Field names may be given as declared on the schema, or as they appear
+in its output (i.e. their ``dump_to`` names), and may select the fields
+of nested schemas with dotted names, e.g. ``author.name``. Unknown names
+are rejected, so that clients cannot have arbitrary attributes of the
+serialized objects dumped as implicit fields.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional
+
+# Third party
+from marshmallow import fields, Schema
+
+# Local
+from .pool import clone_schema
+
+
+log = logging.getLogger(__name__)
+
+
+#: The default maximum number of derived schemas kept
+DEFAULT_FIELDSET_CACHE_SIZE = 256
+
+
+def resolve_field_name(schema, name):
+    # type: (Schema, str) -> str
+    """Return the dotted field name designated by a requested name
+
+    :param schema: the schema whose fields are selected
+    :param name: a field name, or the name of a field in the output,
+        optionally followed by a dot and the name of a field of its
+        nested schema
+
+    :raises ValueError: if the schema has no such field
+    """
+    head, _, tail = name.partition('.')
+    field_name = head if head in schema.fields else None
+    if field_name is None:
+        for candidate, field in schema.fields.items():
+            if field.dump_to == head:
+                field_name = candidate
+                break
+    if field_name is None:
+        raise ValueError('Unknown field %r' % name)
+    if not tail:
+        return field_name
+    field = schema.fields[field_name]
+    if not isinstance(field, fields.Nested):
+        raise ValueError(
+            'Cannot select fields of %r, which is not nested' % head
+        )
+    return '%s.%s' % (field_name, resolve_field_name(field.schema, tail))
+
+
+def derive_schema(schema,  # type: Schema
+                  only=None,  # type: Optional[Iterable[str]]
+                  exclude=None,  # type: Optional[Iterable[str]]
+                  ):
+    # type: (...) -> Schema
+    """Return a copy of a schema restricted to a selection of fields
+
+    The copy dumps the fields of the schema which are listed in
+    ``only`` (if given) and not listed in ``exclude``, in the order in
+    which the schema declares them. Any ``only`` or ``exclude`` options
+    of the schema itself still apply.
+
+    :raises ValueError: if a field name is unknown
+    """
+    only = (
+        None if only is None
+        else [resolve_field_name(schema, name) for name in only]
+    )
+    exclude = [resolve_field_name(schema, name) for name in exclude or ()]
+    derived = clone_schema(schema)
+    if only is not None:
+        order = dict(
+            (name, index) for index, name in enumerate(schema.fields)
+        )
+        derived.only = derived.set_class(sorted(
+            set(only), key=lambda name: (order[name.split('.', 1)[0]], name)
+        ))
+    if exclude:
+        derived.exclude = derived.set_class(
+            sorted(set(schema.exclude) | set(exclude))
+        )
+    derived._normalize_nested_options()
+    derived._update_fields(many=derived.many)
+    return derived
+
+
+class FieldsetCache:
+    """A thread-safe LRU cache of schemas restricted to fieldsets
+
+    Derived schemas are keyed on the declared schema and the requested
+    field names, so a given selection is only derived (and, if schemas
+    are compiled, compiled) once while it stays in the cache.
+    """
+
+    def __init__(self, max_size=DEFAULT_FIELDSET_CACHE_SIZE):
+        # type: (int) -> None
+        """Instantiate the cache
+
+        :param max_size: the maximum number of derived schemas to keep.
+            Once the cache is full, the least recently used schema is
+            dropped to make room for a new one.
+        """
+        log.debug('FieldsetCache.__init__(%s)', max_size)
+        if max_size < 1:
+            raise ValueError(
+                'The cache size must be positive, not %r' % max_size
+            )
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # (schema, only, exclude) -> derived schema, least recently used
+        # first
+        self._schemas = OrderedDict()  # type: OrderedDict
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    def get(self,
+            schema,  # type: Schema
+            only=None,  # type: Optional[FrozenSet[str]]
+            exclude=None,  # type: Optional[FrozenSet[str]]
+            ):
+        # type: (...) -> Schema
+        """Return a schema restricted to a selection of fields
+
+        :param schema: the declared schema
+        :param only: the names of the fields to dump, or ``None`` for
+            all of them
+        :param exclude: the names of the fields not to dump, if any
+
+        :raises ValueError: if a field name is unknown
+        """
+        key = (schema, only, exclude)
+        with self._lock:
+            derived = self._schemas.pop(key, None)
+            if derived is not None:
+                self._schemas[key] = derived
+                self._hits += 1
+                return derived
+            self._misses += 1
+
+        derived = derive_schema(schema, only, exclude)
+        with self._lock:
+            self._schemas[key] = derived
+            while len(self._schemas) > self.max_size:
+                self._schemas.popitem(last=False)
+                self._evicted += 1
+        return derived
+
+    def clear(self):
+        # type: () -> None
+        """Drop all derived schemas"""
+        with self._lock:
+            self._schemas.clear()
+
+    def stats(self):
+        # type: () -> Dict[str, int]
+        """Return counters describing the use of the cache
+
+        * ``hits``: selections served by a cached schema
+        * ``misses``: selections for which a schema was derived
+        * ``evicted``: schemas dropped because the cache was full
+        * ``size``: schemas currently cached
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evicted': self._evicted,
+                'size': len(self._schemas),
+            }
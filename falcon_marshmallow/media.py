@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+Wire codecs for the media types supported by Falcon-Marshmallow
+
+A codec converts between request or response bodies of a given media
+type and the primitives loaded and dumped by schemas, so that schemas
+are applied in the same way whatever the encoding on the wire. A
+``CodecRegistry`` selects codecs from a request's ``Content-Type`` and
+``Accept`` headers.
+
+Real traffic only uses a handful of distinct header values, so the
+results of parsing them are kept in a ``HeaderCache`` rather than being
+computed again for every request.
+
+JSON is always supported. MessagePack is supported if the optional
+``msgpack`` dependency is installed.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, List, Optional, Union
+
+# Third party
+import simplejson
+try:
+    from falcon.vendor import mimeparse
+except ImportError:  # pragma: no cover
+    # Falcon < 2
+    import mimeparse
+
+# Local
+from .backends import JSONBackend, get_backend
+
+
+log = logging.getLogger(__name__)
+
+
+JSON_MEDIA_TYPE = 'application/json'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+#: Media types of newline-delimited JSON, which is loaded record by record
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/ndjson')
+
+#: The default maximum number of header values whose results are cached
+DEFAULT_HEADER_CACHE_SIZE = 256
+
+_missing = object()
+
+
+def parse_media_type(content_type):
+    # type: (Optional[str]) -> str
+    """Return the media type of a Content-Type, without its parameters
+
+    The media type is lowercased, and is empty if there is no
+    Content-Type.
+    """
+    if not content_type:
+        return ''
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+def is_json(content_type):
+    # type: (Optional[str]) -> bool
+    """Return whether a Content-Type is that of JSON
+
+    This includes media types with a ``+json`` structured syntax suffix,
+    e.g. ``application/problem+json``.
+    """
+    media_type = parse_media_type(content_type)
+    return media_type == JSON_MEDIA_TYPE or media_type.endswith('+json')
+
+
+def is_ndjson(content_type):
+    # type: (Optional[str]) -> bool
+    """Return whether a Content-Type is that of newline-delimited JSON"""
+    return parse_media_type(content_type) in NDJSON_MEDIA_TYPES
+
+
+def accepts_json(accept):
+    # type: (Optional[str]) -> bool
+    """Return whether an Accept header accepts JSON responses
+
+    JSON is accepted if ``application/json`` has a non-zero quality
+    value, directly or through a wildcard, or if any media type with a
+    ``+json`` suffix does. A missing Accept header accepts anything, and
+    a malformed one accepts nothing.
+    """
+    if not accept:
+        return True
+    try:
+        if mimeparse.quality(JSON_MEDIA_TYPE, accept) > 0:
+            return True
+        ranges = [
+            mimeparse.parse_media_range(item) for item in accept.split(',')
+        ]
+    except ValueError:
+        return False
+    return any(
+        subtype.endswith('+json') and float(params['q']) > 0
+        for _, subtype, params in ranges
+    )
+
+
+class HeaderCache:
+    """A thread-safe, bounded cache of results computed from headers
+
+    Calling the cache with a header value returns the result of the
+    function for that value, which is only computed the first time it
+    is seen. Lookups do not take a lock. Once the cache is full, the
+    values seen first are evicted first, so that a client sending
+    arbitrary values cannot grow it.
+    """
+
+    def __init__(self, func, max_size=DEFAULT_HEADER_CACHE_SIZE):
+        # type: (Callable[[Optional[str]], Any], int) -> None
+        """Instantiate the cache
+
+        :param func: the function computing results from header values
+        :param max_size: the maximum number of results to keep
+        """
+        if max_size < 1:
+            raise ValueError(
+                'The cache size must be positive, not %r' % max_size
+            )
+        self.max_size = max_size
+        self._func = func
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # type: OrderedDict
+
+    def __call__(self, value):
+        # type: (Optional[str]) -> Any
+        result = self._results.get(value, _missing)
+        if result is not _missing:
+            return result
+        result = self._func(value)
+        with self._lock:
+            self._results[value] = result
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return result
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        # type: () -> None
+        """Drop all cached results"""
+        with self._lock:
+            self._results.clear()
+
+
+class Codec:
+    """Base class for codecs"""
+
+    #: The media type of the bodies handled by the codec
+    media_type = None  # type: str
+
+    #: Other media types under which the same bodies may be sent
+    aliases = ()  # type: tuple
+
+    #: Whether ``dumps`` returns ``bytes`` rather than ``str``
+    binary = False
+
+    def __repr__(self):
+        return '%s()' % self.__class__.__name__
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        """Deserialize a body
+
+        :raises ValueError: if the body is invalid
+        """
+        raise NotImplementedError
+
+    def dumps(self, obj):
+        # type: (Any) -> Union[bytes, str]
+        """Serialize an object to a body
+
+        :raises TypeError: if the object cannot be serialized
+        """
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """Codec for JSON, using a JSON backend"""
+
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, backend=simplejson):
+        # type: (Any) -> None
+        """Instantiate the codec
+
+        :param backend: anything accepted by
+            ``falcon_marshmallow.backends.get_backend``
+        """
+        self.backend = get_backend(backend)  # type: JSONBackend
+        self.binary = self.backend.binary
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.backend)
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        return self.backend.loads(data)
+
+    def dumps(self, obj):
+        # type: (Any) -> Union[bytes, str]
+        return self.backend.dumps(obj)
+
+
+class MsgPackCodec(Codec):
+    """Codec for MessagePack
+
+    Requires the optional ``msgpack`` dependency.
+    """
+
+    media_type = MSGPACK_MEDIA_TYPE
+    aliases = ('application/x-msgpack',)
+    binary = True
+
+    def __init__(self):
+        """Instantiate the codec
+
+        :raises ImportError: if ``msgpack`` is not installed
+        """
+        import msgpack
+        self._msgpack = msgpack
+
+    def loads(self, data):
+        # type: (Union[bytes, str]) -> Any
+        try:
+            return self._msgpack.unpackb(bytes(data), raw=False)
+        except Exception as exc:
+            raise ValueError('Invalid MessagePack body: %s' % exc)
+
+    def dumps(self, obj):
+        # type: (Any) -> bytes
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+
+class CodecRegistry:
+    """A set of codecs, keyed on their media types
+
+    The first codec registered is the default, which is used for
+    requests without a recognized ``Content-Type`` and for clients
+    without a preference.
+    """
+
+    def __init__(self, codecs=()):
+        # type: (Iterable[Codec]) -> None
+        """Instantiate the registry
+
+        :param codecs: the codecs to register, default first
+        """
+        self._codecs = OrderedDict()  # type: OrderedDict
+        self._negotiated = HeaderCache(self._negotiate)
+        self._version = 0
+        for codec in codecs:
+            self.register(codec)
+
+    def __repr__(self):
+        return '%s(%r)' % (
+            self.__class__.__name__, list(self._codecs.values())
+        )
+
+    def register(self, codec):
+        # type: (Codec) -> None
+        """Register a codec for its media type and aliases
+
+        Any codec registered previously for the same media types is
+        replaced.
+        """
+        for media_type in (codec.media_type,) + tuple(codec.aliases):
+            self._codecs[media_type] = codec
+        self._negotiated.clear()
+        self._version += 1
+
+    @property
+    def version(self):
+        # type: () -> int
+        """A number which changes whenever a codec is registered
+
+        Anything derived from the registry's codecs may be kept until
+        the version changes.
+        """
+        return self._version
+
+    @property
+    def default(self):
+        # type: () -> Optional[Codec]
+        """The default codec, if any codec is registered"""
+        for codec in self._codecs.values():
+            return codec
+        return None
+
+    @property
+    def media_types(self):
+        # type: () -> List[str]
+        """The supported media types, including aliases"""
+        return list(self._codecs)
+
+    def get(self, content_type):
+        # type: (Optional[str]) -> Optional[Codec]
+        """Return the codec for a Content-Type, if any
+
+        Parameters (e.g. ``charset``) are ignored, and media types with
+        a ``+json`` structured syntax suffix (e.g.
+        ``application/problem+json``) are handled by the JSON codec.
+        """
+        media_type = parse_media_type(content_type)
+        if not media_type:
+            return None
+        codec = self._codecs.get(media_type)
+        if codec is None and media_type.endswith('+json'):
+            codec = self._codecs.get(JSON_MEDIA_TYPE)
+        return codec
+
+    def negotiate(self, accept):
+        # type: (Optional[str]) -> Optional[Codec]
+        """Return the codec best matching an Accept header, if any
+
+        Codecs registered first are preferred when the client accepts
+        several media types equally, as with ``*/*``. Without an Accept
+        header, the default codec is returned. A malformed Accept
+        header accepts nothing. Results are cached per Accept header.
+        """
+        return self._negotiated(accept)
+
+    def _negotiate(self, accept):
+        # type: (Optional[str]) -> Optional[Codec]
+        """Return the codec best matching an Accept header, uncached"""
+        if not accept:
+            return self.default
+        best = None
+        best_quality = 0.0
+        for media_type, codec in self._codecs.items():
+            try:
+                quality = mimeparse.quality(media_type, accept)
+            except ValueError:
+                return None
+            if quality > best_quality:
+                best, best_quality = codec, quality
+        return best
+
+
+def get_default_codecs(json_backend=simplejson):
+    # type: (Any) -> CodecRegistry
+    """Return a registry of the codecs supported by default
+
+    These are JSON, using ``json_backend``, and MessagePack, if it is
+    installed.
+
+    :param json_backend: anything accepted by
+        ``falcon_marshmallow.backends.get_backend``
+    """
+    registry = CodecRegistry([JSONCodec(json_backend)])
+    try:
+        registry.register(MsgPackCodec())
+    except ImportError:
+        log.debug('msgpack is not installed; MessagePack is not supported')
+    return registry
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Latency and size metrics for the stages of (de)serialization
+
+The ``Marshmallow`` middleware can report how long each stage of
+handling a request takes, and how large request and response bodies
+are, to a ``MetricsSink``, labelled by resource (class name) and HTTP
+method. The stages are:
+
+* ``read``: reading the request body
+* ``parse``: parsing the request body (with the JSON backend, or a
+  codec)
+* ``load``: loading and validating the parsed body with the schema
+* ``dump``: dumping the result with the schema
+* ``encode``: encoding the dumped result (with the JSON backend, or a
+  codec)
+
+The default sink discards everything, and is never even handed a
+measurement, so instrumentation costs next to nothing unless a sink is
+configured. ``InMemorySink`` keeps histograms which may be inspected
+directly, ``PrometheusSink`` also renders them in Prometheus' text
+exposition format, and ``StatsdSink`` sends each measurement over UDP to
+a StatsD daemon.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import bisect
+import logging
+import re
+import socket
+import threading
+from timeit import default_timer
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+# Third party
+from falcon import Request, Response
+
+
+log = logging.getLogger(__name__)
+
+
+#: The default upper bounds, in seconds, of duration histogram buckets
+DEFAULT_DURATION_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+#: The default upper bounds, in bytes, of size histogram buckets
+DEFAULT_SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216,
+)
+#: The content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram kinds
+DURATION = 'duration'
+SIZE = 'size'
+
+
+class Histogram:
+    """Counts of observed values, in buckets with fixed upper bounds"""
+
+    def __init__(self, buckets):
+        # type: (Sequence[float]) -> None
+        """Instantiate an empty histogram
+
+        :param buckets: the (increasing) upper bounds of the buckets.
+            Values above the last bound are only counted in the total.
+        """
+        self.bounds = tuple(buckets)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        # type: (float) -> None
+        """Count a value"""
+        index = bisect.bisect_left(self.bounds, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        # type: () -> List[Tuple[float, int]]
+        """Return ``(bound, count)`` pairs of values up to each bound"""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def to_dict(self):
+        # type: () -> Dict[str, Any]
+        """Return a snapshot of the histogram"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': self.cumulative(),
+        }
+
+
+class MetricsSink:
+    """A sink for metrics which discards them
+
+    Subclasses set ``enabled`` and override ``record_duration`` and
+    ``record_size``. Since this sink is disabled, the middleware does
+    not measure anything when it is used.
+    """
+
+    #: Whether measurements should be taken for this sink at all
+    enabled = False
+
+    def request(self, resource, method):
+        # type: (object, str) -> RequestMetrics
+        """Return the recorder of a request's measurements
+
+        :param resource: the resource handling the request
+        :param method: the HTTP method of the request
+        """
+        if not self.enabled:
+            return NULL_REQUEST_METRICS
+        return RequestMetrics(self, resource, method)
+
+    def record_duration(self, stage, seconds, resource, method):
+        # type: (str, float, str, str) -> None
+        """Record the duration of a stage of handling a request
+
+        :param stage: the stage, e.g. ``'parse'``
+        :param seconds: the time the stage took
+        :param resource: the name of the resource's class
+        :param method: the HTTP method of the request
+        """
+
+    def record_size(self, direction, size, resource, method):
+        # type: (str, int, str, str) -> None
+        """Record the size of a body
+
+        :param direction: ``'request'`` or ``'response'``
+        :param size: the size of the body in bytes
+        :param resource: the name of the resource's class
+        :param method: the HTTP method of the request
+        """
+
+
+class RequestMetrics:
+    """Records the measurements of a request to a sink"""
+
+    __slots__ = ('sink', 'resource', 'method')
+
+    def __init__(self, sink, resource, method):
+        # type: (MetricsSink, object, str) -> None
+        self.sink = sink
+        self.resource = type(resource).__name__
+        self.method = method
+
+    def time(self, stage):
+        # type: (str) -> _StageTimer
+        """Return a context manager timing a stage"""
+        return _StageTimer(self, stage)
+
+    def size(self, direction, size):
+        # type: (str, int) -> None
+        """Record the size of the request or response body"""
+        self.sink.record_size(direction, size, self.resource, self.method)
+
+    def body_size(self, direction, body):
+        # type: (str, Union[bytes, str]) -> None
+        """Record the size of a serialized body, as encoded in UTF-8"""
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.size(direction, len(body))
+
+
+class _StageTimer:
+    """Times a stage, recording its duration even if it fails"""
+
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        # type: (RequestMetrics, str) -> None
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = default_timer()
+
+    def __exit__(self, *exc_info):
+        metrics = self.metrics
+        metrics.sink.record_duration(
+            self.stage, default_timer() - self.start,
+            metrics.resource, metrics.method
+        )
+        return False
+
+
+class _NullRequestMetrics:
+    """Records nothing, as cheaply as possible"""
+
+    def time(self, stage):
+        # type: (str) -> _NullRequestMetrics
+        return self
+
+    def size(self, direction, size):
+        # type: (str, int) -> None
+        pass
+
+    def body_size(self, direction, body):
+        # type: (str, Union[bytes, str]) -> None
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+#: The recorder used for requests when metrics are disabled
+NULL_REQUEST_METRICS = _NullRequestMetrics()
+
+
+class InMemorySink(MetricsSink):
+    """A thread-safe sink keeping histograms in memory"""
+
+    enabled = True
+
+    def __init__(self,
+                 duration_buckets=DEFAULT_DURATION_BUCKETS,  # type: Sequence
+                 size_buckets=DEFAULT_SIZE_BUCKETS,  # type: Sequence
+                 ):
+        # type: (...) -> None
+        """Instantiate the sink
+
+        :param duration_buckets: the upper bounds, in seconds, of the
+            buckets of duration histograms
+        :param size_buckets: the upper bounds, in bytes, of the buckets
+            of size histograms
+        """
+        log.debug(
+            'InMemorySink.__init__(%s, %s)', duration_buckets, size_buckets
+        )
+        self._buckets = {DURATION: duration_buckets, SIZE: size_buckets}
+        self._lock = threading.Lock()
+        # (kind, stage or direction, resource, method) -> histogram
+        self._histograms = {}  # type: Dict[Tuple[str, ...], Histogram]
+
+    def record_duration(self, stage, seconds, resource, method):
+        # type: (str, float, str, str) -> None
+        self._observe((DURATION, stage, resource, method), seconds)
+
+    def record_size(self, direction, size, resource, method):
+        # type: (str, int, str, str) -> None
+        self._observe((SIZE, direction, resource, method), size)
+
+    def _observe(self, key, value):
+        # type: (Tuple[str, ...], float) -> None
+        """Count a value in the histogram for a key"""
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(
+                    self._buckets[key[0]]
+                )
+            histogram.observe(value)
+
+    def get(self, kind, name, resource, method):
+        # type: (str, str, str, str) -> Optional[Dict[str, Any]]
+        """Return a snapshot of a histogram, if anything was recorded
+
+        :param kind: ``'duration'`` or ``'size'``
+        :param name: the stage, for durations, or the direction, for
+            sizes
+        :param resource: the name of the resource's class
+        :param method: the HTTP method
+        """
+        with self._lock:
+            histogram = self._histograms.get((kind, name, resource, method))
+            return None if histogram is None else histogram.to_dict()
+
+    def snapshot(self):
+        # type: () -> Dict[Tuple[str, ...], Dict[str, Any]]
+        """Return snapshots of all histograms
+
+        Histograms are keyed on ``(kind, name, resource, method)``, as
+        described in ``get``.
+        """
+        with self._lock:
+            return dict(
+                (key, histogram.to_dict())
+                for key, histogram in self._histograms.items()
+            )
+
+    def clear(self):
+        # type: () -> None
+        """Drop all histograms"""
+        with self._lock:
+            self._histograms.clear()
+
+
+class PrometheusSink(InMemorySink):
+    """An in-memory sink rendering Prometheus' text exposition format
+
+    Durations are exposed as the ``<namespace>_stage_seconds``
+    histogram, labelled by ``stage``, ``resource`` and ``method``, and
+    sizes as ``<namespace>_body_bytes``, labelled by ``direction``,
+    ``resource`` and ``method``.
+
+    The sink is also a Falcon resource, so it may be routed to directly
+    to serve the metrics, e.g. with ``app.add_route('/metrics', sink)``.
+    """
+
+    def __init__(self, namespace='falcon_marshmallow', **kwargs):
+        # type: (str, **Any) -> None
+        """Instantiate the sink
+
+        Keyword arguments are passed to ``InMemorySink``.
+
+        :param namespace: the prefix of the names of the metrics
+        """
+        log.debug('PrometheusSink.__init__(%s, %s)', namespace, kwargs)
+        InMemorySink.__init__(self, **kwargs)
+        self.namespace = namespace
+
+    def render(self):
+        # type: () -> str
+        """Return the histograms in the text exposition format"""
+        families = (
+            (DURATION, 'stage_seconds', 'stage',
+             'Time spent in each stage of (de)serialization'),
+            (SIZE, 'body_bytes', 'direction',
+             'Size of request and response bodies'),
+        )
+        snapshot = self.snapshot()
+        lines = []
+        for kind, suffix, label, description in families:
+            name = '%s_%s' % (self.namespace, suffix)
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s histogram' % name)
+            for key in sorted(key for key in snapshot if key[0] == kind):
+                histogram = snapshot[key]
+                labels = '%s="%s",resource="%s",method="%s"' % (
+                    label, _escape(key[1]), _escape(key[2]), _escape(key[3])
+                )
+                for bound, count in histogram['buckets']:
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (
+                        name, labels, _format_number(bound), count
+                    ))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (
+                    name, labels, histogram['count']
+                ))
+                lines.append('%s_sum{%s} %s' % (
+                    name, labels, _format_number(histogram['sum'])
+                ))
+                lines.append('%s_count{%s} %d' % (
+                    name, labels, histogram['count']
+                ))
+        return '\n'.join(lines) + '\n'
+
+    def on_get(self, req, resp):
+        # type: (Request, Response) -> None
+        """Serve the metrics"""
+        resp.content_type = PROMETHEUS_CONTENT_TYPE
+        resp.body = self.render()
+
+
+class StatsdSink(MetricsSink):
+    """A sink sending measurements to a StatsD daemon over UDP
+
+    Durations are sent as timers, in milliseconds, named
+    ``<prefix>.stage.<stage>.<resource>.<method>``, and sizes as
+    histograms named ``<prefix>.body.<direction>.<resource>.<method>``.
+    Measurements are sent as they are recorded, without blocking, and
+    are dropped if they cannot be sent.
+    """
+
+    enabled = True
+
+    def __init__(self, host='127.0.0.1', port=8125,
+                 prefix='falcon_marshmallow'):
+        # type: (str, int, str) -> None
+        """Instantiate the sink
+
+        :param host: the host of the StatsD daemon
+        :param port: the UDP port of the StatsD daemon
+        :param prefix: the prefix of the names of the metrics
+        """
+        log.debug('StatsdSink.__init__(%s, %s, %s)', host, port, prefix)
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def record_duration(self, stage, seconds, resource, method):
+        # type: (str, float, str, str) -> None
+        self._send('stage', stage, resource, method, '%.3f|ms' % (
+            seconds * 1000
+        ))
+
+    def record_size(self, direction, size, resource, method):
+        # type: (str, int, str, str) -> None
+        self._send('body', direction, resource, method, '%d|h' % size)
+
+    def _send(self, *parts):
+        # type: (*str) -> None
+        """Send a measurement, named after all but the last part"""
+        name = '.'.join(
+            [self.prefix] + [_STATSD_UNSAFE.sub('_', part)
+                             for part in parts[:-1]]
+        )
+        try:
+            self._socket.sendto(
+                ('%s:%s' % (name, parts[-1])).encode('utf-8'), self.address
+            )
+        except (socket.error, OSError) as exc:
+            log.debug('Could not send metric %s: %s', name, exc)
+
+    def close(self):
+        # type: () -> None
+        """Close the socket"""
+        self._socket.close()
+
+
+_STATSD_UNSAFE = re.compile(r'[^A-Za-z0-9_\-]')
+
+
+def _escape(value):
+    # type: (str) -> str
+    """Escape a Prometheus label value"""
+    return (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+
+
+def _format_number(value):
+    # type: (float) -> str
+    """Format a number as Prometheus does, e.g. ``1`` or ``0.001``"""
+    return repr(float(value)) if value != int(value) else '%d' % value
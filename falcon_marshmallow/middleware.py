@@ -8,11 +8,22 @@ from __future__ import (
     absolute_import, division, print_function, unicode_literals
 )
 import logging
-from typing import Container, Optional
+import weakref
+from contextlib import contextmanager
+from functools import partial
+from typing import (
+    Any, Container, Dict, FrozenSet, Generator, Hashable, Iterable, List,
+    Optional, Sequence, Tuple, Union
+)
+
+try:
+    from collections.abc import Iterator
+except ImportError:  # pragma: no cover
+    from collections import Iterator
 
 # Third party
 import simplejson as json
-from falcon import Request, Response
+from falcon import HTTP_304, Request, Response
 from falcon.errors import (
     HTTPBadRequest,
     HTTPInternalServerError,
@@ -20,55 +31,115 @@ from falcon.errors import (
     HTTPUnprocessableEntity,
     HTTPUnsupportedMediaType,
 )
-from marshmallow import Schema
+from marshmallow import fields, Schema
+
+# Local
+from .backends import get_backend
+from .body import (
+    CONTENT_KEY,
+    BodyContent,
+    check_content_length,
+    get_body_size,
+    get_max_body_size,
+    get_stashed_content,
+    get_stashed_stream,
+    is_spooled,
+    limit_stream,
+    stash_content,
+)
+from .cache import ResponseCache
+from .compiled import get_compiled_loader, get_compiled_serializer
+from .compression import (
+    DEFAULT_ENCODINGS,
+    DEFAULT_LEVEL,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_MIN_SIZE,
+    choose_encoding,
+    compress,
+    compress_stream,
+    decompress_stream,
+)
+from .etags import etag_matches, make_etag
+from .fieldsets import DEFAULT_FIELDSET_CACHE_SIZE, FieldsetCache
+from .media import (
+    Codec,
+    CodecRegistry,
+    HeaderCache,
+    JSONCodec,
+    accepts_json,
+    is_json,
+    is_ndjson,
+)
+from .metrics import MetricsSink, NULL_REQUEST_METRICS, RequestMetrics
+from .parallel import ProcessPool
+from .pool import SchemaPool
+from .profiling import PROFILE_KEY, RequestProfiler
+from .routes import iter_routes
+from .streaming import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    dump_json_stream,
+    load_json_stream,
+    load_ndjson_stream,
+)
+from .validation import dump_errors, load_fail_fast, truncate_errors
 
 
 log = logging.getLogger(__name__)
 
 
 JSON_CONTENT_REQUIRED_METHODS = ('POST', 'PUT', 'PATCH')
-CONTENT_KEY = 'content'
-
 
-def get_stashed_content(req):
-    """
-    A helper to have multiple middlewares acting on data in the request
-    stream.
-
-    For this to work, no middlewware should use `req.stream.read()` directly,
-    as that will either cause this to get `EOF` (`b''`) or the middleware will
-    get `EOF` if this runs first.
-
-    The issue is that without more elaborate measures (which we could do at
-    some point), the first middleware to use `req.stream.read()` will make
-    an following middleware get no data, as the stream is not seekable; it does
-    not support being rewound (no `seek(0)`).
-    """
-    # This is the key which will hold the already-read content.
-    if req.context.get(CONTENT_KEY) is None:
-        req.context[CONTENT_KEY] = req.bounded_stream.read()
-
-    return req.context[CONTENT_KEY]
+# Request headers which may change a result, whether or not the
+# response varies on them
+_CREDENTIAL_HEADERS = ('authorization', 'cookie')
 
 
 class JSONEnforcer:
     """Enforce that requests are JSON compatible"""
 
-    def __init__(self, required_methods=JSON_CONTENT_REQUIRED_METHODS):
-        # type: (Container) -> None
+    def __init__(self, required_methods=JSON_CONTENT_REQUIRED_METHODS,
+                 codecs=None, ndjson=False):
+        # type: (Container, Optional[CodecRegistry], bool) -> None
         """Initialize the middleware
 
         :param required_methods: a collection of HTTP methods for
             which "application/json" should be required as a
             Content-Type header
+        :param codecs: (default ``None``) a
+            ``falcon_marshmallow.media.CodecRegistry`` whose media
+            types are accepted in place of "application/json", both in
+            the Accept header and as the Content-Type. This should be
+            the registry passed to the ``Marshmallow`` middleware.
+        :param ndjson: (default ``False``) whether newline-delimited
+            JSON ("application/x-ndjson") is accepted as the
+            Content-Type too. This should only be set if the
+            ``Marshmallow`` middleware is instantiated with
+            ``ndjson=True``, since it cannot load such bodies otherwise.
         """
-        log.debug('JSONEnforcer.__init__(%s)', required_methods)
+        log.debug(
+            'JSONEnforcer.__init__(%s, %s, %s)',
+            required_methods, codecs, ndjson
+        )
         self._methods = required_methods
+        self._codecs = codecs
+        self._ndjson = ndjson
+        # (registry version, quoted media types), for error messages
+        self._media_types = (None, '')  # type: Tuple[Optional[int], str]
+        # Raw header value -> whether it is acceptable
+        self._accepts_json = HeaderCache(accepts_json)
+        self._is_json = HeaderCache(self._is_json_type)
 
     def process_request(self, req, resp):
         # type: (Request, Response) -> None
         """Ensure requests accept JSON or specify JSON as content type
 
+        Media types with a ``+json`` suffix (e.g.
+        ``application/vnd.api+json``) count as JSON, both in the Accept
+        header and as the content type, and parameters such as
+        ``charset`` are ignored. The result of checking each distinct
+        header value is cached.
+
         :param req: the passed request object
         :param resp: the passed repsonse object
 
@@ -76,10 +147,15 @@ class JSONEnforcer:
             "application/json" responses as acceptable
         :raises HttpUnsupportedContentType: if a request of a type
             specified by "required_methods" does not specify a
-            content-type of "application/json"
+            content-type of "application/json" (or newline-delimited
+            JSON, if accepted)
         """
         log.debug('JSONEnforcer.process_request(%s, %s)', req, resp)
-        if not req.client_accepts_json:
+        if self._codecs is not None:
+            self._check_codecs(req)
+            return
+
+        if not self._accepts_json(req.accept):
             raise HTTPNotAcceptable(
                 description=(
                     'This server only supports responses encoded as JSON. '
@@ -88,9 +164,8 @@ class JSONEnforcer:
                 )
             )
 
-        if req.method in JSON_CONTENT_REQUIRED_METHODS:
-            if (req.content_type is None or
-                    'application/json' not in req.content_type):
+        if req.method in self._methods:
+            if not self._is_json(req.content_type):
                 raise HTTPUnsupportedMediaType(
                     description=(
                         '%s requests must have "application/json" in their '
@@ -98,10 +173,92 @@ class JSONEnforcer:
                     )
                 )
 
+    def _is_json_type(self, content_type):
+        # type: (Optional[str]) -> bool
+        """Return whether a Content-Type is JSON, or accepted NDJSON"""
+        return is_json(content_type) or (
+            self._ndjson and is_ndjson(content_type)
+        )
+
+    def _check_codecs(self, req):
+        # type: (Request) -> None
+        """Ensure requests accept or specify a supported media type
+
+        :raises HttpNotAcceptable: if the request accepts none of the
+            media types of the codec registry
+        :raises HttpUnsupportedContentType: if a request of a type
+            specified by "required_methods" does not specify one of
+            the media types of the codec registry as its content type
+        """
+        if self._codecs.negotiate(req.get_header('Accept')) is None:
+            raise HTTPNotAcceptable(
+                description=(
+                    'This server only supports responses encoded as one '
+                    'of %s. Please update your "Accept" header to include '
+                    'one of them.' % self._get_media_types()
+                )
+            )
+
+        if (req.method in self._methods and
+                self._codecs.get(req.content_type) is None and
+                not (self._ndjson and is_ndjson(req.content_type))):
+            raise HTTPUnsupportedMediaType(
+                description=(
+                    '%s requests must have one of %s as their '
+                    '"Content-Type" header.' % (
+                        req.method, self._get_media_types()
+                    )
+                )
+            )
+
+    def _get_media_types(self):
+        # type: () -> str
+        """Return the quoted media types of the codec registry
+
+        The string is only built again once the registry has changed.
+        """
+        version, media_types = self._media_types
+        if version != self._codecs.version:
+            media_types = ', '.join(
+                '"%s"' % media_type for media_type in self._codecs.media_types
+            )
+            self._media_types = (self._codecs.version, media_types)
+        return media_types
+
 
 class EmptyRequestDropper:
     """Check and drop empty requests"""
 
+    def __init__(self, spool_threshold=None, max_body_size=None,
+                 resource_limits=False):
+        # type: (Optional[int], Optional[int], bool) -> None
+        """Initialize the middleware
+
+        :param spool_threshold: (default ``None``) the Content-Length,
+            in bytes, above which request bodies are spooled to a
+            temporary file rather than read into memory
+        :param max_body_size: (default ``None``) the maximum
+            Content-Length, in bytes, of request bodies. Larger
+            requests are rejected before any of the body is read.
+            Reading more than this from bodies without a
+            Content-Length also results in a 413.
+        :param resource_limits: (default ``False``) whether resources
+            may set their own maximum body size, e.g. with
+            ``post_max_body`` or ``max_body`` (see
+            ``falcon_marshmallow.body.get_max_body_size``). Since the
+            resource is only known once the request has been routed,
+            bodies are then checked and read in ``process_resource``
+            rather than ``process_request``, so requests which are not
+            routed are never read.
+        """
+        log.debug(
+            'EmptyRequestDropper.__init__(%s, %s, %s)',
+            spool_threshold, max_body_size, resource_limits
+        )
+        self._spool_threshold = spool_threshold
+        self._max_body_size = max_body_size
+        self._resource_limits = resource_limits
+
     def process_request(self, req, resp):
         # type: (Request, Response) -> None
         """Ensure that a request does not contain an empty body
@@ -114,12 +271,55 @@ class EmptyRequestDropper:
 
         :raises HTTPBadRequest: if the request has content length with
             an empty body
+        :raises HTTPPayloadTooLarge: if the request's content length
+            exceeds ``max_body_size``
         """
         log.debug('EmptyRequestDropper.process_request(%s, %s)', req, resp)
-        if req.content_length in (None, 0):
-            return
+        if not self._resource_limits:
+            self._check_body(req, self._max_body_size)
+
+    def process_resource(self, req, resp, resource, params):
+        # type: (Request, Response, object, dict) -> None
+        """Ensure that a request does not contain an empty body
+
+        This only does anything if the middleware was instantiated with
+        ``resource_limits=True``, in which case the body is checked as
+        in ``process_request``, against the resource's maximum body
+        size.
+
+        :param req: the passed request object
+        :param resp: the passed response object
+        :param resource: the resource handling the request
+        :param params: any parameters parsed from the url
 
-        content = get_stashed_content(req)
+        :raises HTTPBadRequest: if the request has content length with
+            an empty body
+        :raises HTTPPayloadTooLarge: if the request's content length
+            exceeds the resource's maximum body size
+        """
+        log.debug(
+            'EmptyRequestDropper.process_resource(%s, %s, %s, %s)',
+            req, resp, resource, params
+        )
+        if self._resource_limits:
+            self._check_body(req, get_max_body_size(
+                resource, req.method, self._max_body_size
+            ))
+
+    def _check_body(self, req, max_size):
+        # type: (Request, Optional[int]) -> None
+        """Read the body of a request, and reject it if it is empty"""
+        if req.context.get(CONTENT_KEY) is None:
+            if req.content_length is None:
+                limit_stream(req, max_size)
+                return
+            if req.content_length == 0:
+                return
+
+        content = get_stashed_content(req, self._spool_threshold, max_size)
+        # A stashed body, e.g. decompressed by the Compressor, may be
+        # larger than its Content-Length
+        check_content_length(req, max_size)
 
         # If the content is _still_ Falsy (e.g., something empty like b'')
         if not content:
@@ -130,12 +330,238 @@ class EmptyRequestDropper:
             )
 
 
+class Compressor:
+    """Compress responses and decompress requests
+
+    This middleware should be listed before any other middleware, so
+    that it decompresses request bodies before they are read, and
+    compresses response bodies once they have been serialized.
+
+    It only works with WSGI apps, having no ``process_*_async`` hooks
+    for ``falcon.asgi.App``.
+    """
+
+    def __init__(self,
+                 min_size=DEFAULT_MIN_SIZE,  # type: int
+                 level=DEFAULT_LEVEL,  # type: int
+                 encodings=DEFAULT_ENCODINGS,  # type: Sequence[str]
+                 max_decompressed_size=DEFAULT_MAX_SIZE,  # type: Optional[int]
+                 chunk_size=DEFAULT_CHUNK_SIZE,  # type: int
+                 spool_threshold=None,  # type: Optional[int]
+                 resource_limits=False,  # type: bool
+                 ):
+        # type: (...) -> None
+        """Initialize the middleware
+
+        :param min_size: (default 1 KiB) the size, in bytes, below
+            which response bodies are not compressed. Streamed
+            responses, whose size is not known, are always compressed.
+        :param level: (default 6) the zlib compression level, from 1
+            (fastest) to 9 (smallest)
+        :param encodings: (default ``('gzip', 'deflate')``) the content
+            codings with which responses may be compressed, by order of
+            preference
+        :param max_decompressed_size: (default 16 MiB) the maximum
+            size, in bytes, of decompressed request bodies, or ``None``
+            for no limit. Larger requests are rejected with a 413 as
+            soon as the limit is exceeded.
+        :param chunk_size: (default 64 KiB) the number of bytes of
+            compressed request bodies to read at a time
+        :param spool_threshold: (default ``None``) the decompressed
+            size, in bytes, above which request bodies are spooled to
+            a memory-mapped temporary file rather than held in memory.
+            If ``None``, they are never spooled.
+        :param resource_limits: (default ``False``) whether resources
+            may set their own maximum decompressed size, with
+            ``post_max_body`` or ``max_body`` as for
+            ``EmptyRequestDropper``, in place of
+            ``max_decompressed_size``. Request bodies are then
+            decompressed in ``process_resource`` rather than
+            ``process_request``, so any ``EmptyRequestDropper`` should
+            also be instantiated with ``resource_limits=True``.
+        """
+        log.debug(
+            'Compressor.__init__(%s, %s, %s, %s, %s, %s, %s)',
+            min_size, level, encodings, max_decompressed_size, chunk_size,
+            spool_threshold, resource_limits
+        )
+        self._min_size = min_size
+        self._level = level
+        self._encodings = encodings
+        self._max_decompressed_size = max_decompressed_size
+        self._chunk_size = chunk_size
+        self._spool_threshold = spool_threshold
+        self._resource_limits = resource_limits
+
+    def process_request(self, req, resp):
+        # type: (Request, Response) -> None
+        """Decompress request bodies sent with a Content-Encoding
+
+        The decompressed body is stashed, so that other middleware and
+        ``get_stashed_content`` see it rather than the compressed body.
+        Bodies without a Content-Length (i.e. chunked) are read until
+        the end of ``req.stream``.
+
+        :param req: the passed request object
+        :param resp: the passed response object
+
+        :raises HTTPUnsupportedMediaType: if the Content-Encoding is not
+            supported
+        :raises HTTPBadRequest: if the body is not validly encoded
+        :raises HTTPPayloadTooLarge: if the decompressed body exceeds
+            ``max_decompressed_size``
+        """
+        log.debug('Compressor.process_request(%s, %s)', req, resp)
+        if not self._resource_limits:
+            self._decompress(req, self._max_decompressed_size)
+
+    def process_resource(self, req, resp, resource, params):
+        # type: (Request, Response, object, dict) -> None
+        """Decompress request bodies sent with a Content-Encoding
+
+        This only does anything if the middleware was instantiated with
+        ``resource_limits=True``, in which case the body is
+        decompressed as in ``process_request``, up to the resource's
+        maximum body size.
+
+        :param req: the passed request object
+        :param resp: the passed response object
+        :param resource: the resource handling the request
+        :param params: any parameters parsed from the url
+
+        :raises HTTPUnsupportedMediaType: if the Content-Encoding is not
+            supported
+        :raises HTTPBadRequest: if the body is not validly encoded
+        :raises HTTPPayloadTooLarge: if the decompressed body exceeds
+            the resource's maximum body size
+        """
+        log.debug(
+            'Compressor.process_resource(%s, %s, %s, %s)',
+            req, resp, resource, params
+        )
+        if self._resource_limits:
+            self._decompress(req, get_max_body_size(
+                resource, req.method, self._max_decompressed_size
+            ))
+
+    def _decompress(self, req, max_size):
+        # type: (Request, Optional[int]) -> None
+        """Decompress and stash the body of a request, if it is encoded"""
+        encoding = (req.get_header('Content-Encoding') or '').strip().lower()
+        if (encoding in ('', 'identity') or req.content_length == 0 or
+                req.context.get(CONTENT_KEY) is not None):
+            return
+
+        if req.content_length is None:
+            # Falcon does not bound chunked bodies, so read the stream
+            # itself. Bound it by the decompressed limit too, since
+            # e.g. empty gzip members add to it without decompressing
+            # to anything.
+            limit_stream(req, max_size)
+            stream = req.stream
+        else:
+            stream = req.bounded_stream
+        stash_content(req, decompress_stream(
+            stream, encoding, max_size, self._chunk_size,
+            self._spool_threshold
+        ))
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        # type: (Request, Response, object, bool) -> None
+        """Compress response bodies with an accepted content coding
+
+        Bodies set as ``resp.stream`` are compressed incrementally, as
+        they are streamed. Since the compressed body is a different
+        representation, any strong ETag is made weak.
+
+        :param falcon.Request req: the request object
+        :param falcon.Response resp: the response object
+        :param object resource: the resource object
+        :param bool req_succeeded: whether the request was successful
+        """
+        log.debug(
+            'Compressor.process_response(%s, %s, %s, %s)',
+            req, resp, resource, req_succeeded
+        )
+        if resp.get_header('Content-Encoding') is not None:
+            return
+        body = resp.body
+        if body is None:
+            body = resp.data
+        if not body and resp.stream is None:
+            return
+
+        resp.append_header('Vary', 'Accept-Encoding')
+        encoding = choose_encoding(
+            req.get_header('Accept-Encoding'), self._encodings
+        )
+        if encoding is None:
+            return
+
+        if resp.stream is not None:
+            resp.stream = compress_stream(
+                self._iter_stream(resp.stream), encoding, self._level
+            )
+            resp.delete_header('Content-Length')
+        else:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            if len(body) < self._min_size:
+                return
+            resp.body = None
+            resp.data = compress(body, encoding, self._level)
+
+        resp.set_header('Content-Encoding', encoding)
+        etag = resp.get_header('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            resp.set_header('ETag', 'W/' + etag)
+
+    def _iter_stream(self, stream):
+        # type: (Any) -> Iterable[bytes]
+        """Return the chunks of a response stream
+
+        Streams may be iterables of chunks or file-like objects.
+        """
+        if hasattr(stream, 'read'):
+            return iter(lambda: stream.read(self._chunk_size), b'')
+        return stream
+
+
 class Marshmallow:
     """Attempt to deserialize objects with any available schemas"""
 
-    def __init__(self, req_key='json', resp_key='result', force_json=True,
-                 json_module=json):
-        # type: (str, str, bool, type(json)) -> None
+    def __init__(self,
+                 req_key='json',  # type: str
+                 resp_key='result',  # type: str
+                 force_json=True,  # type: bool
+                 json_module=json,  # type: type(json)
+                 stream_json=False,  # type: bool
+                 stream_chunk_size=DEFAULT_CHUNK_SIZE,  # type: int
+                 stream_batch_size=DEFAULT_BATCH_SIZE,  # type: int
+                 json_backend=None,  # type: object
+                 spool_threshold=None,  # type: Optional[int]
+                 max_body_size=None,  # type: Optional[int]
+                 compile_schemas=False,  # type: bool
+                 schema_pool_size=None,  # type: Optional[int]
+                 process_pool=None,  # type: Optional[ProcessPool]
+                 auto_many=False,  # type: bool
+                 partial_many=False,  # type: bool
+                 errors_key='errors',  # type: str
+                 etags=False,  # type: bool
+                 version_key='version',  # type: str
+                 response_cache=None,  # type: Optional[ResponseCache]
+                 cache_key='cache_key',  # type: str
+                 codecs=None,  # type: Optional[CodecRegistry]
+                 ndjson=False,  # type: bool
+                 fields_param=None,  # type: Optional[str]
+                 exclude_param=None,  # type: Optional[str]
+                 fieldset_cache_size=DEFAULT_FIELDSET_CACHE_SIZE,  # type: int
+                 max_errors=None,  # type: Optional[int]
+                 max_error_size=None,  # type: Optional[int]
+                 metrics=None,  # type: Optional[MetricsSink]
+                 profiler=None,  # type: Optional[RequestProfiler]
+                 ):
+        # type: (...) -> None
         """Instantiate the middleware object
 
         :param req_key: (default ``'json'``) the key on the
@@ -148,25 +574,265 @@ class Marshmallow:
             and responses for resources *without* any defined
             Marshmallow schemas should be parsed as json anyway.
         :param json_module: (default ``simplejson``) the json module to
-            use for  (de)serialization if no schema is available on a
-            resource and ``force_json`` is ``True`` - if you would like
-            to use an alternative serializer to the stdlib ``json``
-            module for your Marshmallow schemas, you will have to
-            specify using a schema metaclass, as defined in the
-            `Marshmallow documentation`_
+            use for (de)serialization if no ``json_backend`` is
+            specified. It is used to parse request bodies and to encode
+            the data dumped by schemas, as well as to (de)serialize
+            bodies for resources without schemas if ``force_json`` is
+            ``True``. Schemas may still override this for responses by
+            specifying a json module in their metaclass, as defined in
+            the `Marshmallow documentation`_
 
             .. _marshmallow documentation: http://marshmallow.readthedocs.io/
                 en/latest/api_reference.html#marshmallow.Schema.Meta
 
+        :param stream_json: (default ``False``) whether to parse request
+            bodies incrementally from ``req.bounded_stream`` rather than
+            reading the whole body into memory first. Top-level JSON
+            arrays are parsed item by item, so peak memory stays close
+            to the size of the parsed result. Note that if another
+            middleware (e.g. ``EmptyRequestDropper``) has already read
+            the body, the already-read body is used instead.
+        :param stream_chunk_size: (default 64 KiB) the number of bytes
+            to read at a time when ``stream_json`` is ``True``
+        :param stream_batch_size: (default 100) the number of items to
+            serialize at a time when a result is an iterator (e.g. a
+            generator or database cursor) and is therefore streamed
+            to the client as a JSON array
+        :param json_backend: (default ``None``) the JSON backend to use
+            for parsing request bodies and serializing responses, both
+            with and without schemas. This may be the name of a built-in
+            backend (``'json'``, ``'simplejson'``, ``'orjson'``, or
+            ``'ujson'``) or a ``JSONBackend`` instance. If ``None``,
+            ``json_module`` is used. Backends that serialize to bytes,
+            such as ``orjson``, have their output written directly to
+            ``resp.data``. Schemas that specify their own
+            ``json_module`` in their Meta class continue to use it for
+            serializing responses.
+        :param spool_threshold: (default ``None``) the Content-Length,
+            in bytes, above which request bodies are spooled to a
+            temporary file and memory-mapped rather than read into
+            memory. Spooled bodies are parsed incrementally from the
+            mapped file.
+        :param max_body_size: (default ``None``) the maximum
+            Content-Length, in bytes, of request bodies. Larger
+            requests are rejected with a 413 before any of the body
+            is read, and reading more than this from bodies without a
+            Content-Length also results in a 413. Resources may set
+            their own limit, see ``process_resource``.
+        :param compile_schemas: (default ``False``) whether to generate
+            specialized functions for schemas, which are used in place
+            of ``Schema.load`` for request schemas and ``Schema.dump``
+            for response schemas. Schemas which cannot be compiled
+            (e.g. because they have pre- or post-processors) are handled
+            by Marshmallow as usual, as is any data producing errors.
+        :param schema_pool_size: (default ``None``) if set, schemas
+            declared on resources are not used directly. Instead, each
+            (de)serialization uses a clone of the declared schema from a
+            thread-safe pool, which keeps up to this many idle clones
+            per schema. This makes it safe for schemas to use their
+            ``context`` in multi-threaded servers. See ``schema_pool``
+            for usage statistics.
+        :param process_pool: (default ``None``) a
+            ``falcon_marshmallow.parallel.ProcessPool`` in which to load
+            and dump large collections with the schemas registered with
+            it. Collections with more than the pool's ``min_items``
+            items are split into batches, which are (de)serialized in
+            separate processes. Anything else is (de)serialized in the
+            current process as usual.
+        :param auto_many: (default ``False``) whether request bodies
+            which are JSON arrays should be loaded as collections
+            (``many=True``) by schemas which are not ``many`` schemas
+            themselves. Resources may also request this explicitly, see
+            ``process_resource``.
+        :param partial_many: (default ``False``) whether collections in
+            request bodies may be partially valid. If ``True``, invalid
+            items are left out of the loaded data, and their errors are
+            stored on ``req.context`` under ``errors_key``, indexed by
+            their position in the body. A 422 is only returned if no
+            item is valid. If ``False``, any invalid item results in a
+            422, whose description includes the errors for every item.
+        :param errors_key: (default ``'errors'``) the key on the
+            ``req.context`` object where the errors of invalid items
+            are stored if ``partial_many`` is ``True``
+        :param etags: (default ``False``) whether to set an ``ETag``
+            header on successful responses to GET and HEAD requests,
+            and to respond with ``304 Not Modified`` and no body if the
+            request's ``If-None-Match`` header matches it. The ETag is
+            computed from the serialized body, unless the responder
+            sets one itself or provides a version key (see
+            ``version_key``), in which case the result is not
+            serialized at all if it has not been modified.
+        :param version_key: (default ``'version'``) the key on the
+            ``req.context`` object where responders may store a value
+            which changes whenever the result changes (e.g. a row
+            version or modification time), from which the ETag is
+            computed if ``etags`` is ``True``
+        :param response_cache: (default ``None``) a
+            ``falcon_marshmallow.cache.ResponseCache`` in which to keep
+            serialized results. Results are only cached if the
+            responder provides a cache key (see ``cache_key``) or a
+            version (see ``version_key``), in which case they are
+            cached per schema and key, and served from the cache
+            without being serialized again. Call
+            ``response_cache.invalidate`` after writes to objects whose
+            cache keys do not change with their versions.
+        :param cache_key: (default ``'cache_key'``) the key on the
+            ``req.context`` object where responders may store a
+            hashable value identifying their result, under which its
+            serialization is cached. If it is not set but a version is,
+            the result is cached under the request's URI and version,
+            selected fields, credentials (Authorization and Cookie
+            headers), and the other request headers listed in the
+            response's Vary header.
+        :param codecs: (default ``None``) a
+            ``falcon_marshmallow.media.CodecRegistry`` of the media
+            types in which bodies may be encoded, besides JSON (e.g.
+            ``falcon_marshmallow.media.get_default_codecs()``, which
+            adds MessagePack if it is installed). Request bodies are
+            decoded with the codec for their Content-Type, and
+            responses are encoded with the codec negotiated from the
+            Accept header, while schemas load and dump them as usual.
+            JSON is always (de)serialized with the configured JSON
+            backend, and streamed results are always JSON arrays.
+        :param ndjson: (default ``False``) whether to load request
+            bodies of newline-delimited JSON (with a Content-Type of
+            ``application/x-ndjson``) lazily, record by record. See
+            ``process_resource``.
+        :param fields_param: (default ``None``) the name of a query
+            parameter (e.g. ``'fields'``) in which clients may list the
+            fields of response schemas to dump, separated by commas.
+            Other fields are left out, as with Marshmallow's ``only``
+            option. Names may be dotted to select the fields of nested
+            schemas, e.g. ``author.name``. Requests for unknown fields
+            are rejected with a 400.
+        :param exclude_param: (default ``None``) the name of a query
+            parameter (e.g. ``'exclude'``) in which clients may list
+            fields of response schemas not to dump, as with
+            Marshmallow's ``exclude`` option
+        :param fieldset_cache_size: (default 256) the maximum number of
+            schemas derived for the selections of fields requested with
+            ``fields_param`` or ``exclude_param`` to keep, so that they
+            are not derived again for every request. See
+            ``fieldset_cache`` for usage statistics.
+        :param max_errors: (default ``None``) if set, request bodies
+            are rejected as soon as this many errors are found, and
+            only the first ``max_errors`` are reported. Collections are
+            then loaded a batch at a time, and items after the batch in
+            which the limit is reached are not validated at all, so
+            that huge, invalid bodies are cheap to reject. This only
+            applies to bodies which are collections: collections nested
+            in the fields of an object (e.g. ``List`` or ``Nested``
+            fields with ``many=True``) are validated in full, and their
+            errors count as those of one field, so bound them with
+            ``max_body_size`` and ``max_error_size``. Resources may set
+            their own limit, see ``process_resource``.
+        :param max_error_size: (default ``None``) the maximum length of
+            the serialized errors in the description of a 422. Errors
+            which do not fit are left out. Whenever errors are left
+            out, the description includes ``"_truncated": true``.
+        :param metrics: (default ``None``) a
+            ``falcon_marshmallow.metrics.MetricsSink`` (e.g. a
+            ``PrometheusSink`` or a ``StatsdSink``) to which to report
+            the duration of each stage of (de)serialization (reading,
+            parsing, loading, dumping and encoding) and the sizes of
+            request and response bodies, labelled by resource and
+            method. If ``None``, nothing is measured.
+        :param profiler: (default ``None``) a
+            ``falcon_marshmallow.profiling.RequestProfiler`` selecting
+            requests for which to profile ``process_resource`` and
+            ``process_response`` with ``cProfile``, and writing their
+            stats. If ``None``, the methods are not even wrapped, so
+            profiling costs nothing unless it is enabled.
         """
         log.debug(
-            'Marshmallow.__init__(%s, %s, %s, %s)',
-            req_key, resp_key, force_json, json_module
+            'Marshmallow.__init__(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '
+            '%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '
+            '%s, %s, %s, %s)',
+            req_key, resp_key, force_json, json_module, stream_json,
+            stream_chunk_size, stream_batch_size, json_backend,
+            spool_threshold, max_body_size, compile_schemas,
+            schema_pool_size, process_pool, auto_many, partial_many,
+            errors_key, etags, version_key, response_cache, cache_key,
+            codecs, ndjson, fields_param, exclude_param, fieldset_cache_size,
+            max_errors, max_error_size, metrics, profiler
         )
         self._req_key = req_key
         self._resp_key = resp_key
         self._force_json = force_json
         self._json = json_module
+        self._backend = get_backend(
+            json_module if json_backend is None else json_backend
+        )
+        self._stream_json = stream_json
+        self._stream_chunk_size = stream_chunk_size
+        self._stream_batch_size = stream_batch_size
+        self._spool_threshold = spool_threshold
+        self._max_body_size = max_body_size
+        self._compile_schemas = compile_schemas
+        self._schema_pool = (
+            None if schema_pool_size is None
+            else SchemaPool(schema_pool_size)
+        )
+        self._process_pool = process_pool
+        self._auto_many = auto_many
+        self._partial_many = partial_many
+        self._errors_key = errors_key
+        self._etags = etags
+        self._version_key = version_key
+        self._response_cache = response_cache
+        self._cache_key = cache_key
+        self._codecs = codecs
+        self._ndjson = ndjson
+        self._fields_param = fields_param
+        self._exclude_param = exclude_param
+        self._fieldset_cache = (
+            None if fields_param is None and exclude_param is None
+            else FieldsetCache(fieldset_cache_size)
+        )
+        self._max_errors = max_errors
+        self._max_error_size = max_error_size
+        self._metrics = MetricsSink() if metrics is None else metrics
+        self._profiler = profiler
+        if profiler is not None:
+            # Shadow the methods Falcon calls on this instance only
+            self.process_resource = self._profile_resource
+            self.process_response = self._profile_response
+        # resource -> {(method, msg_type): schema}, populated lazily by
+        # ``_resolve_schema`` and cleared by ``invalidate_schema_cache``.
+        # Resources are weakly referenced, so that they are not kept
+        # alive by the cache, except for those which cannot be, which
+        # are kept by id alongside their lookups, as
+        # id(resource) -> (resource, {(method, msg_type): schema}).
+        self._schema_cache = weakref.WeakKeyDictionary()
+        self._pinned_schema_cache = {}  # type: Dict[int, tuple]
+
+    @property
+    def schema_pool(self):
+        # type: () -> Optional[SchemaPool]
+        """The pool of schema clones, if ``schema_pool_size`` was given
+
+        Call ``schema_pool.stats()`` for usage statistics.
+        """
+        return self._schema_pool
+
+    @property
+    def response_cache(self):
+        # type: () -> Optional[ResponseCache]
+        """The cache of serialized responses, if one was given
+
+        Call ``response_cache.stats()`` for usage statistics, and
+        ``response_cache.invalidate()`` to drop cached responses.
+        """
+        return self._response_cache
+
+    @property
+    def fieldset_cache(self):
+        # type: () -> Optional[FieldsetCache]
+        """The cache of schemas derived for sparse fieldsets, if any
+
+        Call ``fieldset_cache.stats()`` for usage statistics.
+        """
+        return self._fieldset_cache
 
     @staticmethod
     def _get_specific_schema(resource, method, msg_type):
@@ -248,6 +914,320 @@ class Marshmallow:
             return specific_schema
         return getattr(resource, 'schema', None)
 
+    @staticmethod
+    def _get_many(resource, method):
+        # type: (object, str) -> Optional[bool]
+        """Return whether a resource expects collections in requests
+
+        Like schemas, this may be specified for requests with a given
+        method, for all messages with a given method, or generally, e.g.
+        with ``post_request_many``, ``post_many``, or ``many``.
+
+        Return ``None`` if the resource does not specify it
+
+        :param resource: the resource object passed to
+            ``process_resource``
+        :param method: the (case-insensitive) HTTP method used
+            for the request, e.g. 'GET' or 'POST'
+        """
+        method = method.lower()
+        for attr in ('%s_request_many' % method, '%s_many' % method, 'many'):
+            many = getattr(resource, attr, None)
+            if many is not None:
+                return many
+        return None
+
+    def _get_max_errors(self, resource, method):
+        # type: (object, str) -> Optional[int]
+        """Return the number of errors after which to reject a request
+
+        Resources may set this for requests with a given method, or for
+        all of their requests, e.g. with ``post_max_errors`` or
+        ``max_errors``. Otherwise, the ``max_errors`` passed to the
+        constructor applies.
+
+        :param resource: the resource object passed to
+            ``process_resource``
+        :param method: the (case-insensitive) HTTP method used
+            for the request, e.g. 'GET' or 'POST'
+        """
+        method = method.lower()
+        for attr in ('%s_max_errors' % method, 'max_errors'):
+            max_errors = getattr(resource, attr, None)
+            if max_errors is not None:
+                return max_errors
+        return self._max_errors
+
+    def _resolve_schema(self, resource, method, msg_type):
+        # type: (object, str, str) -> Optional[Schema]
+        """Return the cached schema for a resource, method, and message
+
+        The first lookup for a given ``(resource, method, msg_type)``
+        combination goes through ``_get_schema`` and validates that any
+        schema found is an instantiated Marshmallow schema. The result
+        (including ``None``, if there is no schema) is cached, so that
+        subsequent requests skip both the attribute lookups and the
+        type check.
+
+        Resources are cached by instance rather than by class, since
+        schemas may be assigned to resource instances (see
+        ``_get_cached_schemas``).
+
+        If a resource swaps its schemas at runtime, call
+        ``invalidate_schema_cache`` afterwards.
+
+        :param resource: the resource object passed to
+            ``process_response`` or ``process_resource``
+        :param method: the HTTP method used for the request
+        :param msg_type: a string 'request' or 'response'
+
+        :raises TypeError: if the schema found is not an instantiated
+            Marshmallow schema
+        """
+        schemas = self._get_cached_schemas(resource)
+        key = (method.upper(), msg_type)
+        try:
+            return schemas[key]
+        except KeyError:
+            pass
+
+        sch = self._validate_schema(
+            self._get_schema(resource, method, msg_type)
+        )
+        if sch is not None and self._compile_schemas:
+            # Pay the cost of compilation up front
+            if msg_type == 'request':
+                get_compiled_loader(sch)
+            else:
+                get_compiled_serializer(sch)
+        schemas[key] = sch
+        return sch
+
+    def _get_cached_schemas(self, resource):
+        # type: (object) -> dict
+        """Return the cached schema lookups of a resource
+
+        The lookups are a dict of ``(method, msg_type)`` to schema,
+        which is dropped along with the resource. Resources which
+        cannot be weakly referenced (or hashed), such as instances of
+        classes with ``__slots__``, are kept by id instead, and so are
+        kept alive until ``invalidate_schema_cache`` is called for them.
+        """
+        try:
+            schemas = self._schema_cache.get(resource)
+        except TypeError:
+            entry = self._pinned_schema_cache.get(id(resource))
+            if entry is None:
+                entry = self._pinned_schema_cache.setdefault(
+                    id(resource), (resource, {})
+                )
+            return entry[1]
+        if schemas is None:
+            schemas = self._schema_cache.setdefault(resource, {})
+        return schemas
+
+    @staticmethod
+    def _validate_schema(sch):
+        # type: (object) -> Optional[Schema]
+        """Ensure that a schema is either ``None`` or a Schema instance
+
+        :raises TypeError: if the schema is not an instantiated
+            Marshmallow schema
+        """
+        if sch is not None and not isinstance(sch, Schema):
+            raise TypeError(
+                'The schema and <method>_schema properties of a resource '
+                'must be instantiated Marshmallow schemas.'
+            )
+        return sch
+
+    def invalidate_schema_cache(self, resource=None):
+        # type: (Optional[object]) -> None
+        """Drop cached schema lookups
+
+        :param resource: if provided, only drop cached lookups for
+            this resource. Otherwise, drop all cached lookups.
+        """
+        log.debug('Marshmallow.invalidate_schema_cache(%s)', resource)
+        if resource is None:
+            self._schema_cache.clear()
+            self._pinned_schema_cache.clear()
+            return
+        try:
+            self._schema_cache.pop(resource, None)
+        except TypeError:
+            self._pinned_schema_cache.pop(id(resource), None)
+
+    def prepare(self, app):
+        # type: (Any) -> List[Dict[str, Any]]
+        """Look up, validate, and warm up the schemas of an app's routes
+
+        Call this once every route has been added to the app, before it
+        serves requests. The schemas of every resource are looked up for
+        each of its responders, so that a misconfigured schema fails at
+        startup rather than on the first request for it, and so that no
+        request pays for the lookups (see ``_resolve_schema``). Schemas
+        are then warmed up: their nested schemas are instantiated, they
+        are compiled if ``compile_schemas`` is enabled, and a clone of
+        each is pooled if ``schema_pool_size`` is set.
+
+        :param app: the Falcon app using this middleware, which must use
+            Falcon's default router
+
+        :return: a report with an entry for each route and method, each
+            a dict with the ``route`` (its URI template), the ``method``,
+            the ``resource``, and its ``request_schema`` and
+            ``response_schema`` (``None`` if there are none)
+
+        :raises TypeError: if a schema is not an instantiated Marshmallow
+            schema, or if the routes of the app cannot be discovered
+        """
+        log.debug('Marshmallow.prepare(%s)', app)
+        report = []
+        warmed = set()  # type: set
+        for route, resource, methods in iter_routes(app):
+            for method in methods:
+                entry = {
+                    'route': route,
+                    'method': method,
+                    'resource': resource,
+                }
+                for msg_type in ('request', 'response'):
+                    try:
+                        sch = self._resolve_schema(resource, method, msg_type)
+                    except TypeError as exc:
+                        raise TypeError('%s %s: %s' % (method, route, exc))
+                    if sch is not None and sch not in warmed:
+                        self._warm_schema(sch)
+                        warmed.add(sch)
+                    entry['%s_schema' % msg_type] = sch
+                report.append(entry)
+        log.info(
+            'Prepared %d schemas for %d responders', len(warmed), len(report)
+        )
+        return report
+
+    def _warm_schema(self, sch):
+        # type: (Schema) -> None
+        """Pay the lazy initialization costs of a declared schema
+
+        Compilation is already taken care of by ``_resolve_schema``.
+        """
+        if self._schema_pool is not None:
+            with self._schema_pool.borrow(sch):
+                pass
+        self._warm_nested(sch, set())
+
+    @classmethod
+    def _warm_nested(cls, sch, seen):
+        # type: (Schema, set) -> None
+        """Instantiate the nested schemas of a schema, recursively
+
+        Schema classes are only visited once, so that self-nesting
+        schemas do not recurse forever.
+        """
+        seen.add(type(sch))
+        for field in sch.fields.values():
+            if isinstance(field, fields.Nested):
+                nested = field.schema
+                if type(nested) not in seen:
+                    cls._warm_nested(nested, seen)
+
+    def _load_body(self,
+                   req,  # type: Request
+                   max_size=None,  # type: Optional[int]
+                   metrics=NULL_REQUEST_METRICS,  # type: RequestMetrics
+                   ):
+        # type: (...) -> object
+        """Parse the request body as JSON
+
+        If ``stream_json`` is enabled and no other middleware has
+        stashed the body already, parse it incrementally from
+        ``req.bounded_stream``. Otherwise, parse the stashed body,
+        incrementally if it was spooled to disk.
+
+        If there is a codec registry, the body is parsed with the codec
+        for the request's Content-Type instead, or the registry's
+        default codec if the Content-Type is not recognized, unless
+        that codec is for JSON.
+
+        :param req: the request
+        :param max_size: the maximum Content-Length, in bytes, or
+            ``None`` for no limit
+        :param metrics: the recorder of the request's measurements.
+            Reading and parsing are timed separately, unless the body
+            is parsed as it is read.
+
+        :raises UnicodeDecodeError: if the body is not valid UTF-8
+        :raises ValueError: if the body is not valid JSON, or valid for
+            its codec
+        :raises HTTPPayloadTooLarge: if the request's content length
+            exceeds ``max_size``
+        """
+        codec = self._get_request_codec(req)
+        if codec is not None:
+            content = self._read_body(req, max_size, metrics)
+            with metrics.time('parse'):
+                return codec.loads(content)
+
+        if self._stream_json and req.context.get(CONTENT_KEY) is None:
+            check_content_length(req, max_size)
+            with metrics.time('parse'):
+                return load_json_stream(
+                    req.bounded_stream,
+                    self._backend.module,
+                    self._stream_chunk_size,
+                )
+
+        content = self._read_body(req, max_size, metrics)
+        with metrics.time('parse'):
+            if is_spooled(content):
+                return load_json_stream(
+                    get_stashed_stream(req),
+                    self._backend.module,
+                    self._stream_chunk_size,
+                )
+            return self._backend.loads(content)
+
+    def _read_body(self, req, max_size, metrics):
+        # type: (Request, Optional[int], RequestMetrics) -> BodyContent
+        """Return the stashed request body, reading it if need be
+
+        Only actually reading the body is timed, not getting a body
+        which another middleware has already read.
+        """
+        if req.context.get(CONTENT_KEY) is not None:
+            return get_stashed_content(req)
+        with metrics.time('read'):
+            return get_stashed_content(req, self._spool_threshold, max_size)
+
+    def _load_ndjson(self, req, sch, max_size=None):
+        # type: (Request, Optional[Schema], Optional[int]) -> Iterator
+        """Return a generator of the records of an NDJSON request body
+
+        The body is read from ``req.bounded_stream`` as records are
+        consumed, unless another middleware has stashed it already.
+
+        :raises HTTPPayloadTooLarge: if the request's content length
+            exceeds ``max_size``
+        """
+        if req.context.get(CONTENT_KEY) is None:
+            check_content_length(req, max_size)
+            stream = req.bounded_stream
+        else:
+            stream = get_stashed_stream(req)
+
+        if sch is None:
+            def load(record):
+                return record, {}
+        else:
+            def load(record):
+                return self._load_schema(sch, record, many=False)
+
+        return load_ndjson_stream(
+            stream, load, self._backend.loads, self._stream_chunk_size
+        )
+
     def process_resource(self, req, resp, resource, params):
         # type: (Request, Response, object, dict) -> None
         """Deserialize request body with any resource-specific schemas
@@ -259,11 +1239,50 @@ class Marshmallow:
         If a Marshmallow schema is defined on the passed ``resource``,
         use it to deserialize the request body.
 
+        The body is loaded as a collection of objects (``many=True``)
+        if the schema is a ``many`` schema, if the resource sets a flag
+        such as ``post_request_many = True`` (see ``_get_many``), or if
+        the body is a JSON array and the class was instantiated with
+        ``auto_many=True``. Errors for collections are indexed by the
+        position of the invalid items. See ``partial_many`` for
+        accepting partially valid collections.
+
         If no schema is defined and the class was instantiated with
         ``force_json=True``, request data will be deserialized with
         any ``json_module`` passed to the class constructor or
         ``simplejson`` by default.
 
+        If the class was instantiated with ``ndjson=True``,
+        newline-delimited JSON bodies (with a Content-Type of
+        ``application/x-ndjson``) are not read up front. Instead, a
+        generator is stored under ``req_key``, which reads the body as
+        it is consumed, and yields each record loaded with the schema
+        (or just parsed, without one), or a
+        ``falcon_marshmallow.streaming.RecordError`` giving the line
+        number and errors of a record which is invalid. Invalid records
+        therefore do not result in a 422.
+
+        Request bodies may be no larger than ``max_body_size``, unless
+        the resource sets its own limit for requests with a given
+        method or for all of its requests, e.g. with
+        ``post_max_body = 10 * 1024 * 1024`` or ``max_body``. Bodies
+        with a larger Content-Length are rejected with a 413 before any
+        of them is read. Bodies without a Content-Length are not read
+        here, but ``req.stream`` is replaced with a
+        ``falcon_marshmallow.body.LimitedStream``, so that reading more
+        than the limit from it also results in a 413.
+
+        Resources may likewise override ``max_errors``, e.g. with
+        ``post_max_errors = 10`` or ``max_errors``, to have their
+        requests rejected once that many errors are found (see
+        ``falcon_marshmallow.validation.load_fail_fast``). Requests
+        with that many errors are rejected even with ``partial_many``.
+
+        If the class was instantiated with a ``metrics`` sink, the
+        time taken to read, parse and load the body, and its size, are
+        reported to it. NDJSON bodies, which are loaded lazily, are
+        only measured by size.
+
         :param falcon.Request req: the request object
         :param falcon.Response resp: the response object
         :param object resource: the resource object
@@ -272,51 +1291,103 @@ class Marshmallow:
         :rtype: None
         :raises falcon.HTTPBadRequest: if the data cannot be
             deserialized or decoded
+        :raises falcon.HTTPUnprocessableEntity: if the data fails
+            validation
+        :raises falcon.HTTPPayloadTooLarge: if the request body is too
+            large
         """
         log.debug(
             'Marshmallow.process_resource(%s, %s, %s, %s)',
             req, resp, resource, params
         )
-        if req.content_length in (None, 0):
+        max_size = get_max_body_size(
+            resource, req.method, self._max_body_size
+        )
+        # Once another middleware has read the body (and e.g.
+        # decompressed it), its size is that of the stashed content
+        size = get_body_size(req)
+        if size is None:
+            limit_stream(req, max_size)
+            return
+        if size == 0:
             return
+        # Even if another middleware has read the body already, do not
+        # go on to parse one which is too large for this resource
+        check_content_length(req, max_size)
 
-        sch = self._get_schema(resource, req.method, 'request')
+        metrics = self._metrics.request(resource, req.method)
+        metrics.size('request', size)
 
-        if sch is not None:
-            if not isinstance(sch, Schema):
-                raise TypeError(
-                    'The schema and <method>_schema properties of a resource '
-                    'must be instantiated Marshmallow schemas.'
-                )
+        sch = self._resolve_schema(resource, req.method, 'request')
+
+        if (self._ndjson and is_ndjson(req.content_type) and
+                (sch is not None or self._force_json)):
+            req.context[self._req_key] = self._load_ndjson(
+                req, sch, max_size
+            )
+            return
 
+        if sch is not None:
             try:
-                body = get_stashed_content(req)
-                parsed = self._json.loads(body)
+                parsed = self._load_body(req, max_size, metrics)
             except UnicodeDecodeError:
                 raise HTTPBadRequest('Body was not encoded as UTF-8')
-            except self._json.JSONDecodeError:
-                raise HTTPBadRequest('Request must be valid JSON')
-
-            data, errors = sch.load(parsed)
+            except ValueError:
+                raise HTTPBadRequest(
+                    'Request must be valid %s' % self._get_format(req)
+                )
 
-            if errors:
-                raise HTTPUnprocessableEntity(
-                    description=self._json.dumps(errors)
+            many = self._get_many(resource, req.method)
+            if many is None:
+                many = sch.many or (
+                    self._auto_many and isinstance(parsed, list)
                 )
 
+            max_errors = self._get_max_errors(resource, req.method)
+            with metrics.time('load'):
+                if (max_errors is not None and many and
+                        isinstance(parsed, list)):
+                    data, errors, stopped = load_fail_fast(
+                        partial(self._load_schema, sch, many=True),
+                        parsed,
+                        max_errors,
+                    )
+                else:
+                    data, errors = self._load_schema(sch, parsed, many)
+                    stopped = False
+
+            if (errors and max_errors is not None and
+                    (stopped or len(errors) >= max_errors)):
+                errors, truncated = truncate_errors(errors, max_errors)
+                raise HTTPUnprocessableEntity(description=dump_errors(
+                    errors,
+                    self._json.dumps,
+                    self._max_error_size,
+                    truncated or stopped,
+                ))
+
+            if errors and many and self._partial_many:
+                data, errors = self._split_invalid(data, errors)
+                req.context[self._errors_key] = errors
+
+            if errors and not (many and self._partial_many and data):
+                raise HTTPUnprocessableEntity(description=dump_errors(
+                    errors, self._json.dumps, self._max_error_size
+                ))
+
             req.context[self._req_key] = data
 
         elif self._force_json:
-
-            body = get_stashed_content(req)
             try:
-                req.context[self._req_key] = self._json.loads(body)
+                req.context[self._req_key] = self._load_body(
+                    req, max_size, metrics
+                )
             except (ValueError, UnicodeDecodeError):
                 raise HTTPBadRequest(
                     description=(
                         'Could not decode the request body, either because '
-                        'it was not valid JSON or because it was not encoded '
-                        'as UTF-8.'
+                        'it was not valid %s or because it was not encoded '
+                        'as UTF-8.' % self._get_format(req)
                     )
                 )
 
@@ -331,10 +1402,38 @@ class Marshmallow:
         If a Marshmallow schema is defined for the given ``resource``,
         use it to serialize the result.
 
+        If the result is an iterator, such as a generator or a database
+        cursor, it is serialized as a JSON array ``stream_batch_size``
+        items at a time (using ``many=True`` for schemas), and the
+        resulting chunks are set as ``resp.stream`` instead.
+
         If no schema is defined and the class was instantiated with
         ``force_json=True``, request data will be serialized with
         any ``json_module`` passed to the class constructor or
         ``simplejson`` by default.
+        Otherwise, the response is left to the responder, and neither
+        its Content-Type nor its headers are changed.
+
+        If the class was instantiated with ``etags=True``, successful
+        responses to GET and HEAD requests get an ``ETag`` header, and
+        a ``304 Not Modified`` status with no body if the request's
+        ``If-None-Match`` header matches it. If the responder set the
+        ETag itself or provided a version key, the result is not
+        serialized when it has not been modified.
+
+        If the class was instantiated with a ``response_cache`` and the
+        responder provided a cache key or a version key, the serialized
+        result is cached, and served from the cache on later requests
+        with the same key.
+
+        If the class was instantiated with a ``fields_param`` or an
+        ``exclude_param`` and the request selects fields with them, the
+        result is dumped with a schema derived from the resource's
+        schema for those fields, taken from the ``fieldset_cache``.
+
+        If the class was instantiated with a ``metrics`` sink, the
+        time taken to dump and encode the result, and the size of the
+        body, are reported to it. Streamed results are not measured.
 
         :param falcon.Request req: the request object
         :param falcon.Response resp: the response object
@@ -343,6 +1442,8 @@ class Marshmallow:
 
         :raises falcon.HTTPInternalServerError: if the data found
             in the ``req.context`` object cannot be serialized
+        :raises falcon.HTTPBadRequest: if the request selects fields
+            which the schema does not have
         """
         log.debug(
             'Marshmallow.process_response(%s, %s, %s, %s)',
@@ -351,34 +1452,455 @@ class Marshmallow:
         if self._resp_key not in req.context:
             return
 
-        sch = self._get_schema(resource, req.method, 'response')
+        sch = self._resolve_schema(resource, req.method, 'response')
+        if sch is None and not self._force_json:
+            # The result is left for the responder to serialize, so
+            # neither negotiate a media type nor handle ETags for it
+            return
+        result = req.context[self._resp_key]
+
+        fieldset = None
+        if sch is not None:
+            fieldset = self._get_fieldset(req)
+            if fieldset is not None:
+                sch = self._select_fields(sch, fieldset)
+
+        codec = None
+        if not isinstance(result, Iterator):
+            codec = self._get_response_codec(req, resp)
+
+        conditional = (
+            self._is_conditional(req, resp) and
+            not isinstance(result, Iterator)
+        )
+        if conditional and self._known_not_modified(
+                req, resp, codec, fieldset):
+            return
 
+        metrics = self._metrics.request(resource, req.method)
         if sch is not None:
-            if not isinstance(sch, Schema):
-                raise TypeError(
-                    'The schema and <method>_schema properties of a resource '
-                    'must be instantiated Marshmallow schemas.'
+            if isinstance(result, Iterator):
+                resp.stream = dump_json_stream(
+                    result,
+                    lambda batch: self._dump_schema(sch, batch, many=True),
+                    self._stream_batch_size,
                 )
+            else:
+                data = self._dump_cached(
+                    req, resp, sch, result, codec, fieldset, metrics
+                )
+                metrics.body_size('response', data)
+                self._set_body(resp, data, req if conditional else None)
 
-            data, errors = sch.dumps(req.context[self._resp_key])
+        else:
+            if isinstance(result, Iterator):
+                resp.stream = dump_json_stream(
+                    result, self._dump_json, self._stream_batch_size
+                )
+            else:
+                data = self._dump_cached(
+                    req, resp, None, result, codec, metrics=metrics
+                )
+                metrics.body_size('response', data)
+                self._set_body(resp, data, req if conditional else None)
+
+    def _profile_resource(self, req, resp, resource, params):
+        # type: (Request, Response, object, dict) -> None
+        """Call ``process_resource``, profiling it if the profiler says so
 
-            if errors:
-                raise HTTPInternalServerError(
-                    title='Could not serialize response',
-                    description=json.dumps(errors)
+        The profile is kept on the request, so that it goes on in
+        ``process_response``.
+        """
+        profile = self._profiler.start(req)
+        if profile is None:
+            type(self).process_resource(self, req, resp, resource, params)
+            return
+        with self._profiler.enabled(req, profile):
+            type(self).process_resource(self, req, resp, resource, params)
+
+    def _profile_response(self, req, resp, resource, req_succeeded):
+        # type: (Request, Response, object, bool) -> None
+        """Call ``process_response``, then write the request's profile
+
+        The request is only profiled if it was selected by
+        ``_profile_resource``, and its profile was not dropped since.
+        """
+        profile = req.context.get(PROFILE_KEY)
+        if profile is None:
+            type(self).process_response(
+                self, req, resp, resource, req_succeeded
+            )
+            return
+        try:
+            with self._profiler.enabled(req, profile):
+                type(self).process_response(
+                    self, req, resp, resource, req_succeeded
                 )
+        finally:
+            # Unless the profile was dropped, for another being enabled
+            if req.context.get(PROFILE_KEY) is profile:
+                self._profiler.write(req, resource, profile)
+
+    def _get_request_codec(self, req):
+        # type: (Request) -> Optional[Codec]
+        """Return the codec with which to parse a request body
+
+        Return ``None`` if the body should be parsed as JSON with the
+        JSON backend, as it is without a codec registry. Otherwise,
+        return the codec for the request's Content-Type, or the
+        registry's default codec if it is not recognized.
+        """
+        if self._codecs is None:
+            return None
+        codec = self._codecs.get(req.content_type) or self._codecs.default
+        if codec is None or isinstance(codec, JSONCodec):
+            return None
+        return codec
+
+    def _get_format(self, req):
+        # type: (Request) -> str
+        """Return the name of the format a request body is parsed from
+
+        This is ``JSON``, or the media type of the request's codec.
+        """
+        codec = self._get_request_codec(req)
+        return 'JSON' if codec is None else codec.media_type
+
+    def _get_response_codec(self, req, resp):
+        # type: (Request, Response) -> Optional[Codec]
+        """Return the codec negotiated for a response
+
+        Return ``None`` if the response should be serialized as JSON
+        with the JSON backend, as it is without a codec registry. The
+        response's Content-Type is set for other codecs.
+        """
+        if self._codecs is None:
+            return None
+        resp.append_header('Vary', 'Accept')
+        codec = self._codecs.negotiate(req.get_header('Accept'))
+        if codec is None or isinstance(codec, JSONCodec):
+            return None
+        resp.content_type = codec.media_type
+        return codec
+
+    def _get_fieldset(self, req):
+        # type: (Request) -> Optional[tuple]
+        """Return the fields selected by a request, if any
+
+        Return ``(only, exclude)``, where each is a frozen set of the
+        field names listed in the corresponding query parameter, or
+        ``None`` if it is not given. Return ``None`` if neither is.
+        """
+        if self._fieldset_cache is None:
+            return None
+        only = self._get_field_names(req, self._fields_param)
+        exclude = self._get_field_names(req, self._exclude_param)
+        if only is None and exclude is None:
+            return None
+        return only, exclude
 
+    @staticmethod
+    def _get_field_names(req, param):
+        # type: (Request, Optional[str]) -> Optional[FrozenSet[str]]
+        """Return the comma-separated field names in a query parameter
+
+        The parameter may also be repeated. Commas are split here, since
+        Falcon only does so if ``auto_parse_qs_csv`` is enabled.
+        """
+        if param is None:
+            return None
+        values = req.get_param_as_list(param)
+        if values is None:
+            return None
+        return frozenset(
+            name.strip() for value in values for name in value.split(',')
+            if name.strip()
+        )
+
+    def _select_fields(self, sch, fieldset):
+        # type: (Schema, tuple) -> Schema
+        """Return the schema derived from ``sch`` for a fieldset
+
+        :raises falcon.HTTPBadRequest: if a field name is unknown
+        """
+        try:
+            return self._fieldset_cache.get(sch, *fieldset)
+        except ValueError as exc:
+            raise HTTPBadRequest(
+                description='Could not select the requested fields: %s' % exc
+            )
+
+    def _get_cache_key(self, req, resp, fieldset=None):
+        # type: (Request, Response, Optional[tuple]) -> Optional[Hashable]
+        """Return the key under which to cache a result, if any
+
+        A key provided by the responder is used as it is. Otherwise,
+        the key is made of the request's URI and version, as well as
+        anything else which may change the result for the same URI:
+        the selected ``fieldset``, the client's credentials, and the
+        request headers the response varies on (e.g. Accept, with a
+        codec registry). Responses varying on everything (``Vary: *``)
+        are not cached.
+        """
+        if self._response_cache is None:
+            return None
+        if self._cache_key in req.context:
+            return req.context[self._cache_key]
+        if self._version_key not in req.context:
+            return None
+
+        names = set(_CREDENTIAL_HEADERS)
+        for name in (resp.get_header('Vary') or '').split(','):
+            names.add(name.strip().lower())
+        if '*' in names:
+            return None
+        names.discard('')
+        return (
+            req.relative_uri,
+            req.context[self._version_key],
+            fieldset,
+            tuple((name, req.get_header(name)) for name in sorted(names)),
+        )
+
+    def _dump_cached(self,
+                     req,  # type: Request
+                     resp,  # type: Response
+                     sch,  # type: Optional[Schema]
+                     result,  # type: object
+                     codec=None,  # type: Optional[Codec]
+                     fieldset=None,  # type: Optional[tuple]
+                     metrics=NULL_REQUEST_METRICS,  # type: RequestMetrics
+                     ):
+        # type: (...) -> Any
+        """Serialize a result, through the response cache if possible
+
+        The result is serialized with the schema, or with the JSON
+        backend (or ``codec``, if given) if there is no schema. Results
+        served from the cache are neither dumped nor encoded, so no
+        time is recorded for those stages.
+        """
+        key = self._get_cache_key(req, resp, fieldset)
+        media_type = None if codec is None else codec.media_type
+        if key is not None:
+            data = self._response_cache.get(sch, key, media_type)
+            if data is not None:
+                return data
+
+        if sch is None:
+            with metrics.time('encode'):
+                data = self._dump_json(result, codec)
+        else:
+            data = self._dump_schema(
+                sch, result, codec=codec, metrics=metrics
+            )
+
+        if key is not None:
+            self._response_cache.set(sch, key, data, media_type)
+        return data
+
+    def _is_conditional(self, req, resp):
+        # type: (Request, Response) -> bool
+        """Return whether to handle ETags for a response"""
+        return (
+            self._etags and
+            req.method in ('GET', 'HEAD') and
+            str(resp.status).startswith('200')
+        )
+
+    def _known_not_modified(self, req, resp, codec=None, fieldset=None):
+        # type: (Request, Response, Optional[Codec], Optional[tuple]) -> bool
+        """Respond with a 304 if a known ETag matches the request
+
+        The ETag is known if the responder has set it, or has stored
+        a version key on the request context, in which case the ETag is
+        computed from it (and the media type of ``codec`` and the
+        selected ``fieldset``, if given) and set. Return whether the
+        response was turned into a 304, in which case there is nothing
+        to serialize.
+        """
+        etag = resp.get_header('ETag')
+        if etag is None and self._version_key in req.context:
+            version = '%s' % req.context[self._version_key]
+            if codec is not None:
+                version = '%s;%s' % (version, codec.media_type)
+            if fieldset is not None:
+                only, exclude = fieldset
+                version = '%s;only=%s;exclude=%s' % (
+                    version,
+                    '*' if only is None else ','.join(sorted(only)),
+                    ','.join(sorted(exclude or ())),
+                )
+            etag = make_etag(version)
+            resp.set_header('ETag', etag)
+        if etag is None:
+            return False
+        return self._not_modified(req, resp, etag)
+
+    @staticmethod
+    def _not_modified(req, resp, etag):
+        # type: (Request, Response, str) -> bool
+        """Respond with a 304 if an ETag matches the request
+
+        Return whether it did.
+        """
+        if not etag_matches(req.get_header('If-None-Match'), etag):
+            return False
+        resp.status = HTTP_304
+        return True
+
+    def _set_body(self, resp, data, req=None):
+        # type: (Response, Union[bytes, str], Optional[Request]) -> None
+        """Set serialized data as the response body
+
+        Bytes are written directly to ``resp.data``, so that Falcon
+        does not need to encode them.
+
+        If a request is passed, the response is made conditional: unless
+        the response already has an ETag, one is computed from the
+        data, and if it matches the request, no body is set and the
+        status is set to 304.
+        """
+        if req is not None and resp.get_header('ETag') is None:
+            etag = make_etag(data)
+            resp.set_header('ETag', etag)
+            if self._not_modified(req, resp, etag):
+                return
+
+        if isinstance(data, bytes):
+            resp.data = data
+        else:
             resp.body = data
 
-        elif self._force_json:
-            try:
-                resp.body = self._json.dumps(req.context[self._resp_key])
-            except TypeError:
-                raise HTTPInternalServerError(
-                    title='Could not serialize response',
-                    description=(
-                        'The server attempted to serialize an object that '
-                        'cannot be serialized. This is likely a server-side '
-                        'bug.'
-                    )
+    @staticmethod
+    def _has_own_json_module(sch):
+        # type: (Schema) -> bool
+        """Return whether a schema's Meta specifies a json module"""
+        meta = getattr(sch, 'Meta', None)
+        return (
+            hasattr(meta, 'json_module') or hasattr(meta, 'render_module')
+        )
+
+    @contextmanager
+    def _borrow_schema(self, sch):
+        # type: (Schema) -> Generator[Schema, None, None]
+        """Provide the schema to use in place of a declared schema
+
+        This is a clone from the schema pool if pooling is enabled, or
+        the declared schema itself otherwise.
+        """
+        if self._schema_pool is None:
+            yield sch
+        else:
+            with self._schema_pool.borrow(sch) as clone:
+                yield clone
+
+    @staticmethod
+    def _split_invalid(data, errors):
+        # type: (list, dict) -> Tuple[list, dict]
+        """Remove invalid items from a loaded collection
+
+        Return the valid items and the errors. If there are errors
+        which do not belong to an item (e.g. from a schema validator),
+        the collection as a whole is invalid, and no items are returned.
+        """
+        if not all(isinstance(index, int) for index in errors):
+            return [], errors
+        return [
+            item for index, item in enumerate(data) if index not in errors
+        ], errors
+
+    def _load_schema(self, sch, data, many=None):
+        # type: (Schema, object, Optional[bool]) -> Tuple[Any, dict]
+        """Deserialize and validate parsed data with a schema
+
+        Large collections are loaded in the process pool, if there is
+        one and the schema is registered with it. Otherwise, the
+        schema's compiled loader is used if ``compile_schemas`` is
+        enabled and the schema could be compiled.
+        """
+        pool = self._process_pool
+        if (pool is not None and (sch.many if many is None else many) and
+                pool.should_run(sch, data)):
+            return pool.load(sch, data)
+
+        with self._borrow_schema(sch) as sch:
+            if self._compile_schemas:
+                loader = get_compiled_loader(sch)
+                if loader is not None:
+                    return loader.load(data, many=many)
+            return sch.load(data, many=many)
+
+    def _dump_schema(self,
+                     sch,  # type: Schema
+                     obj,  # type: object
+                     many=None,  # type: Optional[bool]
+                     codec=None,  # type: Optional[Codec]
+                     metrics=NULL_REQUEST_METRICS,  # type: RequestMetrics
+                     ):
+        # type: (...) -> Any
+        """Serialize an object with a schema
+
+        The schema (or its compiled serializer, if ``compile_schemas``
+        is enabled, or the process pool, for large collections) dumps
+        the object to primitives, which are then encoded with
+        ``codec``, if given, or else with the configured JSON backend,
+        unless the schema specifies its own json module, in which case
+        that is used. Dumping and encoding are timed separately, except
+        with the schema's own json module, which does both at once.
+
+        :raises falcon.HTTPInternalServerError: if the schema reports
+            errors serializing the object
+        """
+        own_json_module = codec is None and self._has_own_json_module(sch)
+        pool = self._process_pool
+        with metrics.time('dump'):
+            if (pool is not None and not own_json_module and
+                    (sch.many if many is None else many) and
+                    pool.should_run(sch, obj)):
+                data, errors = pool.dump(sch, obj)
+            else:
+                with self._borrow_schema(sch) as sch:
+                    serializer = None
+                    if self._compile_schemas and not own_json_module:
+                        serializer = get_compiled_serializer(sch)
+
+                    if own_json_module:
+                        data, errors = sch.dumps(obj, many=many)
+                    elif serializer is not None:
+                        data, errors = serializer.dump(obj, many=many)
+                    else:
+                        data, errors = sch.dump(obj, many=many)
+
+        if errors:
+            raise HTTPInternalServerError(
+                title='Could not serialize response',
+                description=json.dumps(errors)
+            )
+
+        if own_json_module:
+            return data
+        with metrics.time('encode'):
+            if codec is not None:
+                return codec.dumps(data)
+            return self._backend.dumps(data)
+
+    def _dump_json(self, obj, codec=None):
+        # type: (object, Optional[Codec]) -> Union[bytes, str]
+        """Serialize an object with the JSON backend, or ``codec``
+
+        :raises falcon.HTTPInternalServerError: if the object cannot
+            be serialized
+        """
+        try:
+            if codec is not None:
+                return codec.dumps(obj)
+            return self._backend.dumps(obj)
+        except TypeError:
+            raise HTTPInternalServerError(
+                title='Could not serialize response',
+                description=(
+                    'The server attempted to serialize an object that '
+                    'cannot be serialized. This is likely a server-side '
+                    'bug.'
                 )
+            )
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Loading and dumping of large collections in a process pool
+
+Marshmallow (de)serialization is CPU-bound pure Python, so because of
+the GIL a very large ``load`` or ``dump`` occupies a whole core and
+starves every other thread in the worker. A ``ProcessPool`` splits
+large collections into batches, which are (de)serialized in separate
+processes, and reassembles the results in order.
+
+Schemas are registered with the pool up front and sent to each worker
+process once, when it starts. Anything the pool cannot handle (schemas
+which were not registered, small collections, objects which cannot be
+pickled, or a pool which cannot be started) is (de)serialized in the
+calling process as usual.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import io
+import logging
+import pickle
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Third party
+from marshmallow import Schema
+from marshmallow.utils import missing
+
+try:
+    import copyreg
+except ImportError:  # pragma: no cover
+    import copy_reg as copyreg
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+except ImportError:  # pragma: no cover
+    # Python 2 without the ``futures`` backport
+    ProcessPoolExecutor = None
+    BrokenProcessPool = None
+
+
+log = logging.getLogger(__name__)
+
+
+#: The default number of items above which collections are sent to the pool
+DEFAULT_MIN_ITEMS = 10000
+#: The default number of items (de)serialized by a worker at a time
+DEFAULT_BATCH_SIZE = 1000
+
+
+# Schemas registered with the pool, in each worker process
+_worker_schemas = {}  # type: Dict[int, Schema]
+
+
+def _get_missing():
+    # type: () -> object
+    """Return marshmallow's ``missing`` sentinel"""
+    return missing
+
+
+def pickle_schema(schema):
+    # type: (Schema) -> bytes
+    """Pickle a schema instance
+
+    Marshmallow compares values with its ``missing`` sentinel by
+    identity, so the sentinel is pickled by reference, rather than as
+    a new instance, which would not be recognized.
+    """
+    buf = io.BytesIO()
+    pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = copyreg.dispatch_table.copy()
+    pickler.dispatch_table[type(missing)] = lambda _: (_get_missing, ())
+    pickler.dump(schema)
+    return buf.getvalue()
+
+
+def _init_worker(schemas):
+    # type: (Dict[int, bytes]) -> None
+    """Unpickle the registered schemas in a new worker process"""
+    _worker_schemas.clear()
+    for key, pickled in schemas.items():
+        _worker_schemas[key] = pickle.loads(pickled)
+
+
+def _dump_batch(key, batch):
+    # type: (int, list) -> Tuple[list, dict]
+    """Dump a batch of objects with a registered schema"""
+    data, errors = _worker_schemas[key].dump(batch, many=True)
+    return data, errors
+
+
+def _load_batch(key, batch):
+    # type: (int, list) -> Tuple[list, dict]
+    """Load a batch of data with a registered schema"""
+    data, errors = _worker_schemas[key].load(batch, many=True)
+    return data, errors
+
+
+def is_batchable(schema):
+    # type: (Schema) -> bool
+    """Return whether a schema gives the same results in batches
+
+    This is not the case for schemas with processors or validators that
+    receive the whole collection (``pass_many=True``).
+    """
+    processors = getattr(schema, '__processors__', {})
+    return not any(
+        names for (_, pass_many), names in processors.items() if pass_many
+    )
+
+
+class ProcessPool:
+    """A pool of processes for loading and dumping large collections"""
+
+    def __init__(self,
+                 schemas=(),  # type: Sequence[Schema]
+                 processes=None,  # type: Optional[int]
+                 min_items=DEFAULT_MIN_ITEMS,  # type: int
+                 batch_size=DEFAULT_BATCH_SIZE,  # type: int
+                 ):
+        # type: (...) -> None
+        """Instantiate the pool
+
+        The worker processes are started when the pool is first used.
+
+        :param schemas: the schemas which may be used with the pool.
+            Further schemas may be registered with ``register``. Schemas
+            must be picklable, so their classes must be importable.
+        :param processes: the number of worker processes (default: the
+            number of CPUs)
+        :param min_items: collections with more items than this are
+            (de)serialized in the pool
+        :param batch_size: the number of items sent to a worker at a time
+        """
+        log.debug(
+            'ProcessPool.__init__(%s, %s, %s, %s)',
+            schemas, processes, min_items, batch_size
+        )
+        self.processes = processes
+        self.min_items = min_items
+        self.batch_size = batch_size
+        self.available = ProcessPoolExecutor is not None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._keys = {}  # type: Dict[Schema, int]
+        self._pickled = {}  # type: Dict[int, bytes]
+        for schema in schemas:
+            self.register(schema)
+
+    def register(self, schema):
+        # type: (Schema) -> bool
+        """Register a schema for use with the pool
+
+        Schemas should be registered at startup: registering a schema
+        once the pool has started restarts its worker processes.
+
+        :return: whether the schema was registered. Schemas which cannot
+            be pickled, or which cannot be (de)serialized in batches
+            (see ``is_batchable``), are not.
+        """
+        with self._lock:
+            if schema in self._keys:
+                return True
+            if not is_batchable(schema):
+                log.info('Schema %r cannot be used in batches', schema)
+                return False
+            try:
+                pickled = pickle_schema(schema)
+            except Exception:
+                log.exception('Schema %r cannot be pickled', schema)
+                return False
+            key = len(self._pickled)
+            self._keys[schema] = key
+            self._pickled[key] = pickled
+            self._shutdown()
+            return True
+
+    def is_registered(self, schema):
+        # type: (Schema) -> bool
+        """Return whether a schema has been registered"""
+        return schema in self._keys
+
+    def should_run(self, schema, items):
+        # type: (Schema, Any) -> bool
+        """Return whether to (de)serialize a collection in the pool"""
+        return (
+            self.available and
+            isinstance(items, (list, tuple)) and
+            len(items) > self.min_items and
+            schema in self._keys
+        )
+
+    def dump(self, schema, objs):
+        # type: (Schema, Sequence) -> Tuple[list, dict]
+        """Dump a collection with a schema, returning ``(data, errors)``
+
+        The result is that of ``schema.dump(objs, many=True)``.
+        """
+        return self._run(_dump_batch, schema, objs, schema.dump)
+
+    def load(self, schema, data):
+        # type: (Schema, Sequence) -> Tuple[list, dict]
+        """Load a collection with a schema, returning ``(data, errors)``
+
+        The result is that of ``schema.load(data, many=True)``.
+        """
+        return self._run(_load_batch, schema, data, schema.load)
+
+    def shutdown(self):
+        # type: () -> None
+        """Stop the worker processes
+
+        They are started again if the pool is used afterwards.
+        """
+        with self._lock:
+            self._shutdown()
+
+    def _shutdown(self):
+        # type: () -> None
+        """Stop the worker processes, with the lock held"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_executor(self):
+        # type: () -> Optional[ProcessPoolExecutor]
+        """Return the executor, starting it if necessary"""
+        with self._lock:
+            if self._executor is None and self.available:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        self.processes,
+                        initializer=_init_worker,
+                        initargs=(dict(self._pickled),),
+                    )
+                except Exception:
+                    log.exception(
+                        'Could not start the process pool; falling back '
+                        'to in-process (de)serialization'
+                    )
+                    self.available = False
+            return self._executor
+
+    def _run(self, func, schema, items, fallback):
+        # type: (Callable, Schema, Sequence, Callable) -> Tuple[list, dict]
+        """(De)serialize a collection in batches in the pool
+
+        If anything goes wrong, the collection is (de)serialized with
+        ``fallback`` in this process instead.
+        """
+        executor = self._get_executor() if self.should_run(
+            schema, items
+        ) else None
+        if executor is None:
+            data, errors = fallback(items, many=True)
+            return data, errors
+
+        key = self._keys[schema]
+        size = self.batch_size
+        try:
+            futures = [
+                executor.submit(func, key, list(items[start:start + size]))
+                for start in range(0, len(items), size)
+            ]
+            results = [future.result() for future in futures]
+        except Exception as exc:
+            log.warning(
+                'Could not use the process pool (%r); falling back to '
+                'in-process (de)serialization', exc
+            )
+            if isinstance(exc, BrokenProcessPool):
+                # A worker died; the pool is restarted on next use
+                self.shutdown()
+            data, errors = fallback(items, many=True)
+            return data, errors
+
+        return self._reassemble(results, size)
+
+    @staticmethod
+    def _reassemble(results, size):
+        # type: (List[Tuple[list, dict]], int) -> Tuple[list, dict]
+        """Combine the results of batches, re-indexing any errors"""
+        data = []  # type: list
+        errors = {}  # type: Dict[Any, Any]
+        for index, (batch_data, batch_errors) in enumerate(results):
+            data.extend(batch_data)
+            for item, item_errors in batch_errors.items():
+                if isinstance(item, int):
+                    item += index * size
+                errors[item] = item_errors
+        return data, errors
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Pools of schema clones, for sharing schemas safely between threads
+
+Resources typically declare a single schema instance, which is then
+used by every thread serving requests. Schemas are not thread-safe,
+however: ``Schema.context`` in particular is shared mutable state. A
+``SchemaPool`` hands each caller its own clone of a declared schema,
+and keeps released clones around for reuse.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import copy
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# Third party
+from marshmallow import fields, Schema
+
+
+log = logging.getLogger(__name__)
+
+
+#: The default maximum number of idle clones kept per schema
+DEFAULT_POOL_SIZE = 8
+
+
+def clone_schema(schema):
+    # type: (Schema) -> Schema
+    """Return a new instance of a schema with the same options and fields
+
+    The clone gets its own copies of the schema's fields (including any
+    options applied to them, e.g. by ``only``), and a shallow copy of
+    its ``context``, so that changes made to the context by one clone
+    are not seen by others.
+    """
+    clone = copy.copy(schema)
+    clone.context = dict(schema.context)
+    clone.declared_fields = copy.deepcopy(schema.declared_fields)
+    for field in clone.declared_fields.values():
+        # Bind the copied fields to the clone rather than the original
+        field.parent = None
+        if isinstance(field, fields.Nested):
+            # Nested schemas are created lazily and inherit the parent's
+            # context, so have the clone create its own
+            field._Nested__schema = None
+    clone._types_seen = set()
+    clone._update_fields(many=clone.many)
+    return clone
+
+
+def reset_context(schema, context):
+    # type: (Schema, dict) -> None
+    """Give a schema, and the nested schemas it has created, a context
+
+    The nested schemas share the same ``context`` dict, as they do when
+    Marshmallow creates them with a context.
+    """
+    seen = set()
+    pending = [schema]
+    while pending:
+        sch = pending.pop()
+        if id(sch) in seen:
+            continue
+        seen.add(id(sch))
+        sch.context = context
+        for field in sch.fields.values():
+            # List fields hold their items' field as a container
+            for each in (field, getattr(field, 'container', None)):
+                nested = getattr(each, '_Nested__schema', None)
+                if nested is not None:
+                    pending.append(nested)
+
+
+class SchemaPool:
+    """A thread-safe pool of clones of declared schemas
+
+    Clones are created on demand, so acquiring a schema never blocks.
+    At most ``max_size`` idle clones are kept per declared schema;
+    clones released beyond that are discarded. Pools for a declared
+    schema are dropped once that schema is garbage collected.
+    """
+
+    def __init__(self, max_size=DEFAULT_POOL_SIZE):
+        # type: (int) -> None
+        """Instantiate the pool
+
+        :param max_size: the maximum number of idle clones to keep for
+            each declared schema
+        """
+        if max_size < 1:
+            raise ValueError(
+                'The pool size must be positive, not %r' % max_size
+            )
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._idle = weakref.WeakKeyDictionary()
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+        self._in_use = 0
+
+    def acquire(self, schema):
+        # type: (Schema) -> Schema
+        """Return a clone of a schema for the exclusive use of the caller
+
+        The clone should be handed back with ``release`` when done.
+        Reused clones get a fresh copy of the declared schema's
+        ``context``, so that nothing written to it by an earlier caller
+        is seen by the next one, and so that later changes to the
+        declared schema's context are picked up.
+        """
+        with self._lock:
+            self._in_use += 1
+            idle = self._idle.get(schema)
+            clone = idle.pop() if idle else None
+            if clone is not None:
+                self._reused += 1
+            else:
+                self._created += 1
+        if clone is None:
+            return clone_schema(schema)
+        reset_context(clone, dict(schema.context))
+        return clone
+
+    def release(self, schema, clone):
+        # type: (Schema, Schema) -> None
+        """Return a clone acquired for ``schema`` to the pool"""
+        with self._lock:
+            self._in_use -= 1
+            idle = self._idle.setdefault(schema, [])  # type: List[Schema]
+            if len(idle) < self.max_size:
+                idle.append(clone)
+            else:
+                self._discarded += 1
+
+    @contextmanager
+    def borrow(self, schema):
+        # type: (Schema) -> Iterator[Schema]
+        """Acquire a clone of a schema for the duration of a block"""
+        clone = self.acquire(schema)
+        try:
+            yield clone
+        finally:
+            self.release(schema, clone)
+
+    def stats(self):
+        # type: () -> Dict[str, int]
+        """Return counters describing the use of the pool
+
+        * ``created``: clones created, because none were idle
+        * ``reused``: acquisitions served by an idle clone
+        * ``discarded``: clones dropped on release as the pool was full
+        * ``in_use``: clones currently acquired
+        * ``idle``: clones currently waiting to be reused
+        """
+        with self._lock:
+            return {
+                'created': self._created,
+                'reused': self._reused,
+                'discarded': self._discarded,
+                'in_use': self._in_use,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+            }
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Sampled profiling of the middleware's work on requests
+
+A ``RequestProfiler`` selects requests to profile, either at random or
+because they carry a given header, and writes the ``cProfile`` stats of
+the ``Marshmallow`` middleware's work on each of them (i.e. in
+``process_resource`` and ``process_response``, but not in the
+responder) to a directory. Stats files are named after the route and
+method of the request, and may be inspected with ``pstats`` or tools
+such as SnakeViz, e.g.::
+
+    python -m pstats profiles/philosophers_id.GET.1571234567890-42-0.prof
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Third party
+from falcon import Request
+
+
+log = logging.getLogger(__name__)
+
+
+#: The key on ``req.context`` holding the profile of a request
+PROFILE_KEY = 'profile'
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_\-]+')
+# Held while a profile is enabled. Since Python 3.12, a profile sees
+# every thread, and enabling a second one raises a ValueError.
+_ENABLED_LOCK = threading.Lock()
+
+
+class RequestProfiler:
+    """Selects requests to profile, and writes their stats"""
+
+    def __init__(self,
+                 directory,  # type: str
+                 sample_rate=0.0,  # type: float
+                 header=None,  # type: Optional[str]
+                 token=None,  # type: Optional[str]
+                 random=random.random,  # type: Callable[[], float]
+                 ):
+        # type: (...) -> None
+        """Instantiate the profiler
+
+        :param directory: the directory to which to write stats files,
+            which is created if it does not exist
+        :param sample_rate: the fraction of requests to profile, from
+            ``0`` (none, unless requested with ``header``) to ``1``
+            (all of them)
+        :param header: the name of a request header with which clients
+            may have their request profiled, if any
+        :param token: the value ``header`` must have for the request to
+            be profiled. If ``None``, any value will do, which is only
+            safe if untrusted clients cannot set the header (e.g.
+            because a proxy strips it).
+        :param random: a function returning a random number in
+            ``[0, 1)``, with which requests are sampled
+
+        :raises ValueError: if ``sample_rate`` is not between 0 and 1
+        """
+        log.debug(
+            'RequestProfiler.__init__(%s, %s, %s, %s, %s)',
+            directory, sample_rate, header,
+            None if token is None else '<token>', random
+        )
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(
+                'The sample rate must be between 0 and 1, not %r' %
+                sample_rate
+            )
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.header = header
+        self._token = token
+        self._random = random
+        self._counter = itertools.count()
+
+    def should_profile(self, req):
+        # type: (Request) -> bool
+        """Return whether to profile a request"""
+        if self.header is not None:
+            value = req.get_header(self.header)
+            if value is not None and (
+                    self._token is None or
+                    hmac.compare_digest(
+                        value.encode('utf-8'), self._token.encode('utf-8')
+                    )):
+                return True
+        return bool(self.sample_rate) and self._random() < self.sample_rate
+
+    def start(self, req):
+        # type: (Request) -> Optional[cProfile.Profile]
+        """Return a new profile for the request, if it should have one
+
+        The profile is kept on ``req.context`` under ``PROFILE_KEY``,
+        until it is written.
+        """
+        if not self.should_profile(req):
+            return None
+        profile = req.context[PROFILE_KEY] = cProfile.Profile()
+        return profile
+
+    @contextmanager
+    def enabled(self, req, profile):
+        # type: (Request, cProfile.Profile) -> Iterator[None]
+        """Enable a request's profile for the duration of the block
+
+        Only one profile is enabled at a time. If another one is, or
+        another profiling tool is active, the request is not profiled
+        after all: its profile is dropped, and the block runs without
+        it.
+        """
+        enabled = _ENABLED_LOCK.acquire(False)
+        if enabled:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool is active (Python 3.12+)
+                _ENABLED_LOCK.release()
+                enabled = False
+        if not enabled:
+            log.info(
+                'Not profiling %s %s, since another profile is active',
+                req.method, req.uri_template
+            )
+            req.context.pop(PROFILE_KEY, None)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            _ENABLED_LOCK.release()
+
+    def write(self, req, resource, profile):
+        # type: (Request, object, cProfile.Profile) -> Optional[str]
+        """Write the stats of a request's profile
+
+        The file is named after the request's route (or the resource's
+        class, if the route is not known), its method, the time, and
+        the process, e.g. ``philosophers_id.GET.1571234567890-42-0.prof``
+        for a GET request to ``/philosophers/{id}``.
+
+        Return the path of the file, or ``None`` if it could not be
+        written, in which case the error is logged rather than raised,
+        so as not to fail the request.
+        """
+        req.context.pop(PROFILE_KEY, None)
+        route = req.uri_template or type(resource).__name__
+        name = _UNSAFE.sub('_', route).strip('_') or 'root'
+        path = os.path.join(self.directory, '%s.%s.%d-%d-%d.prof' % (
+            name, req.method, int(time.time() * 1000), os.getpid(),
+            next(self._counter),
+        ))
+        try:
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # It exists already, or cannot be created, in which case
+                # writing the file fails too
+                pass
+            profile.dump_stats(path)
+        except (IOError, OSError) as exc:
+            log.warning('Could not write profile to %s: %s', path, exc)
+            return None
+        log.info('Wrote profile of %s %s to %s', req.method, route, path)
+        return path
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Discovery of the routes of a Falcon app
+
+Falcon does not expose the routes added to an app, so they are found by
+walking the tree of Falcon's default ``CompiledRouter``. This lets the
+middleware find every resource and its schemas once, at startup.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+from typing import Any, Iterable, Iterator, List, Tuple
+
+
+def iter_routes(app):
+    # type: (Any) -> Iterator[Tuple[str, object, List[str]]]
+    """Yield ``(uri_template, resource, methods)`` for an app's routes
+
+    ``methods`` lists the HTTP methods for which the resource has a
+    responder of its own, leaving out the default responders Falcon adds
+    for other methods (e.g. for OPTIONS, or to return a 405).
+
+    :param app: a Falcon app, or its router
+
+    :raises TypeError: if the app does not use Falcon's default router,
+        or another router with the same structure
+    """
+    router = getattr(app, '_router', app)
+    roots = getattr(router, '_roots', None)
+    if roots is None:
+        raise TypeError(
+            'Cannot discover the routes of %r; only routers compatible '
+            'with falcon.routing.CompiledRouter are supported' % router
+        )
+    return _iter_nodes(roots)
+
+
+def _iter_nodes(nodes):
+    # type: (Iterable[Any]) -> Iterator[Tuple[str, object, List[str]]]
+    """Yield the routes of a tree of router nodes, depth first"""
+    for node in nodes:
+        resource = node.resource
+        if resource is not None:
+            methods = [
+                method for method, responder in (node.method_map or {}).items()
+                if getattr(responder, '__self__', None) is resource
+            ]
+            yield node.uri_template, resource, sorted(methods)
+        for route in _iter_nodes(node.children):
+            yield route
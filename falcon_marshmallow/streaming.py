@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for incrementally (de)serializing request and response bodies
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import codecs
+import logging
+from itertools import islice
+from typing import Any, Callable, IO, Iterable, Iterator, List, Tuple
+
+# Third party
+import simplejson as json
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_BATCH_SIZE = 100
+JSON_WHITESPACE = ' \t\n\r'
+
+
+class _ChunkReader:
+    """Read text from a byte stream in chunks, decoding as UTF-8"""
+
+    def __init__(self, stream, chunk_size):
+        # type: (IO, int) -> None
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.eof = False
+
+    def read(self, size=None):
+        # type: (int) -> str
+        """Return up to ``size`` decoded characters from the stream
+
+        :raises UnicodeDecodeError: if the stream is not valid UTF-8
+        """
+        if self.eof:
+            return ''
+        chunk = self._stream.read(size or self._chunk_size)
+        if not chunk:
+            self.eof = True
+            # Raises if the stream ended partway through a character
+            return self._decoder.decode(b'', final=True)
+        if isinstance(chunk, bytes):
+            return self._decoder.decode(chunk)
+        return chunk
+
+
+def load_json_stream(stream, json_module=json, chunk_size=DEFAULT_CHUNK_SIZE):
+    # type: (IO, Any, int) -> Any
+    """Parse a JSON document from a stream without buffering all of it
+
+    If the top-level value is an array, its items are decoded one at
+    a time, and the text of each item is discarded as soon as it has
+    been parsed, so that peak memory stays close to the size of the
+    parsed result rather than the size of the raw body plus the
+    parsed result. Any other top-level value is read in full and
+    parsed with ``json_module.loads``.
+
+    :param stream: a file-like object with a ``read(size)`` method,
+        e.g. ``req.bounded_stream``
+    :param json_module: the json module to use for decoding; it must
+        provide ``loads`` and ``JSONDecoder``
+    :param chunk_size: the number of bytes to read from the stream
+        at a time
+
+    :raises UnicodeDecodeError: if the stream is not valid UTF-8
+    :raises ValueError: (``JSONDecodeError``) if the stream is not
+        a valid JSON document
+    """
+    log.debug(
+        'load_json_stream(%s, %s, %s)', stream, json_module, chunk_size
+    )
+    reader = _ChunkReader(stream, chunk_size)
+    decode_error = getattr(json_module, 'JSONDecodeError', ValueError)
+
+    buf = ''
+    pos = 0
+    while True:
+        pos = _skip_whitespace(buf, pos)
+        if pos < len(buf) or reader.eof:
+            break
+        buf = reader.read()
+        pos = 0
+
+    if pos == len(buf) or buf[pos] != '[':
+        # Not an array: nothing to gain from incremental parsing
+        rest = [buf]
+        while not reader.eof:
+            rest.append(reader.read())
+        return json_module.loads(''.join(rest))
+
+    raw_decode = json_module.JSONDecoder().raw_decode
+    items = []
+    pos += 1
+    expect_item = None  # None: item or ']'; True: item; False: ',' or ']'
+
+    while True:
+        pos = _skip_whitespace(buf, pos)
+        if pos == len(buf):
+            if reader.eof:
+                raise decode_error('Unterminated array', buf, pos)
+            buf, pos = buf[pos:] + reader.read(), 0
+            continue
+
+        char = buf[pos]
+        if char == ']' and expect_item is not True:
+            pos += 1
+            break
+
+        if expect_item is False:
+            if char != ',':
+                raise decode_error("Expecting ',' delimiter", buf, pos)
+            pos += 1
+            expect_item = True
+            continue
+
+        try:
+            item, end = raw_decode(buf, pos)
+        except ValueError:
+            end = None
+        # A number cut off by the end of a chunk (e.g. "1e" of "1e5")
+        # decodes successfully, so unless we are at EOF, only trust a
+        # value once the following delimiter has been read as well
+        if end is not None and not reader.eof:
+            after = _skip_whitespace(buf, end)
+            if after == len(buf) or buf[after] not in ',]':
+                end = None
+        if end is None:
+            if reader.eof:
+                raise decode_error('Expecting value', buf, pos)
+            # Grow the buffer geometrically so that large items
+            # are not re-parsed once per chunk
+            buf = buf[pos:]
+            buf, pos = buf + reader.read(max(chunk_size, len(buf))), 0
+            continue
+
+        items.append(item)
+        pos = end
+        expect_item = False
+
+    # Only whitespace may follow the closing bracket
+    while True:
+        pos = _skip_whitespace(buf, pos)
+        if pos < len(buf):
+            raise decode_error('Extra data', buf, pos)
+        if reader.eof:
+            return items
+        buf, pos = reader.read(), 0
+
+
+def _skip_whitespace(buf, pos):
+    # type: (str, int) -> int
+    """Return the index of the first non-whitespace char at or after pos"""
+    end = len(buf)
+    while pos < end and buf[pos] in JSON_WHITESPACE:
+        pos += 1
+    return pos
+
+
+def iter_batches(iterable, batch_size):
+    # type: (Iterable, int) -> Iterator[List]
+    """Yield lists of up to ``batch_size`` items from ``iterable``"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def dump_json_stream(iterable, dump_batch, batch_size=DEFAULT_BATCH_SIZE):
+    # type: (Iterable, Callable[[List], str], int) -> Iterator[bytes]
+    """Serialize an iterable as a JSON array, one batch at a time
+
+    Items are pulled from ``iterable`` ``batch_size`` at a time and
+    each batch is serialized with ``dump_batch``, which must return
+    the batch encoded as a JSON array. The resulting UTF-8 chunks are
+    spliced into a single JSON array.
+
+    The first batch is serialized before this function returns, so
+    that errors raised by ``dump_batch`` for it may still be turned
+    into an error response. Errors raised for later batches propagate
+    out of the returned iterator after the response has started.
+
+    :param iterable: the items to serialize
+    :param dump_batch: a callable taking a list of items and returning
+        them serialized as a JSON array
+    :param batch_size: the number of items to serialize at a time
+
+    :return: an iterator of UTF-8 encoded chunks, suitable for use as
+        ``resp.stream``
+    """
+    log.debug(
+        'dump_json_stream(%s, %s, %s)', iterable, dump_batch, batch_size
+    )
+    batches = iter_batches(iterable, batch_size)
+    first = next(batches, None)
+    if first is None:
+        return iter([b'[]'])
+    head = _array_contents(dump_batch(first))
+    return _join_json_arrays(head, batches, dump_batch)
+
+
+def _join_json_arrays(head, batches, dump_batch):
+    # type: (bytes, Iterator[List], Callable[[List], str]) -> Iterator[bytes]
+    """Yield the chunks of a JSON array made up of serialized batches"""
+    yield b'[' + head
+    for batch in batches:
+        yield b',' + _array_contents(dump_batch(batch))
+    yield b']'
+
+
+def _array_contents(dumped):
+    # type: (str) -> bytes
+    """Strip the enclosing brackets from a serialized JSON array"""
+    if not isinstance(dumped, bytes):
+        dumped = dumped.encode('utf-8')
+    return dumped.strip()[1:-1]
+
+
+class RecordError:
+    """A record of a newline-delimited JSON body which could not be loaded
+
+    :ivar line: the number of the line holding the record, from 1
+    :ivar errors: the errors for the record, in the format used by
+        Marshmallow, with errors parsing the record itself under
+        ``'_schema'``
+    """
+
+    def __init__(self, line, errors):
+        # type: (int, dict) -> None
+        self.line = line
+        self.errors = errors
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (
+            self.__class__.__name__, self.line, self.errors
+        )
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RecordError) and
+            (self.line, self.errors) == (other.line, other.errors)
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+def iter_lines(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    # type: (IO, int) -> Iterator[Tuple[int, bytes]]
+    """Yield the non-blank lines of a byte stream with their numbers
+
+    The stream is read ``chunk_size`` bytes at a time, as lines are
+    consumed. Line numbers start at 1 and count blank lines.
+    """
+    number = 0
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+    if pending.strip():
+        yield number + 1, pending
+
+
+def load_ndjson_stream(stream, load, loads=json.loads,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    # type: (IO, Callable[[Any], Tuple[Any, dict]], Callable, int) -> Iterator
+    """Lazily parse and load the records of a newline-delimited JSON body
+
+    Each non-blank line is parsed with ``loads`` and loaded with
+    ``load`` as it is consumed, so that only one record is held in
+    memory at a time, and the stream is read no faster than records
+    are consumed.
+
+    :param stream: a file-like object with a ``read(size)`` method,
+        e.g. ``req.bounded_stream``
+    :param load: a callable taking a parsed record and returning the
+        loaded record and any errors, like ``Schema.load``
+    :param loads: the callable with which to parse each line
+    :param chunk_size: the number of bytes to read from the stream
+        at a time
+
+    :return: an iterator of loaded records, or of ``RecordError``
+        instances for records which could not be parsed or loaded
+    """
+    log.debug(
+        'load_ndjson_stream(%s, %s, %s, %s)', stream, load, loads, chunk_size
+    )
+    for number, line in iter_lines(stream, chunk_size):
+        try:
+            record = loads(line)
+        except ValueError as exc:
+            yield RecordError(number, {'_schema': ['Invalid JSON: %s' % exc]})
+            continue
+        data, errors = load(record)
+        if errors:
+            yield RecordError(number, errors)
+        else:
+            yield data
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Bounding the work done to reject invalid request bodies
+
+Marshmallow validates every item of a collection, and collects the
+errors of all of them, before returning. Rejecting a large, thoroughly
+invalid body therefore costs as much as loading a valid one, and its
+errors may be larger than the body itself. ``load_fail_fast`` loads
+collections a batch at a time instead, stopping once enough errors have
+been found (collections nested in fields are still loaded in full),
+while ``truncate_errors`` and ``dump_errors`` bound the errors which are
+reported.
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+
+#: The number of items of a collection loaded at a time in fail-fast mode
+DEFAULT_FAIL_FAST_BATCH_SIZE = 100
+#: The key added to errors from which some were left out
+TRUNCATED_KEY = '_truncated'
+
+
+def load_fail_fast(load,  # type: Callable[[list], Tuple[list, dict]]
+                   data,  # type: list
+                   max_errors,  # type: int
+                   batch_size=DEFAULT_FAIL_FAST_BATCH_SIZE,  # type: int
+                   ):
+    # type: (...) -> Tuple[list, dict, bool]
+    """Load a collection until ``max_errors`` of its items are invalid
+
+    Return the loaded items, their errors, indexed by position in
+    ``data``, and whether loading stopped before the end of the
+    collection, in which case the remaining items are neither loaded
+    nor validated.
+
+    Only ``data`` itself is loaded a batch at a time: collections nested
+    in its items, e.g. in ``List`` or ``Nested(many=True)`` fields, are
+    loaded in full by ``load``, and their errors count as one error of
+    the item.
+
+    :param load: a function loading a list of items, and returning the
+        loaded items and their errors, as ``Schema.load`` does with
+        ``many=True``
+    :param data: the items to load
+    :param max_errors: the number of invalid items after which to stop
+    :param batch_size: the number of items to load at a time. Batches
+        are never smaller than ``max_errors``.
+    """
+    batch_size = max(batch_size, max_errors)
+    loaded = []  # type: list
+    errors = {}  # type: dict
+    for start in range(0, len(data), batch_size):
+        items, batch_errors = load(data[start:start + batch_size])
+        loaded.extend(items)
+        invalid = False
+        for index, error in batch_errors.items():
+            if isinstance(index, int):
+                errors[start + index] = error
+            else:
+                # Errors of the batch as a whole, e.g. from a schema
+                # validator, make the whole collection invalid
+                errors[index] = error
+                invalid = True
+        if invalid or len(errors) >= max_errors:
+            return loaded, errors, start + batch_size < len(data)
+    return loaded, errors, False
+
+
+def truncate_errors(errors, max_errors):
+    # type: (dict, Optional[int]) -> Tuple[dict, bool]
+    """Keep the first ``max_errors`` errors
+
+    Errors of the data as a whole (e.g. from schema validators) come
+    first, followed by those of fields and items, in order. Return the
+    errors and whether any were left out.
+
+    :param errors: errors returned by ``Schema.load``
+    :param max_errors: the number of errors to keep, or ``None`` to
+        keep all of them
+    """
+    if max_errors is None or len(errors) <= max_errors:
+        return errors, False
+    return OrderedDict(
+        (key, errors[key])
+        for key in sorted(errors, key=_error_order)[:max_errors]
+    ), True
+
+
+def dump_errors(errors,  # type: dict
+                dumps,  # type: Callable[[Any], str]
+                max_size=None,  # type: Optional[int]
+                truncated=False,  # type: bool
+                ):
+    # type: (...) -> str
+    """Serialize errors, leaving out as many as needed to fit a size
+
+    If errors are left out, either here or because ``truncated`` is
+    true, the serialized errors include ``"_truncated": true``.
+
+    :param errors: errors returned by ``Schema.load``
+    :param dumps: the function with which to serialize errors
+    :param max_size: the maximum length of the serialized errors, or
+        ``None`` for no limit. Errors are kept in the order described
+        in ``truncate_errors``, as long as they fit.
+    :param truncated: whether some errors have already been left out
+    """
+    if not truncated:
+        dumped = dumps(errors)
+        if max_size is None or len(dumped) <= max_size:
+            return dumped
+
+    keys = sorted(errors, key=_error_order)
+
+    def dump(count):
+        # type: (int) -> str
+        kept = OrderedDict((key, errors[key]) for key in keys[:count])
+        kept[TRUNCATED_KEY] = True
+        return dumps(kept)
+
+    if max_size is None:
+        return dump(len(keys))
+    # Find the largest number of errors which fit, by bisection, so that
+    # huge error trees are only serialized a few times
+    low, high = 0, len(keys) if truncated else len(keys) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if len(dump(middle)) <= max_size:
+            low = middle
+        else:
+            high = middle - 1
+    return dump(low)
+
+
+def _error_order(key):
+    # type: (Any) -> Tuple[bool, Any]
+    """Order errors of the whole data first, then by field or index"""
+    if isinstance(key, int):
+        return True, key
+    return False, '%s' % key
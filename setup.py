@@ -71,7 +71,11 @@ TEST_DEPENDENCIES = [
     'mock;python_version<"3.3"',
 ]
 
-EXTRAS_DEPENDENCIES = {}
+EXTRAS_DEPENDENCIES = {
+    'msgpack': ['msgpack'],
+    'orjson': ['orjson'],
+    'ujson': ['ujson'],
+}
 
 
 PACKAGE_EXCLUDE = ['*.tests', '*.tests.*']
@@ -93,9 +97,12 @@ CLASSIFIERS = [
     'Programming Language :: Python :: 2',
     'Programming Language :: Python :: 2.7',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
     'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3.7',
+    'Programming Language :: Python :: 3.8',
+    'Programming Language :: Python :: 3.9',
+    'Programming Language :: Python :: 3.10',
+    'Programming Language :: Python :: 3.11',
     'Programming Language :: Python :: Implementation :: CPython',
     'Topic :: Internet :: WWW/HTTP :: WSGI :: Middleware',
 ]
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration of the test suite
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import sys
+
+
+# The ASGI middleware, and so its tests, require Python 3.7 or above,
+# and the tests do not even compile on older versions
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_asgi.py')
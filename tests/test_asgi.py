@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.asgi
+"""
+
+# Std lib
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# Third party
+import pytest
+import simplejson as json
+from falcon import errors
+from marshmallow import fields, Schema
+
+# Local
+from falcon_marshmallow import asgi
+from falcon_marshmallow.body import CONTENT_KEY, get_stashed_stream
+from falcon_marshmallow.profiling import PROFILE_KEY, RequestProfiler
+
+
+class FooSchema(Schema):
+    """Convert foo to bar for testing purposes"""
+    bar = fields.String(load_from='foo', dump_to='foo')
+    thread = fields.Method('get_thread')
+
+    def get_thread(self, obj):
+        """Return the name of the current thread"""
+        return threading.current_thread().name
+
+
+class Resource:
+    """A resource with a schema"""
+    schema = FooSchema()
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """An executor counting the calls submitted to it"""
+
+    def __init__(self):
+        ThreadPoolExecutor.__init__(self, 1, thread_name_prefix='offload')
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return ThreadPoolExecutor.submit(self, *args, **kwargs)
+
+
+def run(coroutine):
+    """Run a coroutine to completion"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def make_request(body, method='POST'):
+    # type: (bytes, str) -> mock.Mock
+    """Return a mock ASGI request with the given body"""
+    req = mock.Mock(method=method, content_length=len(body))
+    chunks = [body[i:i + 4] for i in range(0, len(body), 4)]
+
+    async def read(size=None):
+        """Read the body, in chunks if asked"""
+        if size is None:
+            rest = b''.join(chunks)
+            del chunks[:]
+            return rest
+        return chunks.pop(0) if chunks else b''
+
+    req.stream.read = mock.Mock(side_effect=read)
+    req.context = {}
+    return req
+
+
+class TestGetStashedContentAsync:
+    """Test reading the body of ASGI requests"""
+
+    @pytest.mark.parametrize('spool_threshold', [None, 4])
+    def test_stash(self, spool_threshold):
+        # type: (int) -> None
+        """Test that the body is read once and stashed"""
+        req = make_request(b'{"foo": "bar"}')
+        for _ in range(2):
+            content = run(asgi.get_stashed_content_async(
+                req, spool_threshold, chunk_size=4
+            ))
+            assert content[:] == b'{"foo": "bar"}'
+        assert req.context[CONTENT_KEY] is content
+        assert get_stashed_stream(req).read() == b'{"foo": "bar"}'
+        if spool_threshold is None:
+            req.stream.read.assert_called_once_with()
+
+    def test_max_size(self):
+        """Test that large bodies are rejected before being read"""
+        req = make_request(b'{"foo": "bar"}')
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            run(asgi.get_stashed_content_async(req, max_size=4))
+        req.stream.read.assert_not_called()
+
+
+class TestJSONEnforcer:
+    """Test enforcement of JSON requests"""
+
+    def test_not_acceptable(self):
+        """Test that the synchronous checks apply"""
+        req = mock.Mock(accept='text/html')
+        with pytest.raises(errors.HTTPNotAcceptable):
+            run(asgi.JSONEnforcer().process_request_async(req, None))
+
+
+class TestEmptyRequestDropper:
+    """Test dropping empty requests"""
+
+    @pytest.mark.parametrize('body, content_length, raises', [
+        (b'{}', 2, False),
+        (b'', 2, True),
+        (b'', 0, False),
+    ])
+    def test_process_request_async(self, body, content_length, raises):
+        # type: (bytes, int, bool) -> None
+        """Test that empty bodies are rejected"""
+        req = make_request(body)
+        req.content_length = content_length
+        dropper = asgi.EmptyRequestDropper()
+        if raises:
+            with pytest.raises(errors.HTTPBadRequest):
+                run(dropper.process_request_async(req, None))
+        else:
+            run(dropper.process_request_async(req, None))
+
+
+class TestMarshmallow:
+    """Test the asynchronous Marshmallow middleware"""
+
+    @pytest.mark.parametrize('threshold, offloaded', [(100, 0), (4, 1)])
+    def test_process_resource_async(self, threshold, offloaded):
+        # type: (int, int) -> None
+        """Test loading requests, offloading large ones"""
+        executor = RecordingExecutor()
+        mw = asgi.Marshmallow(
+            executor=executor, offload_threshold=threshold
+        )
+        req = make_request(b'{"foo": "test"}')
+
+        run(mw.process_resource_async(req, None, Resource(), {}))
+        assert req.context['json'] == {'bar': 'test'}
+        assert executor.submitted == offloaded
+
+    def test_process_resource_async_errors(self):
+        """Test that errors propagate from the executor"""
+        mw = asgi.Marshmallow(offload_threshold=0)
+        req = make_request(b'{"foo": ')
+        with pytest.raises(errors.HTTPBadRequest):
+            run(mw.process_resource_async(req, None, Resource(), {}))
+
+    def test_process_resource_async_spooled(self):
+        """Test loading spooled requests"""
+        mw = asgi.Marshmallow(spool_threshold=4, stream_chunk_size=4)
+        req = make_request(b'[{"foo": "a"}, {"foo": "b"}]')
+        mw._get_schema = lambda *x, **y: FooSchema(many=True)
+
+        run(mw.process_resource_async(req, None, Resource(), {}))
+        assert req.context['json'] == [{'bar': 'a'}, {'bar': 'b'}]
+
+    @pytest.mark.parametrize('result, offloaded', [
+        ({'bar': 'test'}, False),
+        ([{'bar': 'test'}], False),
+        ([{'bar': 'test'}] * 3, True),
+    ])
+    def test_process_response_async(self, result, offloaded):
+        # type: (object, bool) -> None
+        """Test dumping responses, offloading large ones"""
+        mw = asgi.Marshmallow(
+            executor=RecordingExecutor(), offload_item_threshold=2
+        )
+        mw._get_schema = lambda *x, **y: FooSchema(
+            many=isinstance(result, list)
+        )
+        req = mock.Mock(method='GET', context={'result': result})
+        resp = mock.Mock()
+
+        run(mw.process_response_async(req, resp, Resource(), True))
+        dumped = json.loads(resp.body)
+        if isinstance(result, list):
+            dumped = dumped[0]
+        assert dumped['foo'] == 'test'
+        assert dumped['thread'].startswith('offload') is offloaded
+
+    def test_process_response_async_iterator(self):
+        """Test that iterators are streamed asynchronously"""
+        executor = RecordingExecutor()
+        mw = asgi.Marshmallow(executor=executor, stream_batch_size=2)
+        req = mock.Mock(
+            method='GET', context={'result': iter([{'bar': 'test'}] * 3)}
+        )
+        resp = mock.Mock()
+
+        run(mw.process_response_async(req, resp, Resource(), True))
+
+        async def collect():
+            """Collect the streamed chunks"""
+            return [chunk async for chunk in resp.stream]
+
+        chunks = run(collect())
+        assert len(chunks) == 3
+        dumped = json.loads(b''.join(chunks).decode('utf-8'))
+        assert [item['foo'] for item in dumped] == ['test'] * 3
+        assert all(item['thread'].startswith('offload') for item in dumped)
+        assert executor.submitted == 1 + len(chunks) + 1
+
+    def test_no_result(self):
+        """Test that nothing is done without a result"""
+        mw = asgi.Marshmallow()
+        resp = mock.Mock(spec=[])
+        run(mw.process_response_async(
+            mock.Mock(context={}), resp, Resource(), True
+        ))
+
+    def test_profile(self):
+        """Test profiling requests, with or without a result"""
+        profiler = mock.Mock(spec=RequestProfiler)
+        profiler.start.side_effect = (
+            lambda req: req.context.setdefault(PROFILE_KEY, mock.Mock())
+        )
+        profiler.enabled.side_effect = RequestProfiler('profiles').enabled
+        mw = asgi.Marshmallow(profiler=profiler)
+        req = make_request(b'{"foo": "test"}', method='DELETE')
+
+        run(mw.process_resource_async(req, None, Resource(), {}))
+        profile = req.context[PROFILE_KEY]
+        profile.enable.assert_called_once_with()
+        profile.disable.assert_called_once_with()
+
+        run(mw.process_response_async(req, None, Resource(), True))
+        profiler.write.assert_called_once_with(req, mock.ANY, profile)
+        assert profile.enable.call_count == 2
+
+    def test_profile_without_body(self, tmpdir):
+        # type: (object) -> None
+        """Test profiling requests without a body, e.g. GET requests"""
+        directory = str(tmpdir)
+        mw = asgi.Marshmallow(profiler=RequestProfiler(directory, 1))
+        req = make_request(b'', method='GET')
+        req.uri_template = '/foo'
+        resp = mock.Mock()
+        resp.get_header.return_value = None
+
+        run(mw.process_resource_async(req, resp, Resource(), {}))
+        req.context['result'] = {'bar': 'test'}
+        run(mw.process_response_async(req, resp, Resource(), True))
+        assert json.loads(resp.body)['foo'] == 'test'
+        names = os.listdir(directory)
+        assert len(names) == 1
+        assert names[0].startswith('foo.GET.')
+
+
+class ItemSchema(Schema):
+    """A schema for items posted and fetched in an ASGI app"""
+    id = fields.Integer(dump_only=True)
+    name = fields.String(required=True)
+
+
+class TestApp:
+    """Test the middleware in a Falcon ASGI app"""
+
+    @pytest.fixture()
+    def client(self):
+        """A client for an ASGI app storing and fetching items"""
+        falcon_asgi = pytest.importorskip('falcon.asgi')
+        from falcon import testing
+        items = []
+
+        class Items:
+            schema = ItemSchema()
+
+            async def on_post(self, req, resp):
+                item = dict(req.context['json'], id=len(items) + 1)
+                items.append(item)
+                req.context['result'] = item
+
+        class Item:
+            schema = ItemSchema()
+
+            async def on_get(self, req, resp, item_id):
+                req.context['result'] = items[int(item_id) - 1]
+
+        app = falcon_asgi.App(middleware=[
+            asgi.JSONEnforcer(),
+            asgi.EmptyRequestDropper(),
+            asgi.Marshmallow(),
+        ])
+        app.add_route('/items', Items())
+        app.add_route('/items/{item_id}', Item())
+        return testing.TestClient(app)
+
+    def test_post_and_get(self, client):
+        """Test loading a posted item, and dumping a fetched one"""
+        resp = client.simulate_post('/items', json={'name': 'Søren'})
+        assert resp.status_code == 200
+        assert resp.json == {'id': 1, 'name': 'Søren'}
+
+        resp = client.simulate_get('/items/1')
+        assert resp.status_code == 200
+        assert resp.json == {'id': 1, 'name': 'Søren'}
+
+    def test_post_invalid(self, client):
+        """Test that invalid items are rejected"""
+        resp = client.simulate_post('/items', json={'id': 5})
+        assert resp.status_code == 422
+        assert 'name' in json.loads(resp.json['description'])
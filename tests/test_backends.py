@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.backends
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import json as std_json
+
+# Third party
+import pytest
+import simplejson
+
+# Local
+from falcon_marshmallow import backends
+
+
+class TestGetBackend:
+    """Test resolving JSON backends"""
+
+    @pytest.mark.parametrize('name, backend_cls', [
+        ('json', backends.StdlibJSONBackend),
+        ('simplejson', backends.SimpleJSONBackend),
+    ])
+    def test_by_name(self, name, backend_cls):
+        # type: (str, type) -> None
+        """Test getting built-in backends by name"""
+        assert isinstance(backends.get_backend(name), backend_cls)
+
+    def test_unknown_name(self):
+        """Test that unknown names raise ValueError"""
+        with pytest.raises(ValueError):
+            backends.get_backend('foo')
+
+    def test_instance(self):
+        """Test that backend instances are returned as-is"""
+        backend = backends.StdlibJSONBackend()
+        assert backends.get_backend(backend) is backend
+
+    @pytest.mark.parametrize('module', [std_json, simplejson])
+    def test_module(self, module):
+        # type: (object) -> None
+        """Test that modules are wrapped in a ModuleBackend"""
+        backend = backends.get_backend(module)
+        assert isinstance(backend, backends.ModuleBackend)
+        assert backend.module is module
+
+
+class TestBackends:
+    """Test the behavior of the built-in backends"""
+
+    @pytest.mark.parametrize('name', ['json', 'simplejson', 'orjson', 'ujson'])
+    def test_round_trip(self, name):
+        # type: (str) -> None
+        """Test that every backend round-trips data and rejects bad data"""
+        pytest.importorskip(name)
+        backend = backends.get_backend(name)
+        obj = {'foo': ['bär', 1, 2.5, None, True, {'a/b': 'c'}]}
+
+        dumped = backend.dumps(obj)
+        assert isinstance(dumped, bytes) == backend.binary
+        assert backend.loads(dumped) == obj
+        assert backend.loads(std_json.dumps(obj).encode('utf-8')) == obj
+
+        with pytest.raises(ValueError):
+            backend.loads(b'{::')
+        with pytest.raises(TypeError):
+            backend.dumps({'foo': object()})
+
+    def test_orjson_option(self):
+        """Test passing options to orjson"""
+        orjson = pytest.importorskip('orjson')
+        backend = backends.OrjsonBackend(option=orjson.OPT_SORT_KEYS)
+        assert backend.dumps({'b': 1, 'a': 2}) == b'{"a":2,"b":1}'
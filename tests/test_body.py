@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.body
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import io
+import mmap
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from typing import Optional
+
+# Third party
+import pytest
+from falcon import errors
+
+# Local
+from falcon_marshmallow import body
+
+
+class TestRewindableBody:
+    """Test the seekable body stream"""
+
+    data = b'first line\nsecond line\nthird'
+
+    def test_read(self):
+        """Test reading in pieces and in full"""
+        stream = body.RewindableBody(self.data)
+        assert stream.read(5) == b'first'
+        assert stream.tell() == 5
+        assert stream.read() == self.data[5:]
+        assert stream.read() == b''
+        assert stream.is_exhausted
+
+    def test_full_read_does_not_copy(self):
+        """Test that reading everything returns the original bytes"""
+        stream = body.RewindableBody(self.data)
+        assert stream.read() is self.data
+        stream.seek(0)
+        assert stream.read(len(self.data) + 10) is self.data
+        assert stream.getvalue() is self.data
+
+    @pytest.mark.parametrize('offset, whence, exp', [
+        (3, io.SEEK_SET, 3),
+        (2, io.SEEK_CUR, 7),
+        (-5, io.SEEK_END, len(data) - 5),
+    ])
+    def test_seek(self, offset, whence, exp):
+        # type: (int, int, int) -> None
+        """Test seeking relative to the start, current position, and end"""
+        stream = body.RewindableBody(self.data)
+        stream.read(5)
+        assert stream.seek(offset, whence) == exp
+        assert stream.read() == self.data[exp:]
+
+    def test_seek_negative(self):
+        """Test that seeking before the start raises"""
+        with pytest.raises(ValueError):
+            body.RewindableBody(self.data).seek(-1)
+
+    def test_readline(self):
+        """Test reading lines and iterating"""
+        stream = body.RewindableBody(self.data)
+        assert stream.readline() == b'first line\n'
+        assert stream.readline(3) == b'sec'
+        stream.seek(0)
+        assert list(stream) == self.data.splitlines(True)
+
+    def test_readinto(self):
+        """Test reading into a buffer"""
+        stream = body.RewindableBody(self.data)
+        buf = bytearray(5)
+        assert stream.readinto(buf) == 5
+        assert bytes(buf) == b'first'
+
+    def test_view(self):
+        """Test taking zero-copy slices"""
+        stream = body.RewindableBody(self.data)
+        view = stream.view(6, 10)
+        assert isinstance(view, memoryview)
+        assert view.tobytes() == b'line'
+        assert view.obj is self.data
+        assert stream.view().tobytes() == self.data
+        assert len(stream) == len(self.data)
+
+
+class TestStash:
+    """Test stashing the body on the request"""
+
+    @staticmethod
+    def _req(data):
+        # type: (bytes) -> mock.Mock
+        req = mock.Mock(context={})
+        req.bounded_stream.read.return_value = data
+        return req
+
+    def test_get_stashed_content(self):
+        """Test that the body is read once and a stream installed"""
+        req = self._req(b'foo')
+        assert body.get_stashed_content(req) == b'foo'
+        assert body.get_stashed_content(req) == b'foo'
+        assert isinstance(req.stream, body.RewindableBody)
+        assert req._bounded_stream is req.stream
+        assert req.stream.read() == b'foo'
+
+    def test_get_stashed_stream(self):
+        """Test that the shared stream is rewound for every caller"""
+        req = self._req(b'foo')
+        stream = body.get_stashed_stream(req)
+        assert stream.read() == b'foo'
+        assert body.get_stashed_stream(req) is stream
+        assert stream.read() == b'foo'
+        req.bounded_stream.read.assert_called_once_with()
+
+    def test_get_stashed_stream_stashed_elsewhere(self):
+        """Test wrapping a body stashed by something else"""
+        req = self._req(b'')
+        req.context[body.CONTENT_KEY] = b'foo'
+        assert body.get_stashed_stream(req).read() == b'foo'
+        req.bounded_stream.read.assert_not_called()
+
+    def test_stash_content(self):
+        """Test stashing a body read by something else"""
+        req = self._req(b'compressed')
+        body.stash_content(req, b'foo')
+        assert body.get_stashed_content(req) == b'foo'
+        assert req.stream.read() == b'foo'
+        req.bounded_stream.read.assert_not_called()
+
+    def test_get_stashed_view(self):
+        """Test getting a zero-copy slice of the body"""
+        req = self._req(b'foo bar')
+        view = body.get_stashed_view(req, 4)
+        assert view.tobytes() == b'bar'
+        assert view.obj is body.get_stashed_content(req)
+
+
+class TestSpooling:
+    """Test spooling large bodies to disk and limiting body sizes"""
+
+    @staticmethod
+    def _req(data, content_length=None):
+        # type: (bytes, Optional[int]) -> mock.Mock
+        req = mock.Mock(context={})
+        req.content_length = (
+            len(data) if content_length is None else content_length
+        )
+        req.bounded_stream = io.BytesIO(data)
+        return req
+
+    def test_spool_to_mmap(self):
+        """Test copying a stream to a memory-mapped file"""
+        data = b'foo' * 1000
+        mapped = body.spool_to_mmap(io.BytesIO(data), chunk_size=7)
+        assert isinstance(mapped, mmap.mmap)
+        assert mapped[:] == data
+        assert body.is_spooled(mapped)
+
+    def test_spool_empty(self):
+        """Test that empty streams are not mapped"""
+        assert body.spool_to_mmap(io.BytesIO(b'')) == b''
+
+    @pytest.mark.parametrize('threshold, spooled', [
+        (None, False),
+        (100, False),
+        (5, True),
+    ])
+    def test_get_stashed_content_spooling(self, threshold, spooled):
+        # type: (Optional[int], bool) -> None
+        """Test that bodies above the threshold are spooled"""
+        req = self._req(b'foo bar baz')
+        content = body.get_stashed_content(req, spool_threshold=threshold)
+        assert body.is_spooled(content) == spooled
+        assert content[:] == b'foo bar baz'
+
+        stream = body.get_stashed_stream(req)
+        assert stream.read() == b'foo bar baz'
+        stream.seek(0)
+        assert stream.readline() == b'foo bar baz'
+        assert body.get_stashed_view(req, 4, 7).tobytes() == b'bar'
+
+    @pytest.mark.parametrize('content_length, max_size, raises', [
+        (None, 5, False),
+        (5, None, False),
+        (5, 5, False),
+        (6, 5, True),
+    ])
+    def test_check_content_length(self, content_length, max_size, raises):
+        # type: (Optional[int], Optional[int], bool) -> None
+        """Test rejecting bodies that are too large"""
+        req = mock.Mock(context={}, content_length=content_length)
+        if raises:
+            with pytest.raises(errors.HTTPPayloadTooLarge):
+                body.check_content_length(req, max_size)
+        else:
+            body.check_content_length(req, max_size)
+
+    @pytest.mark.parametrize('content, raises', [
+        (b'x' * 5, False),
+        (b'x' * 6, True),
+    ])
+    def test_check_content_length_stashed(self, content, raises):
+        # type: (bytes, bool) -> None
+        """Test that stashed bodies are checked by their own size"""
+        # e.g. a decompressed body, larger than its Content-Length
+        req = mock.Mock(context={}, content_length=2)
+        body.stash_content(req, content)
+        assert body.get_body_size(req) == len(content)
+        if raises:
+            with pytest.raises(errors.HTTPPayloadTooLarge):
+                body.check_content_length(req, 5)
+        else:
+            body.check_content_length(req, 5)
+
+    def test_max_size_checked_before_read(self):
+        """Test that oversized bodies are rejected without reading"""
+        req = mock.Mock(context={}, content_length=10)
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            body.get_stashed_content(req, max_size=5)
+        req.bounded_stream.read.assert_not_called()
+
+
+class TestLimitedStream:
+    """Test bounding bodies without a Content-Length"""
+
+    @pytest.mark.parametrize('data, raises', [
+        (b'foo', False),
+        (b'foobar', False),
+        (b'foobarb', True),
+    ])
+    def test_read(self, data, raises):
+        # type: (bytes, bool) -> None
+        """Test reading at most the maximum size"""
+        stream = body.LimitedStream(io.BytesIO(data), 6)
+        if raises:
+            with pytest.raises(errors.HTTPPayloadTooLarge):
+                stream.read()
+        else:
+            assert stream.read() == data
+            assert stream.read() == b''
+
+    def test_read_chunks(self):
+        """Test that the limit applies to the total read"""
+        stream = body.LimitedStream(io.BytesIO(b'foobarbaz'), 6)
+        assert stream.read(4) == b'foob'
+        assert stream.read(2) == b'ar'
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            stream.read(4)
+
+    def test_readline(self):
+        """Test that lines count towards the limit"""
+        stream = body.LimitedStream(io.BytesIO(b'foo\nbar\nbaz\n'), 8)
+        assert stream.readline() == b'foo\n'
+        assert stream.readline() == b'bar\n'
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            stream.readline()
+
+    def test_unbounded_read_is_bounded(self):
+        """Test that reading everything reads no more than needed"""
+        inner = io.BytesIO(b'x' * 100)
+        stream = body.LimitedStream(inner, 10)
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            stream.read()
+        assert inner.tell() == 11
+
+
+class TestResourceLimits:
+    """Test per-resource body size limits"""
+
+    @pytest.mark.parametrize('attrs, method, exp', [
+        ({}, 'POST', 100),
+        ({'max_body': 10}, 'POST', 10),
+        ({'max_body': 1000}, 'PUT', 1000),
+        ({'post_max_body': 10, 'max_body': 1000}, 'POST', 10),
+        ({'post_max_body': 10, 'max_body': 1000}, 'PUT', 1000),
+        ({'post_max_body': 10}, 'PATCH', 100),
+    ])
+    def test_get_max_body_size(self, attrs, method, exp):
+        # type: (dict, str, int) -> None
+        """Test that resources may set their own limits"""
+        resource = type(str('Resource'), (object,), attrs)()
+        assert body.get_max_body_size(resource, method, 100) == exp
+
+    def test_limit_stream(self):
+        """Test that only unbounded, unread bodies are limited"""
+        req = mock.Mock(context={}, content_length=None)
+        req.stream = inner = io.BytesIO(b'foobar')
+        body.limit_stream(req, None)
+        assert req.stream is inner
+        body.limit_stream(req, 10)
+        assert isinstance(req.stream, body.LimitedStream)
+        assert req.stream.max_size == 10
+        # The tightest limit applies
+        body.limit_stream(req, 100)
+        body.limit_stream(req, 5)
+        assert req.stream.max_size == 5
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            req.stream.read()
+
+        req = mock.Mock(context={}, content_length=6)
+        req.stream = inner
+        body.limit_stream(req, 5)
+        assert req.stream is inner
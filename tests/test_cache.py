@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.cache
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+from typing import Optional
+
+# Third party
+import pytest
+from marshmallow import fields, Schema
+
+# Local
+from falcon_marshmallow import cache
+from falcon_marshmallow.fieldsets import derive_schema
+from falcon_marshmallow.pool import clone_schema
+
+
+class FooSchema(Schema):
+    """A schema to key cached responses on"""
+    foo = fields.String()
+    bar = fields.String()
+
+
+class Clock:
+    """A clock which only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache:
+    """Test caching serialized responses"""
+
+    def test_get_set(self):
+        """Test storing and retrieving responses"""
+        sch = FooSchema()
+        resp_cache = cache.ResponseCache()
+        assert resp_cache.get(sch, 1) is None
+        resp_cache.set(sch, 1, '{"foo": "one"}')
+        resp_cache.set(None, 1, b'{"foo": "raw"}')
+        assert resp_cache.get(sch, 1) == '{"foo": "one"}'
+        assert resp_cache.get(None, 1) == b'{"foo": "raw"}'
+        assert resp_cache.get(FooSchema(), 1) is None
+        assert resp_cache.stats() == {
+            'hits': 2, 'misses': 2, 'evicted': 0, 'expired': 0, 'size': 2,
+        }
+
+    def test_lru(self):
+        """Test that the least recently used responses are evicted"""
+        resp_cache = cache.ResponseCache(max_size=2)
+        resp_cache.set(None, 1, 'one')
+        resp_cache.set(None, 2, 'two')
+        assert resp_cache.get(None, 1) == 'one'
+        resp_cache.set(None, 3, 'three')
+        assert resp_cache.get(None, 2) is None
+        assert resp_cache.get(None, 1) == 'one'
+        assert resp_cache.get(None, 3) == 'three'
+        assert resp_cache.stats()['evicted'] == 1
+        assert resp_cache.stats()['size'] == 2
+
+    def test_ttl(self):
+        """Test that responses expire"""
+        clock = Clock()
+        resp_cache = cache.ResponseCache(ttl=10, timer=clock)
+        resp_cache.set(None, 1, 'one')
+        clock.now = 9
+        assert resp_cache.get(None, 1) == 'one'
+        clock.now = 10
+        assert resp_cache.get(None, 1) is None
+        assert resp_cache.stats() == {
+            'hits': 1, 'misses': 1, 'evicted': 0, 'expired': 1, 'size': 0,
+        }
+
+    def test_variants(self):
+        """Test that representations are cached and dropped together"""
+        resp_cache = cache.ResponseCache()
+        resp_cache.set(None, 1, 'json')
+        resp_cache.set(None, 1, b'msgpack', 'application/msgpack')
+        assert resp_cache.get(None, 1) == 'json'
+        assert resp_cache.get(None, 1, 'application/msgpack') == b'msgpack'
+        resp_cache.invalidate(1)
+        assert resp_cache.stats()['size'] == 0
+
+    @pytest.mark.parametrize('key, by_schema, exp_left', [
+        (None, False, set()),
+        (1, False, {(True, 2)}),
+        (None, True, {(False, 1)}),
+        (1, True, {(False, 1), (True, 2)}),
+    ])
+    def test_invalidate(self, key, by_schema, exp_left):
+        # type: (Optional[int], bool, set) -> None
+        """Test dropping cached responses by key and schema"""
+        sch = FooSchema()
+        resp_cache = cache.ResponseCache()
+        resp_cache.set(None, 1, 'none-one')
+        resp_cache.set(sch, 1, 'sch-one')
+        resp_cache.set(sch, 2, 'sch-two')
+
+        resp_cache.invalidate(key, sch if by_schema else None)
+        assert {
+            (entry_sch is sch, entry_key)
+            for entry_sch, entry_key in [(None, 1), (sch, 1), (sch, 2)]
+            if resp_cache.get(entry_sch, entry_key) is not None
+        } == exp_left
+
+    @pytest.mark.parametrize('by_class', [False, True])
+    def test_invalidate_schema_class(self, by_class):
+        # type: (bool) -> None
+        """Test that copies of a schema are invalidated with it"""
+        sch = FooSchema()
+        resp_cache = cache.ResponseCache()
+        resp_cache.set(clone_schema(sch), 1, 'clone')
+        resp_cache.set(derive_schema(sch, only=['foo']), 2, 'derived')
+        resp_cache.set(None, 3, 'none')
+
+        resp_cache.invalidate(schema=FooSchema if by_class else sch)
+        assert resp_cache.stats()['size'] == 1
+        assert resp_cache.get(None, 3) == 'none'
+
+    def test_bad_size(self):
+        """Test that the cache must be able to hold something"""
+        with pytest.raises(ValueError):
+            cache.ResponseCache(max_size=0)
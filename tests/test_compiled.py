@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.compiled
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import gc
+import weakref
+from collections import OrderedDict
+from datetime import date, datetime
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# Third party
+import pytest
+from marshmallow import (
+    fields, post_dump, pre_load, Schema, validate, validates
+)
+
+# Local
+from falcon_marshmallow import compiled
+from falcon_marshmallow.pool import clone_schema
+
+
+class Inner(Schema):
+    """A schema to nest"""
+    a = fields.Integer()
+    b = fields.String(dump_to='B')
+
+
+class Everything(Schema):
+    """A schema with most kinds of fields"""
+    id = fields.String()
+    num = fields.Integer()
+    num_str = fields.Integer(as_string=True)
+    flt = fields.Float()
+    flag = fields.Boolean()
+    day = fields.Date()
+    moment = fields.DateTime()
+    tags = fields.List(fields.String())
+    nums = fields.List(fields.Integer())
+    inner = fields.Nested(Inner)
+    inners = fields.Nested(Inner, many=True)
+    raw = fields.Raw()
+    with_default = fields.String(default='default')
+    renamed = fields.String(attribute='id')
+    dotted = fields.Integer(attribute='inner.a')
+    method = fields.Method('get_method')
+    secret = fields.String(load_only=True)
+
+    def get_method(self, obj):
+        """Return a constant"""
+        return 'method'
+
+
+class Obj(object):
+    """Object to serialize by attribute"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def num(self):
+        """Callables are called by marshmallow's accessor"""
+        return 5
+
+
+DATA = {
+    'id': 1,
+    'num_str': 3,
+    'flt': '1.5',
+    'flag': 'true',
+    'day': date(2000, 1, 2),
+    'moment': datetime(2000, 1, 2, 3, 4),
+    'tags': ('a', b'b', 3),
+    'nums': ['1', 2],
+    'inner': {'a': '4', 'b': 'x'},
+    'inners': [{'a': 1}, {'b': 2}],
+    'raw': {'z': 1},
+    'secret': 'secret',
+}
+
+
+class TestCompiledSerializer:
+    """Test the generated serializers"""
+
+    @pytest.mark.parametrize('obj', [
+        DATA,
+        Obj(**DATA),
+        OrderedDict(DATA),
+        dict(DATA, flag=True, tags='abc', inner=None),
+        {},
+        dict(DATA, day='not a date'),
+        dict(DATA, num='not a number'),
+    ])
+    def test_parity(self, obj):
+        # type: (object) -> None
+        """Test that results and errors match those of Schema.dump"""
+        sch = Everything()
+        serializer = compiled.get_compiled_serializer(sch)
+        assert serializer is not None
+
+        assert tuple(serializer.dump(obj)) == tuple(sch.dump(obj))
+        assert not serializer.disabled
+
+    def test_parity_many(self):
+        """Test dumping collections"""
+        sch = Everything()
+        serializer = compiled.get_compiled_serializer(sch)
+        objs = [DATA, Obj(**DATA)]
+
+        exp = sch.dump(objs, many=True)
+        assert tuple(serializer.dump(iter(objs), many=True)) == tuple(exp)
+        assert tuple(
+            compiled.get_compiled_serializer(Everything(many=True)).dump(objs)
+        ) == tuple(exp)
+
+    def test_ordered(self):
+        """Test that ordered schemas produce ordered dicts"""
+
+        class Ordered(Schema):
+            """Ordered schema"""
+            class Meta:
+                ordered = True
+            b = fields.String()
+            a = fields.String()
+
+        data, _ = compiled.get_compiled_serializer(Ordered()).dump(
+            {'a': 'a', 'b': 'b'}
+        )
+        assert isinstance(data, OrderedDict)
+        assert list(data) == ['b', 'a']
+
+    def test_only_exclude(self):
+        """Test that only/exclude are respected"""
+        sch = Everything(only=('id', 'num'))
+        data, _ = compiled.get_compiled_serializer(sch).dump(DATA)
+        assert data == sch.dump(DATA).data == {'id': '1'}
+
+    def test_self_nesting(self):
+        """Test that self-referential schemas compile"""
+
+        class Node(Schema):
+            """Tree node"""
+            name = fields.String()
+            children = fields.Nested('self', many=True)
+
+        sch = Node()
+        obj = {'name': 'a', 'children': [{'name': 'b', 'children': []}]}
+        serializer = compiled.get_compiled_serializer(sch)
+        assert tuple(serializer.dump(obj)) == tuple(sch.dump(obj))
+
+    def test_cached_per_instance(self):
+        """Test that serializers are compiled once per schema instance"""
+        sch = Everything()
+        serializer = compiled.get_compiled_serializer(sch)
+        assert compiled.get_compiled_serializer(sch) is serializer
+        assert compiled.get_compiled_serializer(Everything()) is not serializer
+
+    def test_code_shared(self):
+        """Test that clones of a schema share its compiled code"""
+
+        class Shared(Schema):
+            """A schema compiled for the first time here"""
+            foo = fields.String()
+            bar = fields.Integer()
+
+        sch = Shared()
+        with mock.patch.object(
+            compiled, 'compile', wraps=compile, create=True
+        ) as compile_:
+            serializers = [
+                compiled.get_compiled_serializer(each)
+                for each in (sch, clone_schema(sch), clone_schema(sch))
+            ]
+            assert compile_.call_count == 1
+            # Other configurations are compiled separately
+            compiled.get_compiled_serializer(Shared(only=('foo',)))
+            assert compile_.call_count == 2
+        assert len(set(serializers)) == 3
+        assert len(set(each.dump_one.__code__ for each in serializers)) == 1
+        # Each clone's function uses that clone's fields
+        for serializer in serializers:
+            field = serializer.schema.fields['foo']
+            assert any(
+                value is field
+                for value in serializer.dump_one.__globals__.values()
+            )
+
+    def test_recompiled_on_change(self):
+        """Test that schemas changed since compiled are compiled again"""
+        sch = Everything()
+        serializer = compiled.get_compiled_serializer(sch)
+        sch.only = sch.set_class(['id', 'num'])
+        sch._update_fields(many=sch.many)
+
+        changed = compiled.get_compiled_serializer(sch)
+        assert changed is not serializer
+        assert compiled.get_compiled_serializer(sch) is changed
+        # and verified again
+        with mock.patch.object(sch, 'dump', wraps=sch.dump) as dump:
+            assert changed.dump(DATA)[0] == {'id': '1'}
+        dump.assert_called_once_with(DATA, many=False)
+
+    def test_collected(self):
+        """Test that compiling a schema does not keep it alive"""
+        sch = Everything()
+        assert compiled.get_compiled_serializer(sch) is not None
+        ref = weakref.ref(sch)
+        del sch
+        gc.collect()
+        assert ref() is None
+
+    def test_disabled_on_mismatch(self):
+        """Test that a serializer disables itself if its output differs"""
+        sch = Everything()
+        serializer = compiled.get_compiled_serializer(sch)
+        serializer.dump_one = lambda obj: {'wrong': True}
+
+        assert serializer.dump(DATA) == sch.dump(DATA)
+        assert serializer.disabled
+        assert serializer.dump(DATA) == sch.dump(DATA)
+
+
+class Request(Schema):
+    """A schema to load"""
+    name = fields.String(required=True, validate=validate.Length(max=8))
+    num = fields.Integer(missing=0)
+    flt = fields.Float(load_from='float')
+    flag = fields.Boolean(allow_none=True)
+    moment = fields.DateTime()
+    tags = fields.List(fields.String())
+    inner = fields.Nested(Inner)
+    inners = fields.Nested(Inner, many=True)
+    raw = fields.Raw()
+    dotted = fields.Integer(attribute='inner.c')
+    method = fields.Method(deserialize='load_method')
+    computed = fields.String(dump_only=True)
+
+    def load_method(self, value):
+        """Return the value, reversed"""
+        return value[::-1]
+
+
+REQUEST = {
+    'name': 'name',
+    'num': 1,
+    'float': 1.5,
+    'flag': True,
+    'moment': '2000-01-02T03:04:00',
+    'tags': ['a', 'b'],
+    'inner': {'a': 1, 'b': 'x'},
+    'inners': [{'a': 2}, {'b': 'y'}],
+    'raw': {'z': [1]},
+    'dotted': 3,
+    'method': 'abc',
+    'computed': 'ignored',
+}
+
+
+class TestCompiledLoader:
+    """Test the generated loaders"""
+
+    @pytest.mark.parametrize('data', [
+        REQUEST,
+        {'name': 'name'},
+        dict(REQUEST, num='2', flag='yes', tags=['a', 1], flt=2),
+        dict(REQUEST, flag=None),
+        {},
+        dict(REQUEST, name='much too long'),
+        dict(REQUEST, name=None),
+        dict(REQUEST, num='foo'),
+        dict(REQUEST, tags=[None]),
+        dict(REQUEST, inner={'a': 'foo'}),
+        dict(REQUEST, inners={'a': 1}),
+        OrderedDict(REQUEST),
+        ['not', 'a', 'dict'],
+        'not a dict',
+        None,
+    ])
+    def test_parity(self, data):
+        # type: (object) -> None
+        """Test that results and errors match those of Schema.load"""
+        sch = Request()
+        loader = compiled.get_compiled_loader(sch)
+        assert loader is not None
+
+        assert tuple(loader.load(data)) == tuple(sch.load(data))
+        assert not loader.disabled
+
+    def test_parity_many(self):
+        """Test loading collections"""
+        sch = Request()
+        loader = compiled.get_compiled_loader(sch)
+        good = [REQUEST, {'name': 'name'}]
+        bad = good + [{'num': 'foo'}]
+
+        for data in (good, bad, REQUEST):
+            assert tuple(loader.load(data, many=True)) == tuple(
+                sch.load(data, many=True)
+            )
+        assert tuple(
+            compiled.get_compiled_loader(Request(many=True)).load(good)
+        ) == tuple(sch.load(good, many=True))
+
+    def test_partial(self):
+        """Test that partial loads are left to the schema"""
+        sch = Request(partial=True)
+        loader = compiled.get_compiled_loader(sch)
+        loader.load_one = mock.Mock()
+        assert tuple(loader.load({})) == tuple(sch.load({}))
+        assert tuple(
+            loader.load({}, partial=('name',))
+        ) == tuple(sch.load({}, partial=('name',)))
+        loader.load_one.assert_not_called()
+
+    def test_ordered(self):
+        """Test that ordered schemas produce ordered dicts"""
+
+        class Ordered(Schema):
+            """Ordered schema"""
+            class Meta:
+                ordered = True
+            b = fields.String()
+            a = fields.String()
+
+        data, _ = compiled.get_compiled_loader(Ordered()).load(
+            {'a': 'a', 'b': 'b'}
+        )
+        assert isinstance(data, OrderedDict)
+        assert list(data) == ['b', 'a']
+
+    def test_self_nesting(self):
+        """Test that self-referential schemas compile"""
+
+        class Node(Schema):
+            """Tree node"""
+            name = fields.String()
+            children = fields.Nested('self', many=True)
+
+        sch = Node()
+        data = {'name': 'a', 'children': [{'name': 'b', 'children': []}]}
+        loader = compiled.get_compiled_loader(sch)
+        assert tuple(loader.load(data)) == tuple(sch.load(data))
+
+    def test_cached_per_instance(self):
+        """Test that loaders are compiled once per schema instance"""
+        sch = Request()
+        loader = compiled.get_compiled_loader(sch)
+        assert compiled.get_compiled_loader(sch) is loader
+        assert compiled.get_compiled_loader(Request()) is not loader
+
+    def test_disabled_on_mismatch(self):
+        """Test that a loader disables itself if its output differs"""
+        sch = Request()
+        loader = compiled.get_compiled_loader(sch)
+        loader.load_one = lambda data: {'wrong': True}
+
+        assert loader.load(REQUEST) == sch.load(REQUEST)
+        assert loader.disabled
+        assert loader.load(REQUEST) == sch.load(REQUEST)
+
+
+class TestUncompilable:
+    """Test that schemas which cannot be compiled are detected"""
+
+    def test_processors(self):
+        """Test schemas with processors"""
+
+        class WithProcessor(Schema):
+            """Schema with a post-dump processor"""
+            foo = fields.String()
+
+            @post_dump
+            def upper(self, data):
+                """Modify the data"""
+                return data
+
+        assert compiled.get_compiled_serializer(WithProcessor()) is None
+
+        class WithPreLoad(Schema):
+            """Schema with a pre-load processor"""
+            foo = fields.String()
+
+            @pre_load
+            def lower(self, data):
+                """Modify the data"""
+                return data
+
+        assert compiled.get_compiled_loader(WithPreLoad()) is None
+
+    def test_validators(self):
+        """Test schemas with validation methods"""
+
+        class WithValidator(Schema):
+            """Schema with a field validation method"""
+            foo = fields.String()
+
+            @validates('foo')
+            def check_foo(self, value):
+                """Accept anything"""
+
+        assert compiled.get_compiled_loader(WithValidator()) is None
+
+    def test_implicit_fields(self):
+        """Test schemas with implicit fields"""
+
+        class Implicit(Schema):
+            """Schema with implicit fields"""
+            class Meta:
+                fields = ('foo', 'bar')
+
+        assert compiled.get_compiled_serializer(Implicit()) is None
+
+    def test_custom_get_attribute(self):
+        """Test schemas with custom attribute access"""
+
+        class Custom(Schema):
+            """Schema with custom attribute access"""
+            foo = fields.String()
+
+            def get_attribute(self, attr, obj, default):
+                return 'custom'
+
+        assert compiled.get_compiled_serializer(Custom()) is None
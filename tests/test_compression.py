@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.compression
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import gzip
+import io
+import zlib
+from typing import Optional
+
+# Third party
+import pytest
+from falcon import errors
+
+# Local
+from falcon_marshmallow import compression
+from falcon_marshmallow.body import is_spooled
+
+
+BODY = b'{"name": "S\xc3\xb8ren Kierkegaard"}' * 100
+
+
+def gunzip(data):
+    # type: (bytes) -> bytes
+    """Decompress gzipped data with the gzip module"""
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+class TestChooseEncoding:
+    """Test negotiating content codings"""
+
+    @pytest.mark.parametrize('header, exp', [
+        (None, None),
+        ('', None),
+        ('identity', None),
+        ('gzip', 'gzip'),
+        ('deflate', 'deflate'),
+        ('deflate, gzip', 'gzip'),
+        ('gzip;q=0.5, deflate', 'deflate'),
+        ('GZIP ; q=0.8, br', 'gzip'),
+        ('gzip;q=0, deflate;q=0', None),
+        ('*', 'gzip'),
+        ('*;q=0.1, deflate;q=0.5', 'deflate'),
+        ('gzip;q=bad', None),
+    ])
+    def test_choose_encoding(self, header, exp):
+        # type: (Optional[str], Optional[str]) -> None
+        """Test choosing the preferred accepted coding"""
+        assert compression.choose_encoding(header) == exp
+
+
+class TestCompress:
+    """Test compressing response bodies"""
+
+    def test_compress(self):
+        """Test compressing whole bodies"""
+        assert gunzip(compression.compress(BODY, 'gzip')) == BODY
+        assert zlib.decompress(compression.compress(BODY, 'deflate')) == BODY
+
+    def test_compress_stream(self):
+        """Test compressing bodies chunk by chunk"""
+        chunks = list(compression.compress_stream(
+            (BODY[i:i + 100] for i in range(0, len(BODY), 100)), 'gzip'
+        ))
+        assert gunzip(b''.join(chunks)) == BODY
+
+
+class TestDecompressStream:
+    """Test decompressing request bodies"""
+
+    @pytest.mark.parametrize('encoding, compress', [
+        ('gzip', lambda data: compression.compress(data, 'gzip')),
+        ('x-gzip', lambda data: compression.compress(data, 'gzip')),
+        ('deflate', zlib.compress),
+    ])
+    def test_decompress_stream(self, encoding, compress):
+        """Test decompressing bodies in chunks"""
+        stream = io.BytesIO(compress(BODY))
+        assert compression.decompress_stream(
+            stream, encoding, chunk_size=16
+        ) == BODY
+
+    @pytest.mark.parametrize('max_size, raises', [
+        (None, False),
+        (len(BODY), False),
+        (len(BODY) - 1, True),
+    ])
+    def test_max_size(self, max_size, raises):
+        # type: (Optional[int], bool) -> None
+        """Test that bodies expanding beyond the limit are rejected"""
+        stream = io.BytesIO(compression.compress(BODY, 'gzip'))
+        if raises:
+            with pytest.raises(errors.HTTPPayloadTooLarge):
+                compression.decompress_stream(stream, 'gzip', max_size, 16)
+        else:
+            compression.decompress_stream(stream, 'gzip', max_size, 16)
+
+    @pytest.mark.parametrize('spool_threshold, spooled', [
+        (None, False),
+        (len(BODY), False),
+        (len(BODY) - 1, True),
+    ])
+    def test_spool_threshold(self, spool_threshold, spooled):
+        # type: (Optional[int], bool) -> None
+        """Test spooling bodies by their decompressed size"""
+        stream = io.BytesIO(compression.compress(BODY, 'gzip'))
+        content = compression.decompress_stream(
+            stream, 'gzip', chunk_size=16, spool_threshold=spool_threshold
+        )
+        assert is_spooled(content) is spooled
+        assert content[:] == BODY
+
+    def test_multi_member(self):
+        """Test that all members of a gzip body are decompressed"""
+        stream = io.BytesIO(
+            compression.compress(BODY, 'gzip') + gzip.compress(b'tail')
+        )
+        assert compression.decompress_stream(
+            stream, 'gzip', chunk_size=16
+        ) == BODY + b'tail'
+
+    def test_multi_member_max_size(self):
+        """Test that the limit applies to all members together"""
+        stream = io.BytesIO(compression.compress(BODY, 'gzip') * 2)
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            compression.decompress_stream(stream, 'gzip', len(BODY) + 1)
+
+    @pytest.mark.parametrize('encoding, body', [
+        ('deflate', zlib.compress(BODY) + zlib.compress(b'tail')),
+        ('gzip', compression.compress(BODY, 'gzip') + b'not gzip'),
+    ])
+    def test_trailing_data(self, encoding, body):
+        # type: (str, bytes) -> None
+        """Test that data past the end of the stream is rejected"""
+        with pytest.raises(errors.HTTPBadRequest):
+            compression.decompress_stream(io.BytesIO(body), encoding)
+
+    def test_bomb(self):
+        """Test that bombs are rejected before being fully expanded"""
+        bomb = compression.compress(b'\0' * (10 * 1024 * 1024), 'gzip')
+        stream = io.BytesIO(bomb)
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            compression.decompress_stream(stream, 'gzip', 1024)
+
+    @pytest.mark.parametrize('encoding, body, exc', [
+        ('br', b'foo', errors.HTTPUnsupportedMediaType),
+        ('gzip', b'not gzip', errors.HTTPBadRequest),
+        ('gzip', compression.compress(BODY, 'gzip')[:-20],
+         errors.HTTPBadRequest),
+    ])
+    def test_bad_body(self, encoding, body, exc):
+        # type: (str, bytes, type) -> None
+        """Test rejecting unsupported codings and bad bodies"""
+        with pytest.raises(exc):
+            compression.decompress_stream(io.BytesIO(body), encoding)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.etags
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+from typing import List, Optional
+
+# Third party
+import pytest
+
+# Local
+from falcon_marshmallow import etags
+
+
+class TestMakeETag:
+    """Test computing entity tags"""
+
+    def test_make_etag(self):
+        """Test that tags are quoted and depend only on the content"""
+        etag = etags.make_etag('{"foo": "tést"}')
+        assert etag.startswith('"') and etag.endswith('"')
+        assert etag == etags.make_etag('{"foo": "tést"}'.encode('utf-8'))
+        assert etag != etags.make_etag('{"foo": "test"}')
+
+
+class TestParseETags:
+    """Test parsing If-None-Match headers"""
+
+    @pytest.mark.parametrize('header, exp', [
+        (None, []),
+        ('', []),
+        ('"abc"', ['abc']),
+        ('W/"abc", "def" ,', ['abc', 'def']),
+        ('*', ['*']),
+    ])
+    def test_parse_etags(self, header, exp):
+        # type: (Optional[str], List[str]) -> None
+        """Test parsing lists of tags"""
+        assert etags.parse_etags(header) == exp
+
+
+class TestETagMatches:
+    """Test matching tags against If-None-Match headers"""
+
+    @pytest.mark.parametrize('header, etag, exp', [
+        (None, '"abc"', False),
+        ('"abc"', '"abc"', True),
+        ('"def", W/"abc"', '"abc"', True),
+        ('"abc"', 'W/"abc"', True),
+        ('"def"', '"abc"', False),
+        ('*', '"abc"', True),
+    ])
+    def test_etag_matches(self, header, etag, exp):
+        # type: (Optional[str], str, bool) -> None
+        """Test weak comparison of tags"""
+        assert etags.etag_matches(header, etag) is exp
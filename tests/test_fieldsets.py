@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.fieldsets
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+from typing import List, Optional
+
+# Third party
+import pytest
+from marshmallow import fields, Schema
+
+# Local
+from falcon_marshmallow import fieldsets
+
+
+class Author(Schema):
+    """A schema to nest"""
+    name = fields.String()
+    age = fields.Integer(dump_to='years')
+
+    class Meta:
+        ordered = True
+
+
+class Book(Schema):
+    """A schema with nested and renamed fields"""
+    title = fields.String()
+    author = fields.Nested(Author)
+    pages = fields.Integer(dump_to='page_count')
+    tags = fields.List(fields.String())
+    secret = fields.String()
+
+    class Meta:
+        ordered = True
+        exclude = ('secret',)
+
+
+BOOK = {
+    'title': 'Either/Or',
+    'author': {'name': 'Søren Kierkegaard', 'age': 42},
+    'pages': 600,
+    'tags': ['philosophy'],
+    'secret': 'hidden',
+}
+
+
+@pytest.mark.parametrize('name, exp', [
+    ('title', 'title'),
+    ('pages', 'pages'),
+    ('page_count', 'pages'),
+    ('author.name', 'author.name'),
+    ('author.years', 'author.age'),
+    ('secret', ValueError),
+    ('unknown', ValueError),
+    ('title.name', ValueError),
+    ('tags.name', ValueError),
+    ('author.unknown', ValueError),
+])
+def test_resolve_field_name(name, exp):
+    # type: (str, object) -> None
+    """Test resolving requested names to field names"""
+    if exp is ValueError:
+        with pytest.raises(ValueError):
+            fieldsets.resolve_field_name(Book(), name)
+    else:
+        assert fieldsets.resolve_field_name(Book(), name) == exp
+
+
+@pytest.mark.parametrize('only, exclude, exp_keys', [
+    (None, None, ['title', 'author', 'page_count', 'tags']),
+    (['tags', 'title'], None, ['title', 'tags']),
+    (['page_count'], None, ['page_count']),
+    (None, ['author', 'tags'], ['title', 'page_count']),
+    (['title', 'tags'], ['tags'], ['title']),
+    ([], None, []),
+])
+def test_derive_schema(only, exclude, exp_keys):
+    # type: (Optional[List[str]], Optional[List[str]], List[str]) -> None
+    """Test deriving schemas restricted to a selection of fields"""
+    sch = Book()
+    derived = fieldsets.derive_schema(sch, only, exclude)
+    data, errors = derived.dump(BOOK)
+    assert not errors
+    assert list(data) == exp_keys
+    # The declared schema is unaffected
+    assert list(sch.dump(BOOK).data) == [
+        'title', 'author', 'page_count', 'tags'
+    ]
+
+
+@pytest.mark.parametrize('only, exclude, exp_author', [
+    (['author.name'], None, {'name': 'Søren Kierkegaard'}),
+    (['author.years', 'author.name'], None, {
+        'name': 'Søren Kierkegaard', 'years': 42,
+    }),
+    (None, ['author.name'], {'years': 42}),
+])
+def test_derive_schema_nested(only, exclude, exp_author):
+    # type: (Optional[List[str]], Optional[List[str]], dict) -> None
+    """Test selecting the fields of nested schemas"""
+    sch = Book()
+    derived = fieldsets.derive_schema(sch, only, exclude)
+    assert derived.dump(BOOK).data['author'] == exp_author
+    assert sch.dump(BOOK).data['author'] == {
+        'name': 'Søren Kierkegaard', 'years': 42,
+    }
+
+
+def test_derive_schema_keeps_options():
+    """Test that the declared schema's own options still apply"""
+    sch = Book(only=('title', 'pages'), many=True)
+    derived = fieldsets.derive_schema(sch, None, ['title'])
+    assert derived.many
+    assert derived.dump([BOOK]).data == [{'page_count': 600}]
+    with pytest.raises(ValueError):
+        fieldsets.derive_schema(sch, ['tags'])
+
+
+class TestFieldsetCache:
+    """Test caching derived schemas"""
+
+    def test_get(self):
+        """Test that derived schemas are reused"""
+        sch = Book()
+        cache = fieldsets.FieldsetCache()
+        derived = cache.get(sch, frozenset(['title']))
+        assert derived is not sch
+        assert derived.dump(BOOK).data == {'title': 'Either/Or'}
+        assert cache.get(sch, frozenset(['title'])) is derived
+        assert cache.get(sch, None, frozenset(['title'])) is not derived
+        assert cache.get(Book(), frozenset(['title'])) is not derived
+        assert cache.stats() == {
+            'hits': 1, 'misses': 3, 'evicted': 0, 'size': 3,
+        }
+        cache.clear()
+        assert cache.stats()['size'] == 0
+
+    def test_lru(self):
+        """Test that the least recently used schemas are evicted"""
+        sch = Book()
+        cache = fieldsets.FieldsetCache(max_size=2)
+        title = cache.get(sch, frozenset(['title']))
+        cache.get(sch, frozenset(['pages']))
+        assert cache.get(sch, frozenset(['title'])) is title
+        cache.get(sch, frozenset(['tags']))
+        assert cache.get(sch, frozenset(['title'])) is title
+        assert cache.stats() == {
+            'hits': 2, 'misses': 3, 'evicted': 1, 'size': 2,
+        }
+
+    def test_unknown_field(self):
+        """Test that unknown fields are not cached"""
+        cache = fieldsets.FieldsetCache()
+        with pytest.raises(ValueError):
+            cache.get(Book(), frozenset(['secret']))
+        assert cache.stats()['size'] == 0
+
+    def test_invalid_size(self):
+        """Test that the cache must be able to hold a schema"""
+        with pytest.raises(ValueError):
+            fieldsets.FieldsetCache(0)
@@ -8,6 +8,10 @@ from __future__ import (
     absolute_import, division, print_function, unicode_literals
 )
 import logging
+import os
+import pstats
+import threading
+import zlib
 from datetime import date
 from uuid import uuid1
 
@@ -15,10 +19,16 @@ from uuid import uuid1
 import pytest
 import simplejson as json
 from falcon import API, status_codes, testing
-from marshmallow import fields, Schema
+from marshmallow import fields, post_load, Schema
 
 # Local
 from falcon_marshmallow import middleware as m
+from falcon_marshmallow.cache import ResponseCache
+from falcon_marshmallow.compression import compress
+from falcon_marshmallow.media import get_default_codecs
+from falcon_marshmallow.metrics import InMemorySink
+from falcon_marshmallow.profiling import RequestProfiler
+from falcon_marshmallow.streaming import RecordError
 
 
 log = logging.getLogger(__name__)
@@ -170,10 +180,62 @@ class TestAllIncludedMiddleware:
         )  # type: testing.Result
         assert resp.status_code == 200
 
+    def test_responder_rereads_body(self):
+        """Test that responders can re-read the body after middleware"""
+        seen = {}
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                seen['stream'] = req.stream.read()
+                req.stream.seek(0)
+                seen['bounded_stream'] = req.bounded_stream.read()
+                req.context['result'] = req.context['json']
+
+        app = API(middleware=[
+            m.Marshmallow(),
+            m.JSONEnforcer(),
+            m.EmptyRequestDropper()])
+        app.add_route('/echo', Echo())
+        client = testing.TestClient(app)
+
+        body = json.dumps({'foo': 'bär'})
+        resp = client.simulate_post(
+            '/echo', body=body, headers=self.headers
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert resp.json == {'foo': 'bär'}
+        assert seen['stream'] == body.encode('utf-8')
+        assert seen['bounded_stream'] == body.encode('utf-8')
+
 
 class TestMarshmallowMiddleware:
     """Test Marshmallow middleware"""
 
+    def test_get_compiled(self):
+        """Test getting a philosopher with a compiled schema"""
+        data_store = DataStore()
+
+        class PhilosopherResource:
+
+            schema = Philosopher()
+
+            def on_get(self, req, resp, phil_id):
+                req.context['result'] = data_store.get(phil_id)
+
+        app = API(middleware=[m.Marshmallow(compile_schemas=True)])
+        app.add_route('/philosophers/{phil_id}', PhilosopherResource())
+        client = testing.TestClient(app)
+
+        for _ in range(2):
+            resp = client.simulate_get(
+                '/philosophers/first'
+            )  # type: testing.Result
+            assert resp.status_code == 200
+            assert resp.json['name'] == 'Søren Kierkegaard'
+            assert resp.json['birth'] == '1813-05-05'
+            assert resp.json['works'] == ['Fear and Trembling', 'Either/Or']
+
     def test_get(self, hydrated_client):
         # type: (testing.TestClient) -> None
         """Test getting the pre-populated philosopher"""
@@ -247,6 +309,969 @@ class TestMarshmallowMiddleware:
         assert resp.status == status_codes.HTTP_BAD_REQUEST
 
 
+class TestStreamingMiddleware:
+    """Test the Marshmallow middleware with incremental body parsing"""
+
+    @pytest.mark.parametrize('stream_json', [True, False])
+    def test_post_many(self, stream_json):
+        # type: (bool) -> None
+        """Test posting a large array with and without streaming"""
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        app = API(middleware=[
+            m.Marshmallow(stream_json=stream_json, stream_chunk_size=256)
+        ])
+        app.add_route('/echo', Echo())
+        client = testing.TestClient(app)
+
+        body = [{'id': i, 'name': 'Søren'} for i in range(500)]
+        resp = client.simulate_post(
+            '/echo', body=json.dumps(body)
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert resp.json == body
+
+    def test_post_bad_json(self):
+        """Test that streamed invalid JSON is rejected"""
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        app = API(middleware=[m.Marshmallow(stream_json=True)])
+        app.add_route('/echo', Echo())
+        client = testing.TestClient(app)
+
+        resp = client.simulate_post(
+            '/echo', body='[{"foo": 1}, {::'
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_BAD_REQUEST
+
+
+class TestBatchRequests:
+    """Test posting many objects in one request"""
+
+    @pytest.fixture()
+    def client(self):
+        """A client for an API accepting batches of philosophers"""
+        data_store = DataStore()
+
+        class PhilosopherCollection:
+
+            post_request_many = True
+            schema = Philosopher()
+            post_response_schema = Philosopher(many=True)
+
+            def on_post(self, req, resp):
+                req.context['result'] = [
+                    data_store.insert(phil) for phil in req.context['json']
+                ]
+                if req.context.get('errors'):
+                    resp.status = status_codes.HTTP_207
+
+        app = API(middleware=[m.Marshmallow(partial_many=True)])
+        app.add_route('/philosophers', PhilosopherCollection())
+        yield testing.TestClient(app)
+        data_store.clear()
+
+    def test_post_batch(self, client):
+        # type: (testing.TestClient) -> None
+        """Test posting a batch of philosophers"""
+        phils = [
+            {'name': 'Philosopher %d' % i, 'birth': '1900-01-%02d' % i}
+            for i in range(1, 21)
+        ]
+        phils[3]['birth'] = 'a long time ago'
+
+        resp = client.simulate_post(
+            '/philosophers', body=json.dumps(phils)
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_207
+        names = [phil['name'] for phil in resp.json]
+        assert names == [
+            phil['name'] for i, phil in enumerate(phils) if i != 3
+        ]
+        assert all(phil['id'] for phil in resp.json)
+
+    def test_post_batch_invalid(self, client):
+        # type: (testing.TestClient) -> None
+        """Test posting a batch of invalid philosophers"""
+        resp = client.simulate_post(
+            '/philosophers', body=json.dumps([{'birth': 'yesterday'}])
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_UNPROCESSABLE_ENTITY
+        assert 'birth' in json.loads(resp.json['description'])['0']
+
+
+class TestFailFast:
+    """Test rejecting invalid requests once enough errors are found"""
+
+    @pytest.fixture()
+    def client(self):
+        """A client for an API failing fast on batches of philosophers"""
+
+        class PhilosopherCollection:
+
+            post_request_many = True
+            post_request_schema = Philosopher()
+
+            def on_post(self, req, resp):
+                req.context['result'] = {'count': len(req.context['json'])}
+
+        class StrictPhilosopherCollection(PhilosopherCollection):
+
+            post_max_errors = 1
+
+        class SchoolSchema(Schema):
+            name = fields.String()
+            members = fields.Nested(Philosopher, many=True)
+
+        class SchoolCollection:
+
+            post_request_schema = SchoolSchema()
+
+            def on_post(self, req, resp):
+                req.context['result'] = {'name': req.context['json']['name']}
+
+        app = API(middleware=[m.Marshmallow(
+            partial_many=True, max_errors=5, max_error_size=300
+        )])
+        app.add_route('/philosophers', PhilosopherCollection())
+        app.add_route('/strict', StrictPhilosopherCollection())
+        app.add_route('/schools', SchoolCollection())
+        return testing.TestClient(app)
+
+    @staticmethod
+    def _phils(size, invalid=()):
+        # type: (int, tuple) -> list
+        return [
+            {
+                'name': 'Philosopher %d' % i,
+                'birth': 'never' if i in invalid else '1900-01-01',
+            }
+            for i in range(size)
+        ]
+
+    def test_few_errors(self, client):
+        # type: (testing.TestClient) -> None
+        """Test that requests below the limit are partially accepted"""
+        resp = client.simulate_post(
+            '/philosophers', body=json.dumps(self._phils(500, (3, 300)))
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert resp.json == {'count': 498}
+
+    def test_many_errors(self, client):
+        # type: (testing.TestClient) -> None
+        """Test that requests reaching the limit are rejected"""
+        resp = client.simulate_post(
+            '/philosophers',
+            body=json.dumps(self._phils(1000, range(0, 1000, 2))),
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_UNPROCESSABLE_ENTITY
+        description = resp.json['description']
+        assert len(description) <= 300
+        errors = json.loads(description)
+        assert errors.pop('_truncated') is True
+        assert 0 < len(errors) <= 5
+        assert sorted(map(int, errors)) == list(range(0, 2 * len(errors), 2))
+
+    def test_resource_limit(self, client):
+        # type: (testing.TestClient) -> None
+        """Test that resources may set their own limit"""
+        resp = client.simulate_post(
+            '/strict', body=json.dumps(self._phils(500, (300, 400)))
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_UNPROCESSABLE_ENTITY
+        errors = json.loads(resp.json['description'])
+        assert errors == {
+            '300': {'birth': ['Not a valid date.']}, '_truncated': True,
+        }
+
+    def test_nested_collection(self, client):
+        # type: (testing.TestClient) -> None
+        """Test that nested collections are validated in full
+
+        Only the errors reported are bounded, by ``max_error_size``,
+        since the errors of a nested collection are those of one field.
+        """
+        school = {'name': 'Stoa', 'members': self._phils(1000, range(1000))}
+        resp = client.simulate_post(
+            '/schools', body=json.dumps(school)
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_UNPROCESSABLE_ENTITY
+        assert json.loads(resp.json['description']) == {'_truncated': True}
+
+
+class TestMetrics:
+    """Test measuring the stages of (de)serialization"""
+
+    def test_schema_stages(self):
+        """Test that every stage is measured with a schema"""
+
+        class PhilosopherCollection:
+
+            schema = Philosopher()
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        sink = InMemorySink()
+        app = API(middleware=[
+            m.EmptyRequestDropper(), m.Marshmallow(metrics=sink),
+        ])
+        app.add_route('/philosophers', PhilosopherCollection())
+        client = testing.TestClient(app)
+        body = json.dumps({'name': 'Søren Kierkegaard'})
+        resp = client.simulate_post(
+            '/philosophers', body=body
+        )  # type: testing.Result
+        assert resp.status_code == 200
+
+        def get(kind, name):
+            return sink.get(kind, name, 'PhilosopherCollection', 'POST')
+
+        # The body was read by the EmptyRequestDropper
+        assert get('duration', 'read') is None
+        for stage in ('parse', 'load', 'dump', 'encode'):
+            assert get('duration', stage)['count'] == 1
+        assert get('size', 'request')['sum'] == len(body.encode('utf-8'))
+        assert get('size', 'response')['sum'] == len(resp.content)
+
+    def test_non_ascii_response(self):
+        """Test that text responses are measured in bytes"""
+
+        class UnescapedJSON:
+            loads = staticmethod(json.loads)
+
+            @staticmethod
+            def dumps(obj):
+                return json.dumps(obj, ensure_ascii=False)
+
+        class Philosopher:
+
+            def on_get(self, req, resp):
+                req.context['result'] = {'name': 'Søren Kierkegaard'}
+
+        sink = InMemorySink()
+        app = API(middleware=[
+            m.Marshmallow(metrics=sink, json_module=UnescapedJSON),
+        ])
+        app.add_route('/philosopher', Philosopher())
+        resp = testing.TestClient(app).simulate_get(
+            '/philosopher'
+        )  # type: testing.Result
+        assert 'Søren' in resp.content.decode('utf-8')
+        assert sink.get('size', 'response', 'Philosopher', 'GET')[
+            'sum'
+        ] == len(resp.content)
+
+    def test_read_stage(self):
+        """Test that reading the body is measured when it is read"""
+        sink = InMemorySink()
+        app = API(middleware=[m.Marshmallow(metrics=sink)])
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        app.add_route('/echo', Echo())
+        resp = testing.TestClient(app).simulate_post(
+            '/echo', body='[1, 2, 3]'
+        )  # type: testing.Result
+        assert resp.json == [1, 2, 3]
+        assert sorted(
+            key[1] for key in sink.snapshot() if key[0] == 'duration'
+        ) == ['encode', 'parse', 'read']
+
+    def test_cached_response(self):
+        """Test that cached responses are not dumped again"""
+        sink = InMemorySink()
+        app = API(middleware=[m.Marshmallow(
+            metrics=sink, response_cache=ResponseCache()
+        )])
+
+        class Philosopher:
+
+            def on_get(self, req, resp):
+                req.context['cache_key'] = 'søren'
+                req.context['result'] = {'name': 'Søren'}
+
+        app.add_route('/philosopher', Philosopher())
+        client = testing.TestClient(app)
+        for _ in range(3):
+            client.simulate_get('/philosopher')
+        assert sink.get(
+            'duration', 'encode', 'Philosopher', 'GET'
+        )['count'] == 1
+        assert sink.get('size', 'response', 'Philosopher', 'GET')[
+            'count'
+        ] == 3
+
+
+class TestProfiling:
+    """Test profiling the middleware's work on sampled requests"""
+
+    @staticmethod
+    def _client(directory):
+        # type: (str) -> testing.TestClient
+
+        class PhilosopherCollection:
+
+            schema = Philosopher()
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+            def on_delete(self, req, resp):
+                pass
+
+        profiler = RequestProfiler(directory, header='X-Profile')
+        app = API(middleware=[m.Marshmallow(profiler=profiler)])
+        app.add_route('/philosophers', PhilosopherCollection())
+        return testing.TestClient(app)
+
+    def test_disabled(self):
+        """Test that the middleware's methods are left alone by default"""
+        mw = m.Marshmallow()
+        assert 'process_resource' not in vars(mw)
+        assert 'process_response' not in vars(mw)
+
+    def test_profile(self, tmpdir):
+        # type: (object) -> None
+        """Test profiling requests selected with the header"""
+        directory = str(tmpdir)
+        client = self._client(directory)
+        body = json.dumps({'name': 'Søren Kierkegaard'})
+
+        resp = client.simulate_post(
+            '/philosophers', body=body
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert os.listdir(directory) == []
+
+        resp = client.simulate_post(
+            '/philosophers', body=body, headers={'X-Profile': '1'}
+        )  # type: testing.Result
+        assert resp.json == {'name': 'Søren Kierkegaard'}
+        names = os.listdir(directory)
+        assert len(names) == 1
+        assert names[0].startswith('philosophers.POST.')
+        functions = set(
+            function for _, _, function in
+            pstats.Stats(os.path.join(directory, names[0])).stats
+        )
+        assert '_load_schema' in functions
+        assert '_dump_schema' in functions
+        assert 'on_post' not in functions
+
+    def test_profile_without_result(self, tmpdir):
+        # type: (object) -> None
+        """Test that profiles are written without a result"""
+        directory = str(tmpdir)
+        client = self._client(directory)
+        resp = client.simulate_delete(
+            '/philosophers', headers={'X-Profile': '1'}
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert len(os.listdir(directory)) == 1
+
+    def test_concurrent(self, tmpdir):
+        # type: (object) -> None
+        """Test that concurrent profiled requests both succeed"""
+        directory = str(tmpdir)
+        # Each request waits for the other while it is being loaded,
+        # i.e. while the first to arrive is being profiled
+        barrier = threading.Barrier(2, timeout=5)
+
+        class Waiting(Schema):
+            name = fields.String()
+
+            @post_load
+            def wait(self, data):
+                barrier.wait()
+                return data
+
+        class Echo:
+            schema = Waiting()
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        profiler = RequestProfiler(directory, 1)
+        app = API(middleware=[m.Marshmallow(profiler=profiler)])
+        app.add_route('/echo', Echo())
+        client = testing.TestClient(app)
+        results = []
+
+        def post():
+            results.append(client.simulate_post(
+                '/echo', body=json.dumps({'name': 'Søren'})
+            ).status_code)
+
+        threads = [threading.Thread(target=post) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [200, 200]
+        assert len(os.listdir(directory)) == 1
+
+
+class TestBodyLimits:
+    """Test spooling and limiting request bodies"""
+
+    @staticmethod
+    def _client(**kwargs):
+        # type: (...) -> testing.TestClient
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        app = API(middleware=[
+            m.EmptyRequestDropper(**kwargs), m.Marshmallow(**kwargs)
+        ])
+        app.add_route('/echo', Echo())
+        return testing.TestClient(app)
+
+    @pytest.mark.parametrize('body', [
+        [{'id': i, 'name': 'Søren'} for i in range(200)],
+        {'name': 'Søren' * 100},
+    ])
+    def test_spooled_body(self, body):
+        # type: (object) -> None
+        """Test that bodies above the spool threshold are parsed"""
+        client = self._client(spool_threshold=100)
+        resp = client.simulate_post(
+            '/echo', body=json.dumps(body)
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert resp.json == body
+
+    def test_spooled_bad_json(self):
+        """Test that spooled bodies must still be valid JSON"""
+        client = self._client(spool_threshold=10)
+        resp = client.simulate_post(
+            '/echo', body='[{"foo": "bar"}, {::'
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_BAD_REQUEST
+
+    @pytest.mark.parametrize('size, status', [
+        (50, status_codes.HTTP_200),
+        (500, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+    ])
+    def test_max_body_size(self, size, status):
+        # type: (int, str) -> None
+        """Test that bodies above the maximum size are rejected"""
+        client = self._client(max_body_size=100)
+        resp = client.simulate_post(
+            '/echo', body=json.dumps('x' * size)
+        )  # type: testing.Result
+        assert resp.status == status
+
+
+class TestResourceBodyLimits:
+    """Test request body limits set by resources"""
+
+    @staticmethod
+    def _app(*middleware):
+        # type: (*object) -> API
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        class Upload:
+            post_max_body = 1000
+
+            def on_post(self, req, resp):
+                req.context['result'] = {'size': len(req.stream.read())}
+
+            def on_put(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        app = API(middleware=list(middleware) + [
+            m.EmptyRequestDropper(max_body_size=100, resource_limits=True),
+            m.Marshmallow(max_body_size=100),
+        ])
+        app.add_route('/echo', Echo())
+        app.add_route('/upload', Upload())
+        return app
+
+    @pytest.mark.parametrize('path, size, status', [
+        ('/echo', 50, status_codes.HTTP_200),
+        ('/echo', 500, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+        ('/upload', 500, status_codes.HTTP_200),
+        ('/upload', 5000, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+    ])
+    def test_content_length(self, path, size, status):
+        # type: (str, int, str) -> None
+        """Test that resources may accept larger or smaller bodies"""
+        client = testing.TestClient(self._app())
+        resp = client.simulate_post(
+            path, body=json.dumps('x' * size)
+        )  # type: testing.Result
+        assert resp.status == status
+
+    def test_method_limit(self):
+        """Test that method-specific limits apply to their method only"""
+        client = testing.TestClient(self._app())
+        resp = client.simulate_put(
+            '/upload', body=json.dumps('x' * 500)
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE
+
+    @pytest.mark.parametrize('size, status', [
+        (500, status_codes.HTTP_200),
+        (5000, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+    ])
+    def test_no_content_length(self, size, status):
+        # type: (int, str) -> None
+        """Test that bodies without a Content-Length are bounded"""
+        app = self._app()
+        env = testing.create_environ(
+            '/upload', method='POST', body='x' * size
+        )
+        del env['CONTENT_LENGTH']
+        srmock = testing.StartResponseMock()
+        b''.join(app(env, srmock))
+        assert srmock.status == status
+
+    @pytest.mark.parametrize('path, size, status', [
+        ('/echo', 50, status_codes.HTTP_200),
+        ('/echo', 500, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+        ('/upload', 500, status_codes.HTTP_200),
+        ('/upload', 5000, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+    ])
+    def test_decompressed_size(self, path, size, status):
+        # type: (str, int, str) -> None
+        """Test that limits apply to the size of decompressed bodies"""
+        client = testing.TestClient(self._app(m.Compressor()))
+        body = compress(json.dumps('x' * size).encode('utf-8'), 'gzip')
+        assert len(body) < 100
+        resp = client.simulate_post(
+            path, body=body, headers={'Content-Encoding': 'gzip'}
+        )  # type: testing.Result
+        assert resp.status == status
+
+
+class TestCompression:
+    """Test compressed requests and responses"""
+
+    @pytest.fixture()
+    def client(self):
+        """A client for an API compressing large responses"""
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        app = API(middleware=[
+            m.Compressor(min_size=100, max_decompressed_size=10000),
+            m.EmptyRequestDropper(),
+            m.Marshmallow(),
+        ])
+        app.add_route('/echo', Echo())
+        return testing.TestClient(app)
+
+    @pytest.mark.parametrize('size, encoded', [(2, False), (100, True)])
+    def test_post_compressed(self, client, size, encoded):
+        # type: (testing.TestClient, int, bool) -> None
+        """Test posting a gzipped body and getting a gzipped response"""
+        body = [{'name': 'Søren'}] * size
+        resp = client.simulate_post(
+            '/echo',
+            body=compress(json.dumps(body).encode('utf-8'), 'gzip'),
+            headers={
+                'Content-Encoding': 'gzip', 'Accept-Encoding': 'gzip',
+            },
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_200
+        content = resp.content
+        if encoded:
+            assert resp.headers['Content-Encoding'] == 'gzip'
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        else:
+            assert 'Content-Encoding' not in resp.headers
+        assert json.loads(content.decode('utf-8')) == body
+
+    def test_post_bomb(self, client):
+        """Test that bodies decompressing past the limit are rejected"""
+        resp = client.simulate_post(
+            '/echo',
+            body=compress(json.dumps('x' * 20000).encode('utf-8'), 'gzip'),
+            headers={'Content-Encoding': 'gzip'},
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE
+
+    @pytest.mark.parametrize('size, status', [
+        (100, status_codes.HTTP_200),
+        (20000, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+    ])
+    def test_post_chunked(self, client, size, status):
+        # type: (testing.TestClient, int, str) -> None
+        """Test decompressing bodies without a Content-Length"""
+        body = ['x'] * size
+        env = testing.create_environ(
+            '/echo', method='POST',
+            body=compress(json.dumps(body).encode('utf-8'), 'gzip'),
+            headers={'Content-Encoding': 'gzip'},
+        )
+        del env['CONTENT_LENGTH']
+        srmock = testing.StartResponseMock()
+        content = b''.join(client.app(env, srmock))
+        assert srmock.status == status
+        if status == status_codes.HTTP_200:
+            assert json.loads(content.decode('utf-8')) == body
+
+    @pytest.mark.parametrize('path, size, status', [
+        ('/echo', 500, status_codes.HTTP_200),
+        ('/echo', 5000, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+        ('/upload', 500, status_codes.HTTP_REQUEST_ENTITY_TOO_LARGE),
+    ])
+    def test_resource_limits(self, path, size, status):
+        # type: (str, int, str) -> None
+        """Test that resources may set their own decompressed limit"""
+
+        class Echo:
+
+            def on_post(self, req, resp):
+                req.context['result'] = req.context['json']
+
+        class Upload(Echo):
+            max_body = 100
+
+        app = API(middleware=[
+            m.Compressor(max_decompressed_size=1000, resource_limits=True),
+            m.EmptyRequestDropper(resource_limits=True),
+            m.Marshmallow(),
+        ])
+        app.add_route('/echo', Echo())
+        app.add_route('/upload', Upload())
+        resp = testing.TestClient(app).simulate_post(
+            path,
+            body=compress(json.dumps('x' * size).encode('utf-8'), 'gzip'),
+            headers={'Content-Encoding': 'gzip'},
+        )  # type: testing.Result
+        assert resp.status == status
+
+
+class TestCodecs:
+    """Test content negotiation with a codec registry"""
+
+    def test_post_and_get(self):
+        """Test posting and getting MessagePack"""
+        msgpack = pytest.importorskip('msgpack')
+        data_store = DataStore()
+
+        class PhilosopherResource:
+
+            schema = Philosopher()
+
+            def on_get(self, req, resp, phil_id):
+                req.context['result'] = data_store.get(phil_id)
+
+        class PhilosopherCollection:
+
+            schema = Philosopher()
+
+            def on_post(self, req, resp):
+                req.context['result'] = data_store.insert(req.context['json'])
+
+        codecs = get_default_codecs()
+        app = API(middleware=[
+            m.JSONEnforcer(codecs=codecs), m.Marshmallow(codecs=codecs)
+        ])
+        app.add_route('/philosophers', PhilosopherCollection())
+        app.add_route('/philosophers/{phil_id}', PhilosopherResource())
+        client = testing.TestClient(app)
+
+        headers = {'Accept': 'application/msgpack'}
+        resp = client.simulate_get('/philosophers/first', headers=headers)
+        assert resp.headers['Content-Type'] == 'application/msgpack'
+        phil = msgpack.unpackb(resp.content, raw=False)
+        assert phil['name'] == 'Søren Kierkegaard'
+
+        del phil['id']
+        headers['Content-Type'] = 'application/msgpack'
+        resp = client.simulate_post(
+            '/philosophers', body=msgpack.packb(phil), headers=headers
+        )
+        assert resp.status == status_codes.HTTP_200
+        assert msgpack.unpackb(resp.content, raw=False)['birth'] == (
+            '1813-05-05'
+        )
+
+        resp = client.simulate_get('/philosophers/first')
+        assert resp.json['name'] == 'Søren Kierkegaard'
+
+
+class TestNDJSONRequests:
+    """Test importing newline-delimited JSON"""
+
+    def test_post_ndjson(self):
+        """Test posting records, some of which are invalid"""
+        data_store = DataStore()
+
+        class PhilosopherImport:
+
+            post_request_schema = Philosopher()
+
+            def on_post(self, req, resp):
+                errors = []
+                for record in req.context['json']:
+                    if isinstance(record, RecordError):
+                        errors.append(record.line)
+                    else:
+                        data_store.insert(record)
+                req.context['result'] = {'errors': errors}
+
+        app = API(middleware=[
+            m.JSONEnforcer(ndjson=True), m.Marshmallow(ndjson=True)
+        ])
+        app.add_route('/philosophers/import', PhilosopherImport())
+        client = testing.TestClient(app)
+
+        lines = [json.dumps({'name': str(i)}) for i in range(100)]
+        lines[10] = json.dumps({'birth': 'not a date'})
+        lines[20] = '{::'
+        resp = client.simulate_post(
+            '/philosophers/import',
+            body='\n'.join(lines),
+            headers={'Content-Type': 'application/x-ndjson'},
+        )  # type: testing.Result
+        assert resp.status == status_codes.HTTP_200
+        assert resp.json == {'errors': [11, 21]}
+        assert len(data_store.store) == 1 + 98
+
+
+class TestStreamingResponses:
+    """Test streaming iterator results as JSON arrays"""
+
+    def test_get_generator(self):
+        """Test getting a generator of philosophers"""
+        data_store = DataStore()
+
+        class PhilosopherCollection:
+
+            schema = Philosopher()
+
+            def on_get(self, req, resp):
+                req.context['result'] = (
+                    data_store.get('first') for _ in range(250)
+                )
+
+        app = API(middleware=[m.Marshmallow(stream_batch_size=100)])
+        app.add_route('/philosophers', PhilosopherCollection())
+        client = testing.TestClient(app)
+
+        resp = client.simulate_get('/philosophers')  # type: testing.Result
+        assert resp.status_code == 200
+        parsed = resp.json
+        assert len(parsed) == 250
+        assert all(p['name'] == 'Søren Kierkegaard' for p in parsed)
+        assert all(p['birth'] == '1813-05-05' for p in parsed)
+
+
+class TestConditionalRequests:
+    """Test ETags and conditional GET requests"""
+
+    @pytest.fixture()
+    def client(self):
+        """A client for an API with ETags enabled"""
+        data_store = DataStore()
+
+        class PhilosopherResource:
+
+            schema = Philosopher()
+            versioned = False
+
+            def on_get(self, req, resp, phil_id):
+                """Get a philosopher"""
+                req.context['result'] = data_store.get(phil_id)
+                if self.versioned:
+                    req.context['version'] = 1
+
+        app = API(middleware=[m.Marshmallow(etags=True)])
+        client = testing.TestClient(app)
+        client.resource = PhilosopherResource()
+        app.add_route('/philosophers/{phil_id}', client.resource)
+        yield client
+        data_store.clear()
+
+    @pytest.mark.parametrize('versioned', [False, True])
+    def test_get_not_modified(self, client, versioned):
+        # type: (testing.TestClient, bool) -> None
+        """Test that matching conditional requests get a 304"""
+        client.resource.versioned = versioned
+        resp = client.simulate_get('/philosophers/first')
+        etag = resp.headers['ETag']
+        assert resp.status == status_codes.HTTP_200
+        assert resp.json['name'] == 'Søren Kierkegaard'
+
+        resp = client.simulate_get(
+            '/philosophers/first', headers={'If-None-Match': etag}
+        )
+        assert resp.status == status_codes.HTTP_304
+        assert resp.headers['ETag'] == etag
+        assert resp.content == b''
+
+        resp = client.simulate_get(
+            '/philosophers/first', headers={'If-None-Match': '"other"'}
+        )
+        assert resp.status == status_codes.HTTP_200
+        assert resp.json['name'] == 'Søren Kierkegaard'
+
+
+class TestResponseCache:
+    """Test caching serialized responses"""
+
+    def test_get_cached(self):
+        """Test that cached responses are invalidated after writes"""
+        data_store = DataStore()
+        resp_cache = ResponseCache()
+
+        class PhilosopherResource:
+
+            schema = Philosopher()
+
+            def on_get(self, req, resp, phil_id):
+                """Get a philosopher"""
+                req.context['result'] = data_store.get(phil_id)
+                req.context['cache_key'] = phil_id
+
+            def on_patch(self, req, resp, phil_id):
+                """Update a philosopher"""
+                data_store.get(phil_id).update(req.context['json'])
+                resp_cache.invalidate(phil_id)
+                req.context['result'] = data_store.get(phil_id)
+
+        app = API(middleware=[m.Marshmallow(response_cache=resp_cache)])
+        app.add_route('/philosophers/{phil_id}', PhilosopherResource())
+        client = testing.TestClient(app)
+
+        for _ in range(2):
+            resp = client.simulate_get('/philosophers/first')
+            assert resp.json['name'] == 'Søren Kierkegaard'
+        assert resp_cache.stats()['hits'] == 1
+
+        resp = client.simulate_patch(
+            '/philosophers/first', body=json.dumps({'name': 'S. K.'})
+        )
+        assert resp.json['name'] == 'S. K.'
+        resp = client.simulate_get('/philosophers/first')
+        assert resp.json['name'] == 'S. K.'
+        assert resp_cache.stats()['hits'] == 1
+
+
+class TestSparseFieldsets:
+    """Test selecting the fields of responses"""
+
+    @pytest.fixture()
+    def client(self):
+        """A client for an API accepting field selections"""
+        data_store = DataStore()
+
+        class PhilosopherResource:
+
+            schema = Philosopher()
+
+            def on_get(self, req, resp, phil_id):
+                """Get a philosopher"""
+                req.context['result'] = data_store.get(phil_id)
+
+        app = API(middleware=[
+            m.Marshmallow(fields_param='fields', exclude_param='exclude')
+        ])
+        app.add_route('/philosophers/{phil_id}', PhilosopherResource())
+        yield testing.TestClient(app)
+        data_store.clear()
+
+    @pytest.mark.parametrize('query, exp_keys', [
+        ('', ['birth', 'death', 'id', 'name', 'schools', 'works']),
+        ('fields=name,works', ['name', 'works']),
+        ('fields=name&fields=id', ['id', 'name']),
+        ('exclude=schools,works', ['birth', 'death', 'id', 'name']),
+        ('fields=name,birth&exclude=birth', ['name']),
+    ])
+    def test_get_fields(self, client, query, exp_keys):
+        # type: (testing.TestClient, str, list) -> None
+        """Test that only the selected fields are returned"""
+        resp = client.simulate_get(
+            '/philosophers/first', query_string=query
+        )
+        assert resp.status == status_codes.HTTP_200
+        assert sorted(resp.json) == exp_keys
+
+    def test_get_unknown_field(self, client):
+        # type: (testing.TestClient) -> None
+        """Test that unknown fields are rejected"""
+        resp = client.simulate_get(
+            '/philosophers/first', query_string='fields=name,__class__'
+        )
+        assert resp.status == status_codes.HTTP_400
+        assert '__class__' in resp.json['description']
+
+
+class TestJSONBackends:
+    """Test the Marshmallow middleware with different JSON backends"""
+
+    @pytest.mark.parametrize('backend', ['json', 'simplejson', 'orjson'])
+    def test_post_and_get(self, backend):
+        # type: (str) -> None
+        """Test posting and getting a philosopher"""
+        pytest.importorskip(backend)
+        data_store = DataStore()
+
+        class PhilosopherResource:
+
+            schema = Philosopher()
+
+            def on_get(self, req, resp, phil_id):
+                req.context['result'] = data_store.get(phil_id)
+
+        class PhilosopherCollection:
+
+            schema = Philosopher()
+
+            def on_post(self, req, resp):
+                req.context['result'] = data_store.insert(
+                    req.context['json']
+                )
+
+        app = API(middleware=[m.Marshmallow(json_backend=backend)])
+        app.add_route('/philosophers', PhilosopherCollection())
+        app.add_route('/philosophers/{phil_id}', PhilosopherResource())
+        client = testing.TestClient(app)
+
+        phil = {
+            'name': 'Albért Camus',
+            'birth': date(1913, 11, 7).isoformat(),
+            'schools': ['existentialism', 'absurdism'],
+        }
+        resp = client.simulate_post(
+            '/philosophers', body=json.dumps(phil)
+        )  # type: testing.Result
+        assert resp.status_code == 200
+
+        resp = client.simulate_get(
+            '/philosophers/%s' % resp.json['id']
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert resp.json['name'] == 'Albért Camus'
+        assert resp.json['birth'] == '1913-11-07'
+
+
 class TestExtraMiddleware:
     """Test the enforcement of convenience middleware"""
 
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.media
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import json as std_json
+from typing import Optional
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# Third party
+import pytest
+
+# Local
+from falcon_marshmallow import media
+
+
+class ReversedCodec(media.Codec):
+    """A codec for JSON written backwards, to tell it apart from JSON"""
+
+    media_type = 'application/x-reversed'
+    aliases = ('application/x-backwards',)
+
+    def loads(self, data):
+        return std_json.loads(data[::-1])
+
+    def dumps(self, obj):
+        return std_json.dumps(obj)[::-1]
+
+
+@pytest.fixture()
+def registry():
+    """A registry of JSON and reversed JSON"""
+    return media.CodecRegistry([media.JSONCodec(), ReversedCodec()])
+
+
+@pytest.mark.parametrize('content_type, exp', [
+    (None, False),
+    ('application/json', False),
+    ('application/x-ndjson', True),
+    ('Application/NDJSON; charset=utf-8', True),
+])
+def test_is_ndjson(content_type, exp):
+    # type: (Optional[str], bool) -> None
+    """Test recognizing newline-delimited JSON"""
+    assert media.is_ndjson(content_type) is exp
+
+
+@pytest.mark.parametrize('content_type, exp', [
+    (None, False),
+    ('', False),
+    ('application/json', True),
+    ('Application/JSON; charset=utf-8', True),
+    ('application/vnd.api+json', True),
+    ('application/jsonx', False),
+    ('text/plain; note=application/json', False),
+    ('application/x-ndjson', False),
+])
+def test_is_json(content_type, exp):
+    # type: (Optional[str], bool) -> None
+    """Test recognizing JSON, including +json media types"""
+    assert media.is_json(content_type) is exp
+
+
+@pytest.mark.parametrize('accept, exp', [
+    (None, True),
+    ('*/*', True),
+    ('application/*', True),
+    ('application/json;q=0.1', True),
+    ('text/html, application/problem+json', True),
+    ('text/html', False),
+    ('application/json;q=0, text/html', False),
+    ('application/vnd.api+json;q=0', False),
+    ('garbage', False),
+])
+def test_accepts_json(accept, exp):
+    # type: (Optional[str], bool) -> None
+    """Test checking Accept headers for JSON"""
+    assert media.accepts_json(accept) is exp
+
+
+class TestHeaderCache:
+    """Test caching results computed from header values"""
+
+    def test_cached(self):
+        """Test that results are computed once per header value"""
+        func = mock.Mock(side_effect=lambda value: value is None)
+        cache = media.HeaderCache(func)
+        assert cache(None) is True
+        assert cache('a') is False
+        assert cache(None) is True
+        assert cache('a') is False
+        assert func.call_count == 2
+        assert len(cache) == 2
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_bounded(self):
+        """Test that the oldest results are evicted once full"""
+        func = mock.Mock(side_effect=len)
+        cache = media.HeaderCache(func, max_size=2)
+        for value in ('a', 'bb', 'a', 'ccc', 'a'):
+            assert cache(value) == len(value)
+        assert len(cache) == 2
+        assert func.call_count == 4
+
+    def test_invalid_size(self):
+        """Test that the cache must be able to hold a result"""
+        with pytest.raises(ValueError):
+            media.HeaderCache(len, 0)
+
+
+class TestCodecs:
+    """Test the built-in codecs"""
+
+    @pytest.mark.parametrize('name, codec_cls', [
+        ('simplejson', media.JSONCodec),
+        ('msgpack', media.MsgPackCodec),
+    ])
+    def test_round_trip(self, name, codec_cls):
+        # type: (str, type) -> None
+        """Test that codecs round-trip data and reject bad data"""
+        pytest.importorskip(name)
+        codec = codec_cls()
+        obj = {'foo': ['bär', 1, 2.5, None, True, {'a/b': 'c'}]}
+
+        dumped = codec.dumps(obj)
+        assert isinstance(dumped, bytes) == codec.binary
+        assert codec.loads(dumped) == obj
+
+        with pytest.raises(ValueError):
+            codec.loads(b'\xc1{::')
+        with pytest.raises(TypeError):
+            codec.dumps({'foo': object()})
+
+    def test_json_backend(self):
+        """Test that the JSON codec uses the given backend"""
+        codec = media.JSONCodec('json')
+        assert isinstance(codec.backend, media.JSONBackend)
+        assert codec.backend.module is std_json
+
+
+class TestCodecRegistry:
+    """Test selecting codecs by media type"""
+
+    @pytest.mark.parametrize('content_type, exp', [
+        (None, None),
+        ('', None),
+        ('application/json', media.JSONCodec),
+        ('Application/JSON; charset=utf-8', media.JSONCodec),
+        ('application/problem+json', media.JSONCodec),
+        ('application/x-reversed', ReversedCodec),
+        ('application/x-backwards', ReversedCodec),
+        ('text/html', None),
+    ])
+    def test_get(self, registry, content_type, exp):
+        # type: (media.CodecRegistry, Optional[str], Optional[type]) -> None
+        """Test looking codecs up by Content-Type"""
+        codec = registry.get(content_type)
+        if exp is None:
+            assert codec is None
+        else:
+            assert isinstance(codec, exp)
+
+    @pytest.mark.parametrize('accept, exp', [
+        (None, media.JSONCodec),
+        ('*/*', media.JSONCodec),
+        ('application/*', media.JSONCodec),
+        ('application/x-reversed', ReversedCodec),
+        ('application/json;q=0.5, application/x-backwards', ReversedCodec),
+        ('application/x-reversed;q=0.5, */*', media.JSONCodec),
+        ('text/html', None),
+        ('garbage', None),
+    ])
+    def test_negotiate(self, registry, accept, exp):
+        # type: (media.CodecRegistry, Optional[str], Optional[type]) -> None
+        """Test negotiating codecs from Accept headers"""
+        codec = registry.negotiate(accept)
+        if exp is None:
+            assert codec is None
+        else:
+            assert isinstance(codec, exp)
+
+    def test_register(self, registry):
+        # type: (media.CodecRegistry) -> None
+        """Test the default codec and replacing codecs"""
+        assert isinstance(registry.default, media.JSONCodec)
+        assert registry.media_types == [
+            'application/json', 'application/x-reversed',
+            'application/x-backwards',
+        ]
+        assert isinstance(registry.negotiate('*/*'), media.JSONCodec)
+        codec = media.JSONCodec('json')
+        version = registry.version
+        registry.register(codec)
+        assert registry.version != version
+        assert registry.get('application/json') is codec
+        # Negotiated codecs are not stale
+        assert registry.negotiate('*/*') is codec
+        assert media.CodecRegistry().default is None
+
+    def test_get_default_codecs(self):
+        """Test that MessagePack is supported if installed"""
+        registry = media.get_default_codecs('json')
+        assert registry.get('application/json').backend.module is std_json
+        try:
+            media.MsgPackCodec()
+        except ImportError:
+            assert registry.media_types == ['application/json']
+        else:
+            assert isinstance(
+                registry.get('application/msgpack'), media.MsgPackCodec
+            )
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.metrics
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import socket
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# Third party
+import pytest
+from falcon import API, testing
+
+# Local
+from falcon_marshmallow import metrics
+
+
+class Resource:
+    """A resource to label metrics with"""
+
+
+class TestHistogram:
+    """Test counting values in buckets"""
+
+    def test_observe(self):
+        """Test that values are counted in the first bucket fitting them"""
+        histogram = metrics.Histogram([1, 10, 100])
+        for value in (0.5, 1, 5, 10, 50, 1000):
+            histogram.observe(value)
+        assert histogram.to_dict() == {
+            'count': 6,
+            'sum': 1066.5,
+            'buckets': [(1, 2), (10, 4), (100, 5)],
+        }
+
+
+class TestMetricsSink:
+    """Test the default sink"""
+
+    def test_disabled(self):
+        """Test that nothing is measured for the default sink"""
+        sink = metrics.MetricsSink()
+        recorder = sink.request(Resource(), 'GET')
+        assert recorder is metrics.NULL_REQUEST_METRICS
+        with recorder.time('parse'):
+            pass
+        recorder.size('request', 10)
+        recorder.body_size('response', b'{}')
+
+    def test_enabled(self):
+        """Test that measurements are recorded with their labels"""
+        sink = mock.Mock(spec=metrics.MetricsSink, enabled=True)
+        recorder = metrics.MetricsSink.request(sink, Resource(), 'POST')
+        with pytest.raises(ValueError):
+            with recorder.time('parse'):
+                raise ValueError
+        recorder.size('request', 10)
+        recorder.body_size('response', 'Søren')
+        stage, seconds, resource, method = (
+            sink.record_duration.call_args[0]
+        )
+        assert (stage, resource, method) == ('parse', 'Resource', 'POST')
+        assert seconds >= 0
+        assert sink.record_size.call_args_list == [
+            mock.call('request', 10, 'Resource', 'POST'),
+            mock.call('response', 6, 'Resource', 'POST'),
+        ]
+
+
+class TestInMemorySink:
+    """Test keeping histograms in memory"""
+
+    def test_record(self):
+        """Test recording durations and sizes"""
+        sink = metrics.InMemorySink(duration_buckets=[0.1, 1])
+        sink.record_duration('parse', 0.05, 'Resource', 'POST')
+        sink.record_duration('parse', 0.5, 'Resource', 'POST')
+        sink.record_duration('load', 0.05, 'Resource', 'POST')
+        sink.record_size('request', 2000, 'Resource', 'POST')
+
+        assert sink.get('duration', 'parse', 'Resource', 'POST') == {
+            'count': 2, 'sum': 0.55, 'buckets': [(0.1, 1), (1, 2)],
+        }
+        assert sink.get('duration', 'parse', 'Resource', 'GET') is None
+        assert sink.get('size', 'request', 'Resource', 'POST')['sum'] == 2000
+        assert sorted(sink.snapshot()) == [
+            ('duration', 'load', 'Resource', 'POST'),
+            ('duration', 'parse', 'Resource', 'POST'),
+            ('size', 'request', 'Resource', 'POST'),
+        ]
+        sink.clear()
+        assert sink.snapshot() == {}
+
+
+class TestPrometheusSink:
+    """Test rendering histograms for Prometheus"""
+
+    def test_render(self):
+        """Test the text exposition format"""
+        sink = metrics.PrometheusSink(
+            namespace='app', duration_buckets=[0.001, 0.5],
+            size_buckets=[1024],
+        )
+        sink.record_duration('parse', 0.25, 'Resource', 'POST')
+        sink.record_size('response', 10, 'Say "hi"', 'GET')
+        assert sink.render() == '\n'.join([
+            '# HELP app_stage_seconds Time spent in each stage of '
+            '(de)serialization',
+            '# TYPE app_stage_seconds histogram',
+            'app_stage_seconds_bucket{stage="parse",resource="Resource",'
+            'method="POST",le="0.001"} 0',
+            'app_stage_seconds_bucket{stage="parse",resource="Resource",'
+            'method="POST",le="0.5"} 1',
+            'app_stage_seconds_bucket{stage="parse",resource="Resource",'
+            'method="POST",le="+Inf"} 1',
+            'app_stage_seconds_sum{stage="parse",resource="Resource",'
+            'method="POST"} 0.25',
+            'app_stage_seconds_count{stage="parse",resource="Resource",'
+            'method="POST"} 1',
+            '# HELP app_body_bytes Size of request and response bodies',
+            '# TYPE app_body_bytes histogram',
+            'app_body_bytes_bucket{direction="response",'
+            'resource="Say \\"hi\\"",method="GET",le="1024"} 1',
+            'app_body_bytes_bucket{direction="response",'
+            'resource="Say \\"hi\\"",method="GET",le="+Inf"} 1',
+            'app_body_bytes_sum{direction="response",'
+            'resource="Say \\"hi\\"",method="GET"} 10',
+            'app_body_bytes_count{direction="response",'
+            'resource="Say \\"hi\\"",method="GET"} 1',
+        ]) + '\n'
+
+    def test_on_get(self):
+        """Test serving the metrics from a route"""
+        sink = metrics.PrometheusSink()
+        sink.record_size('request', 10, 'Resource', 'POST')
+        app = API()
+        app.add_route('/metrics', sink)
+        resp = testing.TestClient(app).simulate_get(
+            '/metrics'
+        )  # type: testing.Result
+        assert resp.status_code == 200
+        assert resp.headers['Content-Type'] == (
+            metrics.PROMETHEUS_CONTENT_TYPE
+        )
+        assert resp.text == sink.render()
+
+
+class TestStatsdSink:
+    """Test sending measurements to StatsD"""
+
+    @pytest.fixture()
+    def listener(self):
+        """A UDP socket to send measurements to"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        yield sock
+        sock.close()
+
+    def test_send(self, listener):
+        # type: (socket.socket) -> None
+        """Test the names and formats of measurements"""
+        sink = metrics.StatsdSink(port=listener.getsockname()[1])
+        try:
+            sink.record_duration('parse', 0.0125, 'Resource', 'POST')
+            sink.record_size('response', 512, 'My.Resource', 'GET')
+        finally:
+            sink.close()
+        assert listener.recv(1024) == (
+            b'falcon_marshmallow.stage.parse.Resource.POST:12.500|ms'
+        )
+        assert listener.recv(1024) == (
+            b'falcon_marshmallow.body.response.My_Resource.GET:512|h'
+        )
+
+    def test_send_error(self):
+        """Test that measurements which cannot be sent are dropped"""
+        sink = metrics.StatsdSink()
+        sink.close()
+        sink._socket = mock.Mock(
+            sendto=mock.Mock(side_effect=socket.error('Nope'))
+        )
+        sink.record_size('request', 1, 'Resource', 'POST')
+        sink._socket.sendto.assert_called_once_with(
+            b'falcon_marshmallow.body.request.Resource.POST:1|h',
+            ('127.0.0.1', 8125),
+        )
@@ -7,21 +7,45 @@ Tests for falcon_marshmallow.middleware
 from __future__ import (
     absolute_import, division, print_function, unicode_literals
 )
+import gc
+import io
+import weakref
+import zlib
 
 try:
     from unittest import mock
 except ImportError:
     import mock
 
-from typing import Optional
+from typing import Iterator, Optional
 
 # Third party
 import pytest
-from falcon import errors, Request, Response
+import simplejson as json
+from falcon import API, errors, Response
 from marshmallow import fields, Schema
 
 # Local
 from falcon_marshmallow import middleware as mid
+from falcon_marshmallow.cache import ResponseCache
+from falcon_marshmallow.compression import compress
+from falcon_marshmallow.media import Codec, CodecRegistry, JSONCodec
+from falcon_marshmallow.streaming import RecordError
+
+
+class ReversedCodec(Codec):
+    """A codec for JSON written backwards, to tell it apart from JSON"""
+
+    media_type = 'application/x-reversed'
+
+    def loads(self, data):
+        return json.loads(data[::-1])
+
+    def dumps(self, obj):
+        return json.dumps(obj)[::-1]
+
+
+CODECS = CodecRegistry([JSONCodec(), ReversedCodec()])
 
 
 class TestMarshmallow:
@@ -117,6 +141,168 @@ class TestMarshmallow:
         else:
             assert val == exp_value
 
+    def test_resolve_schema_cached(self):
+        """Test that schema lookups are cached per resource"""
+
+        class TestResource:
+            """Quick test object"""
+            schema = self.FooSchema()
+
+        tr = TestResource()
+        mw = mid.Marshmallow()
+        mw._get_schema = mock.Mock(return_value=tr.schema)
+
+        assert mw._resolve_schema(tr, 'GET', 'response') is tr.schema
+        assert mw._resolve_schema(tr, 'get', 'response') is tr.schema
+        assert mw._get_schema.call_count == 1
+
+        mw._resolve_schema(tr, 'GET', 'request')
+        assert mw._get_schema.call_count == 2
+
+    def test_resolve_schema_caches_none(self):
+        """Test that missing schemas are cached as well"""
+        mw = mid.Marshmallow()
+        mw._get_schema = mock.Mock(return_value=None)
+        tr = object()
+
+        assert mw._resolve_schema(tr, 'GET', 'response') is None
+        assert mw._resolve_schema(tr, 'GET', 'response') is None
+        assert mw._get_schema.call_count == 1
+
+    @pytest.mark.parametrize('tr', [{}, object()])
+    def test_resolve_schema_unweakable(self, tr):
+        # type: (object) -> None
+        """Test caching resources which cannot be weakly referenced"""
+        mw = mid.Marshmallow()
+        mw._get_schema = mock.Mock(return_value=None)
+
+        mw._resolve_schema(tr, 'GET', 'response')
+        mw._resolve_schema(tr, 'GET', 'response')
+        assert mw._get_schema.call_count == 1
+        assert not mw._schema_cache
+
+        mw.invalidate_schema_cache(tr)
+        mw._resolve_schema(tr, 'GET', 'response')
+        assert mw._get_schema.call_count == 2
+
+    def test_resolve_schema_weak(self):
+        """Test that cached lookups do not keep resources alive"""
+
+        class TestResource:
+            """Quick test object"""
+            schema = self.FooSchema()
+
+        mw = mid.Marshmallow()
+        tr = TestResource()
+        mw._resolve_schema(tr, 'GET', 'response')
+        assert len(mw._schema_cache) == 1
+
+        ref = weakref.ref(tr)
+        del tr
+        gc.collect()
+        assert ref() is None
+        assert not mw._schema_cache
+
+    def test_resolve_schema_bad_schema(self):
+        """Test that invalid schemas raise and are not cached"""
+        mw = mid.Marshmallow()
+        mw._get_schema = lambda *x, **y: self.FooSchema
+        tr = object()
+
+        for _ in range(2):
+            with pytest.raises(TypeError):
+                mw._resolve_schema(tr, 'GET', 'response')
+        assert not mw._get_cached_schemas(tr)
+
+    def test_prepare(self):
+        """Test resolving and warming up the schemas of an app's routes"""
+
+        class Nesting(Schema):
+            """A schema nesting another, and itself"""
+            foo = fields.Nested(self.FooSchema)
+            parent = fields.Nested('self', exclude=('parent',))
+
+        class TestResource:
+            """Quick test object"""
+            schema = Nesting()
+            post_request_schema = self.FooSchema()
+
+            def on_get(self, req, resp):
+                """Get"""
+
+            def on_post(self, req, resp):
+                """Post"""
+
+        tr = TestResource()
+        app = API()
+        app.add_route('/foo', tr)
+        mw = mid.Marshmallow(schema_pool_size=2)
+
+        report = mw.prepare(app)
+
+        assert sorted(report, key=lambda entry: entry['method']) == [
+            {
+                'route': '/foo', 'method': 'GET', 'resource': tr,
+                'request_schema': tr.schema, 'response_schema': tr.schema,
+            },
+            {
+                'route': '/foo', 'method': 'POST', 'resource': tr,
+                'request_schema': tr.post_request_schema,
+                'response_schema': tr.schema,
+            },
+        ]
+        assert len(mw._schema_cache[tr]) == 4
+        assert mw.schema_pool.stats()['idle'] == 2
+        assert tr.schema.fields['foo']._Nested__schema is not None
+
+        mw._get_schema = mock.Mock()
+        mw._resolve_schema(tr, 'POST', 'request')
+        mw._get_schema.assert_not_called()
+
+    def test_prepare_bad_schema(self):
+        """Test that invalid schemas are reported at startup"""
+
+        class TestResource:
+            """Quick test object"""
+            schema = self.FooSchema
+
+            def on_get(self, req, resp):
+                """Get"""
+
+        app = API()
+        app.add_route('/foo', TestResource())
+
+        with pytest.raises(TypeError) as exc_info:
+            mid.Marshmallow().prepare(app)
+        assert 'GET /foo' in str(exc_info.value)
+
+    @pytest.mark.parametrize('invalidate_all', [True, False])
+    def test_invalidate_schema_cache(self, invalidate_all):
+        # type: (bool) -> None
+        """Test invalidating cached schema lookups"""
+
+        class TestResource:
+            """Quick test object"""
+            schema = self.FooSchema()
+
+        tr, other = TestResource(), TestResource()
+        mw = mid.Marshmallow()
+        mw._resolve_schema(tr, 'GET', 'response')
+        mw._resolve_schema(other, 'GET', 'response')
+
+        new_schema = self.FooSchema()
+        tr.schema = new_schema
+        assert mw._resolve_schema(tr, 'GET', 'response') is not new_schema
+
+        if invalidate_all:
+            mw.invalidate_schema_cache()
+            assert not mw._schema_cache
+        else:
+            mw.invalidate_schema_cache(tr)
+            assert len(mw._schema_cache) == 1
+
+        assert mw._resolve_schema(tr, 'GET', 'response') is new_schema
+
     @pytest.mark.parametrize(
         'stream, schema, schema_err, bad_sch, force_json, json_err, '
         'exp_ret', [
@@ -245,6 +431,173 @@ class TestMarshmallow:
         else:
             assert mw._req_key not in req.context
 
+    @pytest.mark.parametrize('attr, method, exp', [
+        ('post_request_many', 'POST', True),
+        ('post_many', 'post', True),
+        ('many', 'POST', True),
+        ('get_many', 'POST', None),
+        ('post_response_many', 'POST', None),
+    ])
+    def test_get_many(self, attr, method, exp):
+        # type: (str, str, Optional[bool]) -> None
+        """Test getting whether a resource expects collections"""
+
+        class Resource:
+            """A resource flagged as expecting collections"""
+
+        setattr(Resource, attr, True)
+        assert mid.Marshmallow._get_many(Resource(), method) is exp
+
+    @pytest.mark.parametrize(
+        'body, flag, auto_many, partial, exp_ret, exp_errors', [
+            (  # Objects are loaded as usual
+                b'{"foo": "a"}', None, True, False, {'bar': 'a'}, None
+            ),
+            (  # Arrays are loaded as collections if asked
+                b'[{"foo": "a"}, {"foo": "b"}]', None, True, False,
+                [{'bar': 'a'}, {'bar': 'b'}], None
+            ),
+            (  # ...or if the resource asks
+                b'[{"foo": "a"}]', True, False, False, [{'bar': 'a'}], None
+            ),
+            (  # Resources may opt out
+                b'[{"foo": "a"}]', False, True, False, None,
+                {'_schema': ['Invalid input type.']}
+            ),
+            (  # Errors are indexed
+                b'[{"foo": "a"}, {"int": "b"}]', None, True, False, None,
+                {'1': {'int': ['Not a valid integer.']}}
+            ),
+            (  # Invalid items may be left out
+                b'[{"foo": "a"}, {"int": "b"}]', None, True, True,
+                [{'bar': 'a'}], {1: {'int': ['Not a valid integer.']}}
+            ),
+            (  # ...but there must be valid items
+                b'[{"int": "b"}]', None, True, True, None,
+                {'0': {'int': ['Not a valid integer.']}}
+            ),
+            (  # Objects are never partially loaded
+                b'{"int": "b"}', None, True, True, None,
+                {'int': ['Not a valid integer.']}
+            ),
+        ]
+    )
+    def test_process_resource_many(self, body, flag, auto_many, partial,
+                                   exp_ret, exp_errors):
+        # type: (bytes, bool, bool, bool, object, Optional[dict]) -> None
+        """Test loading collections from request bodies
+
+        :param body: the request body
+        :param flag: the value of the resource's ``many`` flag
+        :param auto_many: whether to load arrays as collections
+        :param partial: whether collections may be partially valid
+        :param exp_ret: the expected loaded data, if any
+        :param exp_errors: the expected errors, on the context if there
+            is loaded data, otherwise in the 422 raised
+        """
+        mw = mid.Marshmallow(auto_many=auto_many, partial_many=partial)
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+        resource = mock.Mock(spec=['many'], many=flag)
+
+        req = mock.Mock(method='POST')
+        req.bounded_stream.read.return_value = body
+        req.context = {}
+
+        if exp_ret is None:
+            with pytest.raises(errors.HTTPUnprocessableEntity) as exc:
+                # noinspection PyTypeChecker
+                mw.process_resource(req, 'foo', resource, 'foo')
+            assert json.loads(exc.value.description) == exp_errors
+        else:
+            # noinspection PyTypeChecker
+            mw.process_resource(req, 'foo', resource, 'foo')
+            assert req.context[mw._req_key] == exp_ret
+            assert req.context.get('errors') == exp_errors
+
+    @pytest.mark.parametrize('attrs, exp_errors', [
+        ({}, {'foo': ['Not a valid string.'], '_truncated': True}),
+        ({'max_errors': 2}, {
+            'foo': ['Not a valid string.'], 'int': ['Not a valid integer.'],
+        }),
+        ({'post_max_errors': 3, 'max_errors': 1}, None),
+        ({'put_max_errors': 3}, {
+            'foo': ['Not a valid string.'], '_truncated': True,
+        }),
+    ])
+    def test_process_resource_max_errors(self, attrs, exp_errors):
+        # type: (dict, Optional[dict]) -> None
+        """Test reporting only the first errors of a request body"""
+        mw = mid.Marshmallow(max_errors=1)
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+        resource = type(str('Resource'), (object,), attrs)()
+
+        req = mock.Mock(method='POST')
+        req.bounded_stream.read.return_value = b'{"foo": 1, "int": "foo"}'
+        req.context = {}
+
+        with pytest.raises(errors.HTTPUnprocessableEntity) as exc:
+            # noinspection PyTypeChecker
+            mw.process_resource(req, 'foo', resource, 'foo')
+        if exp_errors is not None:
+            assert json.loads(exc.value.description) == exp_errors
+        else:
+            assert '_truncated' not in json.loads(exc.value.description)
+
+    @pytest.mark.parametrize('body, exp_ret, raises', [
+        (b'{"foo": "test", "int": 1}', {'bar': 'test', 'int': 1}, False),
+        (b'{"foo": "test", "int": "1"}', {'bar': 'test', 'int': 1}, False),
+        (b'{"foo": "test", "int": "foo"}', None, True),
+    ])
+    def test_process_resource_compiled(self, body, exp_ret, raises):
+        # type: (bytes, Optional[dict], bool) -> None
+        """Test loading requests with compiled schemas"""
+        mw = mid.Marshmallow(compile_schemas=True)
+        sch = self.FooSchema()
+        mw._get_schema = lambda *x, **y: sch
+
+        req = mock.Mock(method='POST')
+        req.bounded_stream.read.return_value = body
+        req.context = {}
+
+        with mock.patch.object(
+            mid, 'get_compiled_loader', wraps=mid.get_compiled_loader
+        ) as get_loader:
+            if raises:
+                with pytest.raises(errors.HTTPUnprocessableEntity) as exc:
+                    # noinspection PyTypeChecker
+                    mw.process_resource(req, 'foo', 'foo', 'foo')
+                assert json.loads(exc.value.description) == (
+                    sch.load(json.loads(body)).errors
+                )
+            else:
+                # noinspection PyTypeChecker
+                mw.process_resource(req, 'foo', 'foo', 'foo')
+                assert req.context[mw._req_key] == exp_ret
+            get_loader.assert_called_with(sch)
+
+    @pytest.mark.parametrize('stashed', [True, False])
+    def test_process_resource_stream_json(self, stashed):
+        # type: (bool) -> None
+        """Test parsing the request body incrementally"""
+        mw = mid.Marshmallow(stream_json=True, stream_chunk_size=4)
+        mw._get_schema = lambda *x, **y: None
+
+        body = b'[{"foo": "test"}, {"foo": "t\xc3\xa9st"}]'
+        req = mock.Mock(method='POST', content_length=len(body))
+        req.bounded_stream = io.BytesIO(body)
+        req.context = {}
+        if stashed:
+            req.context[mid.CONTENT_KEY] = body
+            req.bounded_stream = io.BytesIO(b'')
+
+        # noinspection PyTypeChecker
+        mw.process_resource(req, 'foo', 'foo', 'foo')
+        assert req.context[mw._req_key] == [
+            {'foo': 'test'}, {'foo': 'tést'}
+        ]
+        if not stashed:
+            assert mid.CONTENT_KEY not in req.context
+
     @pytest.mark.parametrize(
         'res, schema, sch_err, bad_sch, force_json, json_err, exp_ret', [
             (  # Good result, good schema
@@ -367,18 +720,541 @@ class TestMarshmallow:
         else:
             assert resp.body == exp_ret
 
+    @pytest.mark.parametrize('schema', [True, False])
+    def test_process_response_iterator(self, schema):
+        # type: (bool) -> None
+        """Test that iterator results are streamed as JSON arrays"""
+        mw = mid.Marshmallow(stream_batch_size=2)
+        if schema:
+            mw._get_schema = lambda *x, **y: self.FooSchema()
+            exp = [{'foo': str(i)} for i in range(5)]
+        else:
+            mw._get_schema = lambda *x, **y: None
+            exp = [{'bar': str(i)} for i in range(5)]
+
+        req = mock.Mock(method='GET')
+        req.context = {
+            mw._resp_key: ({'bar': str(i)} for i in range(5))
+        }
+        resp = mock.Mock()
+
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        assert isinstance(resp.body, mock.Mock)
+        body = b''.join(resp.stream).decode('utf-8')
+        assert json.loads(body) == exp
+
+    def test_process_response_iterator_error(self):
+        """Test that errors in the first batch raise an HTTP error"""
+        mw = mid.Marshmallow()
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: iter([{'int': 'foo'}])}
+
+        with pytest.raises(errors.HTTPInternalServerError):
+            # noinspection PyTypeChecker
+            mw.process_response(req, mock.Mock(), 'foo', 'foo')
+
+    @pytest.mark.parametrize('schema', [True, False])
+    def test_process_response_binary_backend(self, schema):
+        # type: (bool) -> None
+        """Test that bytes from the backend are written to resp.data"""
+        pytest.importorskip('orjson')
+        mw = mid.Marshmallow(json_backend='orjson')
+        if schema:
+            mw._get_schema = lambda *x, **y: self.FooSchema()
+            exp = {'foo': 'tést'}
+        else:
+            mw._get_schema = lambda *x, **y: None
+            exp = {'bar': 'tést'}
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: {'bar': 'tést'}}
+        resp = mock.Mock()
+
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        assert isinstance(resp.body, mock.Mock)
+        assert isinstance(resp.data, bytes)
+        assert json.loads(resp.data.decode('utf-8')) == exp
+
+    def test_process_response_schema_json_module(self):
+        """Test that a schema's own json module takes precedence"""
+        dumps = mock.Mock(return_value='{"foo": "custom"}')
+
+        class CustomSchema(self.FooSchema):
+            """Schema with a custom json module"""
+            class Meta:
+                json_module = mock.Mock(dumps=dumps)
+
+        mw = mid.Marshmallow(json_backend='json')
+        mw._get_schema = lambda *x, **y: CustomSchema()
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: {'bar': 'test'}}
+        resp = mock.Mock()
+
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        assert resp.body == '{"foo": "custom"}'
+        dumps.assert_called_once_with({'foo': 'test'})
+
+    @pytest.mark.parametrize('res, exp_body, raises', [
+        ({'bar': 'test', 'int': '1'}, {'foo': 'test', 'int': 1}, False),
+        ({'bar': 'test', 'int': 'foo'}, None, True),
+    ])
+    def test_process_response_compiled(self, res, exp_body, raises):
+        # type: (dict, Optional[dict], bool) -> None
+        """Test serializing responses with compiled schemas"""
+        mw = mid.Marshmallow(compile_schemas=True)
+        sch = self.FooSchema()
+        mw._get_schema = lambda *x, **y: sch
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: res}
+        resp = mock.Mock()
+
+        with mock.patch.object(
+            mid, 'get_compiled_serializer',
+            wraps=mid.get_compiled_serializer
+        ) as get_serializer:
+            if raises:
+                with pytest.raises(errors.HTTPInternalServerError):
+                    # noinspection PyTypeChecker
+                    mw.process_response(req, resp, 'foo', 'foo')
+            else:
+                # noinspection PyTypeChecker
+                mw.process_response(req, resp, 'foo', 'foo')
+                assert json.loads(resp.body) == exp_body
+            get_serializer.assert_called_with(sch)
+
+    @pytest.mark.parametrize('method, status, if_none_match, exp_status', [
+        ('GET', '200 OK', None, None),
+        ('GET', '200 OK', 'match', '304 Not Modified'),
+        ('HEAD', '200 OK', '*', '304 Not Modified'),
+        ('GET', '200 OK', '"other"', None),
+        ('POST', '200 OK', 'match', None),
+        ('GET', '201 Created', 'match', None),
+    ])
+    def test_process_response_etags(self, method, status, if_none_match,
+                                    exp_status):
+        # type: (str, str, Optional[str], Optional[str]) -> None
+        """Test setting ETags and responding to conditional requests"""
+        mw = mid.Marshmallow(etags=True)
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+        body = '{"foo": "test"}'
+        etag = mid.make_etag(body)
+        if if_none_match == 'match':
+            if_none_match = etag
+
+        req = mock.Mock(method=method)
+        req.context = {mw._resp_key: {'bar': 'test'}}
+        req.get_header.return_value = if_none_match
+        resp = Response()
+        resp.status = status
+
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        if method == 'POST' or status != '200 OK':
+            assert resp.get_header('ETag') is None
+        else:
+            assert resp.get_header('ETag') == etag
+        if exp_status is None:
+            assert resp.status == status
+            assert resp.body == body
+        else:
+            assert resp.status == exp_status
+            assert resp.body is None
+
+    @pytest.mark.parametrize('resp_etag, version, matches', [
+        ('"known"', None, True),
+        ('"known"', None, False),
+        (None, 3, True),
+        (None, 3, False),
+    ])
+    def test_process_response_known_etag(self, resp_etag, version, matches):
+        # type: (Optional[str], Optional[int], bool) -> None
+        """Test that unmodified results are not serialized"""
+        mw = mid.Marshmallow(etags=True)
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+        etag = resp_etag or mid.make_etag('3')
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: {'bar': 'test'}}
+        if version is not None:
+            req.context['version'] = version
+        req.get_header.return_value = etag if matches else '"other"'
+        resp = Response()
+        if resp_etag is not None:
+            resp.set_header('ETag', resp_etag)
+
+        with mock.patch.object(
+            mw, '_dump_schema', wraps=mw._dump_schema
+        ) as dump:
+            # noinspection PyTypeChecker
+            mw.process_response(req, resp, 'foo', 'foo')
+
+        assert resp.get_header('ETag') == etag
+        if matches:
+            assert resp.status == '304 Not Modified'
+            dump.assert_not_called()
+        else:
+            assert resp.status == '200 OK'
+            assert json.loads(resp.body) == {'foo': 'test'}
+
+    @pytest.mark.parametrize('context, schema, exp_key', [
+        ({}, True, None),
+        ({'cache_key': 'first'}, True, 'first'),
+        ({'cache_key': 'first'}, False, 'first'),
+        ({'version': 3}, True, (
+            '/foo?bar=1', 3, None,
+            (('authorization', None), ('cookie', None)),
+        )),
+    ])
+    def test_process_response_cached(self, context, schema, exp_key):
+        # type: (dict, bool, object) -> None
+        """Test serving serialized results from the response cache"""
+        resp_cache = ResponseCache()
+        mw = mid.Marshmallow(response_cache=resp_cache)
+        sch = self.FooSchema() if schema else None
+        mw._get_schema = lambda *x, **y: sch
+        exp_body = {'foo': 'test'} if schema else {'bar': 'test'}
+
+        for _ in range(2):
+            req = mock.Mock(method='GET', relative_uri='/foo?bar=1')
+            req.context = dict(context, result={'bar': 'test'})
+            req.get_header.return_value = None
+            resp = mock.Mock()
+            resp.get_header.return_value = None
+            dump_name = '_dump_schema' if schema else '_dump_json'
+            with mock.patch.object(
+                mw, dump_name, wraps=getattr(mw, dump_name)
+            ) as dump:
+                # noinspection PyTypeChecker
+                mw.process_response(req, resp, 'foo', 'foo')
+            assert json.loads(resp.body) == exp_body
+
+        if exp_key is None:
+            assert resp_cache.stats()['size'] == 0
+            assert dump.call_count == 1
+        else:
+            assert resp_cache.get(sch, exp_key) == resp.body
+            assert resp_cache.stats()['hits'] == 2
+            dump.assert_not_called()
+
+    @pytest.mark.parametrize('headers, vary, fieldset, same', [
+        ({}, None, None, True),
+        ({'Authorization': 'Basic other'}, None, None, False),
+        ({'Cookie': 'session=other'}, None, None, False),
+        ({'Accept': 'application/x-reversed'}, None, None, True),
+        ({'Accept': 'application/x-reversed'}, 'Accept', None, False),
+        ({'Accept': 'application/json'}, 'Accept', None, True),
+        ({}, None, (frozenset(['foo']), None), False),
+    ])
+    def test_cache_key(self, headers, vary, fieldset, same):
+        # type: (dict, Optional[str], Optional[tuple], bool) -> None
+        """Test that implicit cache keys tell apart differing results"""
+        mw = mid.Marshmallow(response_cache=ResponseCache())
+
+        def key(headers, vary=None, fieldset=None):
+            # type: (dict, Optional[str], Optional[tuple]) -> object
+            base = {'Authorization': 'Basic me', 'Accept': 'application/json'}
+            headers = dict(base, **headers)
+            req = mock.Mock(relative_uri='/foo', context={'version': 1})
+            req.get_header.side_effect = lambda name: next(
+                (value for header, value in headers.items()
+                 if header.lower() == name.lower()), None
+            )
+            resp = mock.Mock()
+            resp.get_header.return_value = vary
+            return mw._get_cache_key(req, resp, fieldset)
+
+        assert (key(headers, vary, fieldset) == key({}, vary)) is same
+
+    def test_cache_key_vary_all(self):
+        """Test that responses varying on everything are not cached"""
+        mw = mid.Marshmallow(response_cache=ResponseCache())
+        req = mock.Mock(relative_uri='/foo', context={'version': 1})
+        resp = mock.Mock()
+        resp.get_header.return_value = 'Accept, *'
+        assert mw._get_cache_key(req, resp) is None
+
+    @pytest.mark.parametrize('content_type, body', [
+        ('application/json', b'{"foo": "test"}'),
+        ('application/x-reversed', b'}"tset" :"oof"{'),
+        (None, b'{"foo": "test"}'),
+    ])
+    def test_process_resource_codecs(self, content_type, body):
+        # type: (Optional[str], bytes) -> None
+        """Test decoding request bodies with the codec registry"""
+        mw = mid.Marshmallow(codecs=CODECS)
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+
+        req = mock.Mock(method='POST', content_type=content_type)
+        req.bounded_stream.read.return_value = body
+        req.context = {}
+
+        # noinspection PyTypeChecker
+        mw.process_resource(req, mock.Mock(), 'foo', 'foo')
+        assert req.context[mw._req_key] == {'bar': 'test'}
+
+    @pytest.mark.parametrize('content_type, exp', [
+        ('application/json', 'JSON'),
+        ('application/x-reversed', 'application/x-reversed'),
+    ])
+    def test_process_resource_codecs_invalid(self, content_type, exp):
+        # type: (str, str) -> None
+        """Test that invalid bodies are rejected for their codec"""
+        mw = mid.Marshmallow(codecs=CODECS)
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+
+        req = mock.Mock(method='POST', content_type=content_type)
+        req.bounded_stream.read.return_value = b'{"foo": '
+        req.context = {}
+
+        with pytest.raises(errors.HTTPBadRequest) as exc_info:
+            # noinspection PyTypeChecker
+            mw.process_resource(req, mock.Mock(), 'foo', 'foo')
+        assert exc_info.value.title == 'Request must be valid %s' % exp
+
+    @pytest.mark.parametrize('accept, schema, exp_body', [
+        (None, True, '{"foo": "test"}'),
+        ('application/json', False, '{"bar": "test"}'),
+        ('application/x-reversed', True, '}"tset" :"oof"{'),
+        ('application/x-reversed', False, '}"tset" :"rab"{'),
+    ])
+    def test_process_response_codecs(self, accept, schema, exp_body):
+        # type: (Optional[str], bool, str) -> None
+        """Test encoding responses with the negotiated codec"""
+        mw = mid.Marshmallow(codecs=CODECS)
+        mw._get_schema = lambda *x, **y: self.FooSchema() if schema else None
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: {'bar': 'test'}}
+        req.get_header.return_value = accept
+        resp = Response()
+
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        assert resp.body == exp_body
+        assert resp.get_header('Vary') == 'Accept'
+        if accept == 'application/x-reversed':
+            assert resp.content_type == accept
+        else:
+            # Left to Falcon's default media type
+            assert resp.content_type is None
+
+    def test_process_response_codecs_unserialized(self):
+        """Test that bodies set by responders are not relabelled"""
+        mw = mid.Marshmallow(codecs=CODECS, force_json=False)
+        mw._get_schema = lambda *x, **y: None
+
+        req = mock.Mock(method='GET')
+        req.context = {mw._resp_key: {'bar': 'test'}}
+        req.get_header.return_value = 'application/x-reversed'
+        resp = Response()
+        resp.content_type = 'text/plain'
+        resp.body = 'bar: test'
+
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        assert resp.body == 'bar: test'
+        assert resp.content_type == 'text/plain'
+        assert resp.get_header('Vary') is None
+
+    @pytest.mark.parametrize('schema, stashed', [
+        (True, False),
+        (True, True),
+        (False, False),
+    ])
+    def test_process_resource_ndjson(self, schema, stashed):
+        # type: (bool, bool) -> None
+        """Test loading NDJSON bodies lazily"""
+        mw = mid.Marshmallow(ndjson=True)
+        mw._get_schema = lambda *x, **y: self.FooSchema() if schema else None
+        body = b'{"foo": "a"}\n{"int": "x"}\n'
+
+        req = mock.Mock(method='POST', content_type='application/x-ndjson')
+        req.bounded_stream = io.BytesIO(body)
+        req.context = {}
+        if stashed:
+            mid.get_stashed_content(req)
+
+        # noinspection PyTypeChecker
+        mw.process_resource(req, mock.Mock(), 'foo', 'foo')
+
+        records = req.context[mw._req_key]
+        assert isinstance(records, Iterator)
+        if schema:
+            assert list(records) == [
+                {'bar': 'a'},
+                RecordError(2, {'int': ['Not a valid integer.']}),
+            ]
+        else:
+            assert list(records) == [{'foo': 'a'}, {'int': 'x'}]
+
+    @pytest.mark.parametrize('fields_param, exclude_param, exp_body', [
+        (None, None, {'foo': 'test', 'int': 1}),
+        (['int'], None, {'int': 1}),
+        (['foo', ' int '], None, {'foo': 'test', 'int': 1}),
+        (None, ['bar'], {'int': 1}),
+        (['foo'], ['foo'], {}),
+        (['unknown'], None, None),
+    ])
+    def test_process_response_fields(self, fields_param, exclude_param,
+                                     exp_body):
+        # type: (Optional[list], Optional[list], Optional[dict]) -> None
+        """Test dumping the fields selected by the request"""
+        mw = mid.Marshmallow(fields_param='fields', exclude_param='exclude')
+        sch = self.FooSchema()
+        mw._get_schema = lambda *x, **y: sch
+
+        for _ in range(2):
+            req = mock.Mock(method='GET')
+            req.context = {mw._resp_key: {'bar': 'test', 'int': 1}}
+            req.get_param_as_list.side_effect = {
+                'fields': fields_param, 'exclude': exclude_param
+            }.get
+            resp = mock.Mock()
+
+            if exp_body is None:
+                with pytest.raises(errors.HTTPBadRequest):
+                    # noinspection PyTypeChecker
+                    mw.process_response(req, resp, 'foo', 'foo')
+                continue
+            # noinspection PyTypeChecker
+            mw.process_response(req, resp, 'foo', 'foo')
+            assert json.loads(resp.body) == exp_body
+
+        if exp_body is None or fields_param == exclude_param is None:
+            assert mw.fieldset_cache.stats()['size'] == 0
+        else:
+            assert mw.fieldset_cache.stats()['hits'] == 1
+            assert mw.fieldset_cache.stats()['size'] == 1
+
+    def test_process_response_fields_etag(self):
+        """Test that fieldsets get their own version-based ETags"""
+        mw = mid.Marshmallow(etags=True, fields_param='fields')
+        mw._get_schema = lambda *x, **y: self.FooSchema()
+
+        etags = set()
+        for fields_param in (None, ['int'], ['foo'], ['int', 'foo']):
+            req = mock.Mock(method='GET')
+            req.context = {mw._resp_key: {'bar': 'test'}, 'version': 1}
+            req.get_header.return_value = None
+            req.get_param_as_list.return_value = fields_param
+            resp = Response()
+            # noinspection PyTypeChecker
+            mw.process_response(req, resp, 'foo', 'foo')
+            etags.add(resp.get_header('ETag'))
+        assert len(etags) == 4
+
+    def test_no_fieldset_cache(self):
+        """Test that fields are only selected if a parameter is set"""
+        mw = mid.Marshmallow()
+        assert mw.fieldset_cache is None
+        req = mock.Mock()
+        assert mw._get_fieldset(req) is None
+        req.get_param_as_list.assert_not_called()
+
+    def test_schema_pool(self):
+        """Test (de)serializing with pooled clones of schemas"""
+        mw = mid.Marshmallow(schema_pool_size=1)
+        sch = self.FooSchema()
+        mw._get_schema = lambda *x, **y: sch
+
+        req = mock.Mock(method='POST')
+        req.bounded_stream.read.return_value = b'{"foo": "test"}'
+        req.context = {}
+        resp = mock.Mock()
+
+        with mock.patch.object(
+            mw.schema_pool, 'borrow', wraps=mw.schema_pool.borrow
+        ) as borrow:
+            # noinspection PyTypeChecker
+            mw.process_resource(req, resp, 'foo', 'foo')
+            assert req.context[mw._req_key] == {'bar': 'test'}
+            req.context[mw._resp_key] = {'bar': 'test'}
+            # noinspection PyTypeChecker
+            mw.process_response(req, resp, 'foo', 'foo')
+            assert json.loads(resp.body) == {'foo': 'test'}
+            assert borrow.call_args_list == [mock.call(sch)] * 2
+
+        assert mw.schema_pool.stats() == {
+            'created': 1, 'reused': 1, 'discarded': 0, 'in_use': 0,
+            'idle': 1,
+        }
+
+    @pytest.mark.parametrize('many, should_run, in_pool', [
+        (True, True, True),
+        (True, False, False),
+        (False, True, False),
+    ])
+    def test_process_pool(self, many, should_run, in_pool):
+        # type: (bool, bool, bool) -> None
+        """Test (de)serializing large collections in a process pool"""
+        pool = mock.Mock()
+        pool.should_run.return_value = should_run
+        pool.load.return_value = ([{'bar': 'pool'}], {})
+        pool.dump.return_value = ([{'foo': 'pool'}], {})
+        mw = mid.Marshmallow(process_pool=pool, schema_pool_size=1)
+        sch = self.FooSchema(many=many)
+        mw._get_schema = lambda *x, **y: sch
+
+        body = b'[{"foo": "test"}]' if many else b'{"foo": "test"}'
+        req = mock.Mock(method='POST')
+        req.bounded_stream.read.return_value = body
+        req.context = {}
+        resp = mock.Mock()
+
+        # noinspection PyTypeChecker
+        mw.process_resource(req, resp, 'foo', 'foo')
+        req.context[mw._resp_key] = req.context[mw._req_key]
+        # noinspection PyTypeChecker
+        mw.process_response(req, resp, 'foo', 'foo')
+
+        if in_pool:
+            pool.load.assert_called_once_with(sch, [{'foo': 'test'}])
+            pool.dump.assert_called_once_with(sch, [{'bar': 'pool'}])
+            assert json.loads(resp.body) == [{'foo': 'pool'}]
+        else:
+            pool.load.assert_not_called()
+            pool.dump.assert_not_called()
+            exp = {'foo': 'test'}
+            assert json.loads(resp.body) == ([exp] if many else exp)
+
+    def test_no_schema_pool(self):
+        """Test that schemas are used directly by default"""
+        assert mid.Marshmallow().schema_pool is None
+
 
 class TestJSONEnforcer:
     """Test enforcement of JSON requests"""
 
     enforcer = mid.JSONEnforcer()
 
-    @pytest.mark.parametrize('accepts', [True, False])
-    def test_client_accept(self, accepts):
-        # type: (bool) -> None
+    @pytest.mark.parametrize('accept, accepts', [
+        ('*/*', True),
+        ('application/json', True),
+        ('application/json; charset=utf-8', True),
+        ('text/html, application/*;q=0.5', True),
+        ('application/vnd.api+json', True),
+        ('text/html', False),
+        ('application/json;q=0', False),
+        ('application/vnd.api+json;q=0, text/html', False),
+        ('not a media type', False),
+    ])
+    def test_client_accept(self, accept, accepts):
+        # type: (str, bool) -> None
         """Test asserting that the client accepts JSON"""
-        req = mock.Mock()
-        req.client_accepts_json = accepts
+        req = mock.Mock(accept=accept)
         req.method = 'GET'
 
         if not accepts:
@@ -396,6 +1272,12 @@ class TestJSONEnforcer:
         ('POST', None, True),
         ('POST', 'application/json', False),
         ('POST', 'mimetype/xml', True),
+        ('POST', 'application/x-ndjson', True),
+        ('POST', 'application/json; charset=utf-8', False),
+        ('POST', 'APPLICATION/JSON', False),
+        ('POST', 'application/problem+json', False),
+        ('POST', 'application/jsonx', True),
+        ('POST', 'text/plain; note=application/json', True),
         ('PATCH', None, True),
         ('PATCH', 'application/json', False),
         ('PATCH', 'mimetype/xml', True),
@@ -409,7 +1291,7 @@ class TestJSONEnforcer:
     def test_method_content_type(self, method, content_type, raises):
         # type: (str, Optional[str], bool) -> None
         """Test checking of content-type for certain methods"""
-        req = mock.Mock(client_accepts_json=True)
+        req = mock.Mock(accept='*/*')
         req.method = method
         req.content_type = content_type
 
@@ -421,6 +1303,203 @@ class TestJSONEnforcer:
             # noinspection PyTypeChecker
             self.enforcer.process_request(req, 'foo')
 
+    @pytest.mark.parametrize('method, raises', [
+        ('POST', False),
+        ('DELETE', True),
+    ])
+    def test_required_methods(self, method, raises):
+        # type: (str, bool) -> None
+        """Test that the configured required methods are enforced"""
+        enforcer = mid.JSONEnforcer(required_methods=('DELETE',))
+        req = mock.Mock(accept='*/*', method=method, content_type=None)
+
+        if raises:
+            with pytest.raises(errors.HTTPUnsupportedMediaType):
+                # noinspection PyTypeChecker
+                enforcer.process_request(req, 'foo')
+        else:
+            # noinspection PyTypeChecker
+            enforcer.process_request(req, 'foo')
+
+    @pytest.mark.parametrize('codecs', [None, CODECS])
+    @pytest.mark.parametrize('ndjson', [False, True])
+    def test_ndjson(self, codecs, ndjson):
+        # type: (Optional[CodecRegistry], bool) -> None
+        """Test that NDJSON is only accepted when it can be loaded"""
+        enforcer = mid.JSONEnforcer(codecs=codecs, ndjson=ndjson)
+        req = mock.Mock(
+            accept='*/*', method='POST', content_type='application/x-ndjson'
+        )
+        req.get_header.return_value = '*/*'
+
+        if not ndjson:
+            with pytest.raises(errors.HTTPUnsupportedMediaType):
+                # noinspection PyTypeChecker
+                enforcer.process_request(req, 'foo')
+        else:
+            # noinspection PyTypeChecker
+            enforcer.process_request(req, 'foo')
+
+    def test_cached(self):
+        """Test that each header value is only checked once"""
+        with mock.patch.object(
+            mid, 'accepts_json', wraps=mid.accepts_json
+        ) as accepts_json:
+            enforcer = mid.JSONEnforcer()
+            for accept in ('text/html, */*', 'text/html, */*', '*/*'):
+                req = mock.Mock(accept=accept, method='POST')
+                req.content_type = 'application/json'
+                # noinspection PyTypeChecker
+                enforcer.process_request(req, 'foo')
+        assert accepts_json.call_count == 2
+        assert len(enforcer._is_json) == 1
+
+
+class TestJSONEnforcerCodecs:
+    """Test enforcement of the media types of a codec registry"""
+
+    enforcer = mid.JSONEnforcer(codecs=CODECS)
+
+    @pytest.mark.parametrize('method, accept, content_type, raises', [
+        ('GET', None, None, None),
+        ('GET', 'application/x-reversed', None, None),
+        ('GET', 'text/html', None, errors.HTTPNotAcceptable),
+        ('POST', '*/*', 'application/json', None),
+        ('POST', '*/*', 'application/x-reversed', None),
+        ('POST', '*/*', 'mimetype/xml', errors.HTTPUnsupportedMediaType),
+        ('POST', '*/*', None, errors.HTTPUnsupportedMediaType),
+    ])
+    def test_process_request(self, method, accept, content_type, raises):
+        # type: (str, Optional[str], Optional[str], Optional[type]) -> None
+        """Test checking Accept and Content-Type headers"""
+        req = mock.Mock(method=method, content_type=content_type)
+        req.get_header.return_value = accept
+
+        if raises:
+            with pytest.raises(raises):
+                # noinspection PyTypeChecker
+                self.enforcer.process_request(req, 'foo')
+        else:
+            # noinspection PyTypeChecker
+            self.enforcer.process_request(req, 'foo')
+
+    def test_media_types(self):
+        """Test that the media types listed in errors are kept current"""
+        codecs = CodecRegistry([JSONCodec()])
+        enforcer = mid.JSONEnforcer(codecs=codecs)
+        req = mock.Mock(method='POST', content_type='mimetype/xml')
+        req.get_header.return_value = '*/*'
+
+        media_types = []
+        for _ in range(2):
+            with pytest.raises(errors.HTTPUnsupportedMediaType) as exc_info:
+                # noinspection PyTypeChecker
+                enforcer.process_request(req, 'foo')
+            assert 'x-reversed' not in exc_info.value.description
+            media_types.append(enforcer._media_types)
+        # The string is only built once
+        assert media_types[0] is media_types[1]
+
+        codecs.register(ReversedCodec())
+        with pytest.raises(errors.HTTPUnsupportedMediaType) as exc_info:
+            # noinspection PyTypeChecker
+            enforcer.process_request(req, 'foo')
+        assert '"application/x-reversed"' in exc_info.value.description
+
+
+class TestCompressor:
+    """Tests for compressing responses and decompressing requests"""
+
+    compressor = mid.Compressor(min_size=10)
+
+    @staticmethod
+    def _request(headers):
+        # type: (dict) -> mock.Mock
+        """Return a mock request with the given headers"""
+        req = mock.Mock(content_length=10, context={})
+        req.get_header.side_effect = headers.get
+        return req
+
+    @pytest.mark.parametrize('encoding', [None, 'identity', 'gzip'])
+    def test_process_request(self, encoding):
+        # type: (Optional[str]) -> None
+        """Test that encoded bodies are decompressed and stashed"""
+        body = b'{"foo": "bar"}'
+        req = self._request({'Content-Encoding': encoding})
+        if encoding == 'gzip':
+            req.bounded_stream = io.BytesIO(compress(body, 'gzip'))
+
+        # noinspection PyTypeChecker
+        self.compressor.process_request(req, 'foo')
+
+        if encoding == 'gzip':
+            assert req.context[mid.CONTENT_KEY] == body
+            assert req.stream.read() == body
+        else:
+            assert mid.CONTENT_KEY not in req.context
+
+    @pytest.mark.parametrize('accept, body, compressed', [
+        ('gzip', '{"foo": "tést"}', True),
+        ('gzip', b'{"foo": "test"}', True),
+        ('gzip', '{}', False),
+        (None, '{"foo": "test"}', False),
+    ])
+    def test_process_response(self, accept, body, compressed):
+        # type: (Optional[str], object, bool) -> None
+        """Test that large enough bodies are compressed"""
+        req = self._request({'Accept-Encoding': accept})
+        resp = Response()
+        resp.etag = '"tag"'
+        if isinstance(body, bytes):
+            resp.data = body
+        else:
+            resp.body = body
+
+        # noinspection PyTypeChecker
+        self.compressor.process_response(req, resp, 'foo', True)
+
+        assert resp.get_header('Vary') == 'Accept-Encoding'
+        if compressed:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            assert resp.body is None
+            assert zlib.decompress(resp.data, 16 + zlib.MAX_WBITS) == body
+            assert resp.get_header('Content-Encoding') == 'gzip'
+            assert resp.get_header('ETag') == 'W/"tag"'
+        else:
+            assert resp.body == body
+            assert resp.get_header('Content-Encoding') is None
+            assert resp.get_header('ETag') == '"tag"'
+
+    @pytest.mark.parametrize('stream', [
+        lambda: iter([b'{"foo": ', b'"test"}']),
+        lambda: io.BytesIO(b'{"foo": "test"}'),
+    ])
+    def test_process_response_stream(self, stream):
+        """Test that streamed bodies are compressed incrementally"""
+        req = self._request({'Accept-Encoding': 'deflate'})
+        resp = Response()
+        resp.stream = stream()
+
+        # noinspection PyTypeChecker
+        self.compressor.process_response(req, resp, 'foo', True)
+
+        assert resp.get_header('Content-Encoding') == 'deflate'
+        assert zlib.decompress(b''.join(resp.stream)) == b'{"foo": "test"}'
+
+    def test_process_response_encoded(self):
+        """Test that bodies are not encoded twice"""
+        req = self._request({'Accept-Encoding': 'gzip'})
+        resp = Response()
+        resp.data = b'already compressed'
+        resp.set_header('Content-Encoding', 'br')
+
+        # noinspection PyTypeChecker
+        self.compressor.process_response(req, resp, 'foo', True)
+
+        assert resp.data == b'already compressed'
+        assert resp.get_header('Vary') is None
+
 
 class TestEmptyRequestDropper:
     """Tests for the empty request dropper"""
@@ -431,7 +1510,7 @@ class TestEmptyRequestDropper:
     def test_ignore_when_no_content_length(self, content_length):
         # type: (Optional[int]) -> None
         """Test that we drop out with no content_length"""
-        req = mock.Mock(content_length=content_length, )
+        req = mock.Mock(content_length=content_length, context={})
 
         # noinspection PyTypeChecker
         self.dropper.process_request(req, 'foo')
@@ -453,3 +1532,27 @@ class TestEmptyRequestDropper:
         else:
             # noinspection PyTypeChecker
             self.dropper.process_request(req, 'foo')
+
+    def test_resource_limits(self):
+        """Test deferring the check until the resource is known"""
+        dropper = mid.EmptyRequestDropper(
+            max_body_size=5, resource_limits=True
+        )
+        req = mock.Mock(content_length=10, context={}, method='POST')
+        req.bounded_stream.read.return_value = b'0123456789'
+
+        # noinspection PyTypeChecker
+        dropper.process_request(req, 'foo')
+        req.bounded_stream.read.assert_not_called()
+
+        with pytest.raises(errors.HTTPPayloadTooLarge):
+            # noinspection PyTypeChecker
+            dropper.process_resource(req, 'foo', 'foo', {})
+        req.bounded_stream.read.assert_not_called()
+
+        class Upload:
+            post_max_body = 100
+
+        # noinspection PyTypeChecker
+        dropper.process_resource(req, 'foo', Upload(), {})
+        assert req.context[mid.CONTENT_KEY] == b'0123456789'
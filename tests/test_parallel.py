@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.parallel
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# Third party
+import pytest
+from marshmallow import fields, post_dump, Schema
+
+# Local
+from falcon_marshmallow import parallel
+
+
+class Item(Schema):
+    """A schema to use in worker processes"""
+    id = fields.Integer(required=True)
+    name = fields.String(dump_to='title', load_from='title')
+
+
+class Envelope(Schema):
+    """A schema processing whole collections"""
+    id = fields.Integer()
+
+    @post_dump(pass_many=True)
+    def wrap(self, data, many):
+        """Wrap the data in an envelope"""
+        return {'items': data}
+
+
+@pytest.fixture()
+def pool():
+    """Return a small pool, shutting it down afterwards"""
+    sch = Item()
+    proc_pool = parallel.ProcessPool(
+        [sch], processes=2, min_items=3, batch_size=2
+    )
+    proc_pool.schema = sch
+    yield proc_pool
+    proc_pool.shutdown()
+
+
+class TestIsBatchable:
+    """Test detecting schemas which may be used in batches"""
+
+    @pytest.mark.parametrize('sch, exp', [
+        (Item(), True),
+        (Envelope(), False),
+    ])
+    def test_is_batchable(self, sch, exp):
+        # type: (Schema, bool) -> None
+        """Test schemas with and without pass_many processors"""
+        assert parallel.is_batchable(sch) is exp
+
+
+class TestProcessPool:
+    """Test (de)serializing in a process pool"""
+
+    def test_register(self, pool):
+        # type: (parallel.ProcessPool) -> None
+        """Test registering schemas"""
+
+        class Local(Schema):
+            """A schema which cannot be pickled"""
+            id = fields.Integer()
+
+        assert pool.is_registered(pool.schema)
+        assert pool.register(pool.schema)
+        assert not pool.register(Envelope())
+        assert not pool.register(Local())
+        assert not pool.is_registered(Item())
+
+    def test_dump(self, pool):
+        # type: (parallel.ProcessPool) -> None
+        """Test dumping in batches"""
+        objs = [{'id': i, 'name': str(i)} for i in range(7)]
+        objs[4]['id'] = 'bad'
+        objs[5]['name'] = 5
+
+        data, errors = pool.dump(pool.schema, objs)
+        assert pool._executor is not None
+        assert (data, errors) == tuple(pool.schema.dump(objs, many=True))
+        assert sorted(errors) == [4]
+
+    def test_load(self, pool):
+        # type: (parallel.ProcessPool) -> None
+        """Test loading in batches"""
+        items = [{'id': i, 'title': str(i)} for i in range(7)]
+        items[1]['id'] = 'bad'
+        del items[6]['id']
+
+        data, errors = pool.load(pool.schema, items)
+        assert pool._executor is not None
+        assert (data, errors) == tuple(pool.schema.load(items, many=True))
+        assert sorted(errors) == [1, 6]
+
+    @pytest.mark.parametrize('sch, items', [
+        (Item(), [{'id': 1}] * 5),
+        (None, [{'id': 1}] * 3),
+        (None, iter([{'id': 1}] * 5)),
+    ])
+    def test_in_process(self, pool, sch, items):
+        # type: (parallel.ProcessPool, Schema, object) -> None
+        """Test that the pool is only used for large collections"""
+        sch = sch or pool.schema
+        assert not pool.should_run(sch, items)
+        data, errors = pool.dump(sch, items)
+        assert data == [{'id': 1}] * len(data)
+        assert pool._executor is None
+
+    def test_unpicklable(self, pool):
+        # type: (parallel.ProcessPool) -> None
+        """Test falling back for objects which cannot be pickled"""
+        objs = [{'id': 1, 'name': 'a', 'func': lambda: None}] * 5
+        assert pool.dump(pool.schema, objs) == tuple(
+            pool.schema.dump(objs, many=True)
+        )
+
+    def test_unavailable(self, pool):
+        # type: (parallel.ProcessPool) -> None
+        """Test falling back if the pool cannot be started"""
+        objs = [{'id': 1}] * 5
+        with mock.patch.object(
+            parallel, 'ProcessPoolExecutor', side_effect=OSError()
+        ):
+            assert pool.dump(pool.schema, objs) == ([{'id': 1}] * 5, {})
+        assert not pool.available
+        assert not pool.should_run(pool.schema, objs)
+
+    def test_broken(self, pool):
+        # type: (parallel.ProcessPool) -> None
+        """Test that broken pools are restarted"""
+        objs = [{'id': 1}] * 5
+        executor = mock.Mock()
+        executor.submit.side_effect = parallel.BrokenProcessPool()
+        pool._executor = executor
+
+        assert pool.dump(pool.schema, objs) == ([{'id': 1}] * 5, {})
+        executor.shutdown.assert_called_once_with(wait=False)
+        assert pool._executor is None
+        assert pool.available
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.pool
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import threading
+
+# Third party
+import pytest
+from marshmallow import fields, Schema
+
+# Local
+from falcon_marshmallow import pool
+
+
+class Inner(Schema):
+    """A schema to nest"""
+    a = fields.Integer()
+    b = fields.Integer()
+    ctx = fields.Method('get_ctx')
+
+    def get_ctx(self, obj):
+        """Return a value from the context"""
+        return self.context.get('value')
+
+
+class Outer(Schema):
+    """A schema using its context"""
+    inner = fields.Nested(Inner)
+    nums = fields.List(fields.Integer())
+    ctx = fields.Method('get_ctx')
+
+    def get_ctx(self, obj):
+        """Return a value from the context"""
+        return self.context.get('value')
+
+
+DATA = {'inner': {'a': 1, 'b': 2}, 'nums': [1, '2']}
+
+
+class TestCloneSchema:
+    """Test cloning schemas"""
+
+    @pytest.mark.parametrize('kwargs', [
+        {},
+        {'many': True},
+        {'only': ('inner.a', 'ctx')},
+        {'exclude': ('inner.b', 'nums')},
+        {'dump_only': ('nums',)},
+    ])
+    def test_same_results(self, kwargs):
+        # type: (dict) -> None
+        """Test that clones behave like the original"""
+        sch = Outer(context={'value': 1}, **kwargs)
+        clone = pool.clone_schema(sch)
+        data = [DATA] if sch.many else DATA
+
+        assert clone is not sch
+        assert type(clone) is Outer
+        assert clone.dump(data) == sch.dump(data)
+        assert clone.load(data) == sch.load(data)
+
+    def test_context_isolated(self):
+        """Test that clones have their own context"""
+        sch = Outer(context={'value': 1})
+        sch.dump(DATA)  # Instantiate the nested schema
+        clone = pool.clone_schema(sch)
+        clone.context['value'] = 2
+
+        assert clone.dump(DATA).data['ctx'] == 2
+        assert clone.dump(DATA).data['inner']['ctx'] == 2
+        assert sch.dump(DATA).data['ctx'] == 1
+        assert sch.dump(DATA).data['inner']['ctx'] == 1
+
+    def test_fields_bound_to_clone(self):
+        """Test that the clone's fields belong to the clone"""
+        sch = Outer()
+        clone = pool.clone_schema(sch)
+        for name, field in clone.fields.items():
+            assert field is not sch.fields[name]
+            assert field.parent is clone
+        for field in sch.fields.values():
+            assert field.parent is sch
+
+
+class TestSchemaPool:
+    """Test pooling schema clones"""
+
+    def test_invalid_size(self):
+        """Test that pools must have room for a clone"""
+        with pytest.raises(ValueError):
+            pool.SchemaPool(0)
+
+    def test_reuse(self):
+        """Test that released clones are reused"""
+        sch_pool = pool.SchemaPool()
+        sch = Outer()
+
+        with sch_pool.borrow(sch) as first:
+            assert first is not sch
+            with sch_pool.borrow(sch) as second:
+                assert second is not first
+                assert sch_pool.stats()['in_use'] == 2
+        with sch_pool.borrow(sch) as third:
+            assert third in (first, second)
+
+        assert sch_pool.stats() == {
+            'created': 2, 'reused': 1, 'discarded': 0, 'in_use': 0,
+            'idle': 2,
+        }
+
+    def test_context_reset(self):
+        """Test that one caller's context does not reach the next"""
+        sch_pool = pool.SchemaPool(max_size=1)
+        sch = Outer(context={'value': 1})
+
+        for _ in range(3):
+            with sch_pool.borrow(sch) as clone:
+                assert clone.context == {'value': 1}
+                data = clone.dump(DATA).data
+                assert data['ctx'] == data['inner']['ctx'] == 1
+                clone.context['value'] = 2
+                clone.context['seen'] = True
+                data = clone.dump(DATA).data
+                assert data['ctx'] == data['inner']['ctx'] == 2
+
+        # Changes to the declared schema's context are picked up
+        sch.context['value'] = 3
+        with sch_pool.borrow(sch) as clone:
+            data = clone.dump(DATA).data
+            assert data['ctx'] == data['inner']['ctx'] == 3
+        assert sch_pool.stats()['reused'] == 3
+
+    def test_bounded(self):
+        """Test that at most max_size idle clones are kept per schema"""
+        sch_pool = pool.SchemaPool(max_size=2)
+        schemas = [Outer(), Inner()]
+
+        for sch in schemas:
+            clones = [sch_pool.acquire(sch) for _ in range(3)]
+            for clone in clones:
+                sch_pool.release(sch, clone)
+
+        assert sch_pool.stats() == {
+            'created': 6, 'reused': 0, 'discarded': 2, 'in_use': 0,
+            'idle': 4,
+        }
+
+    def test_released_on_error(self):
+        """Test that clones are returned to the pool on errors"""
+        sch_pool = pool.SchemaPool()
+        with pytest.raises(RuntimeError):
+            with sch_pool.borrow(Outer()):
+                raise RuntimeError()
+        assert sch_pool.stats()['in_use'] == 0
+
+    def test_threads(self):
+        """Test that concurrent users never share a clone"""
+        sch_pool = pool.SchemaPool(max_size=2)
+        sch = Outer()
+        barrier = threading.Barrier(4)
+        seen = []
+        errors = []
+
+        def work(value):
+            # type: (int) -> None
+            """Dump with a context specific to this thread"""
+            try:
+                for _ in range(20):
+                    with sch_pool.borrow(sch) as clone:
+                        assert clone is not sch
+                        clone.context['value'] = value
+                        barrier.wait(timeout=5)
+                        seen.append(clone)
+                        assert clone.dump(DATA).data['ctx'] == value
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+                barrier.abort()
+
+        threads = [
+            threading.Thread(target=work, args=(i,)) for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        stats = sch_pool.stats()
+        assert stats['in_use'] == 0
+        assert stats['idle'] == 2
+        assert stats['created'] + stats['reused'] == 80
+        assert len(set(map(id, seen))) == stats['created']
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.profiling
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import cProfile
+import os
+import pstats
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from typing import Optional
+
+# Third party
+import pytest
+
+# Local
+from falcon_marshmallow import profiling
+
+
+class Resource:
+    """A resource to name profiles after"""
+
+
+def _request(headers=None, uri_template='/philosophers/{id}'):
+    # type: (Optional[dict], Optional[str]) -> mock.Mock
+    headers = headers or {}
+    return mock.Mock(
+        context={},
+        method='GET',
+        uri_template=uri_template,
+        get_header=lambda name: headers.get(name),
+    )
+
+
+@pytest.mark.parametrize('sample_rate, headers, token, exp', [
+    (0, {}, None, False),
+    (1, {}, None, True),
+    (0.5, {}, None, True),
+    (0.1, {}, None, False),
+    (0, {'X-Profile': '1'}, None, True),
+    (0, {'X-Profile': 'secret'}, 'secret', True),
+    (0, {'X-Profile': 'guess'}, 'secret', False),
+    (0, {'X-Other': 'secret'}, 'secret', False),
+])
+def test_should_profile(sample_rate, headers, token, exp):
+    # type: (float, dict, Optional[str], bool) -> None
+    """Test selecting requests to profile"""
+    profiler = profiling.RequestProfiler(
+        'profiles', sample_rate, header='X-Profile', token=token,
+        random=lambda: 0.25,
+    )
+    assert profiler.should_profile(_request(headers)) is exp
+
+
+@pytest.mark.parametrize('sample_rate', [-0.1, 1.5])
+def test_invalid_sample_rate(sample_rate):
+    # type: (float) -> None
+    """Test that sample rates must be fractions"""
+    with pytest.raises(ValueError):
+        profiling.RequestProfiler('profiles', sample_rate)
+
+
+def test_start():
+    """Test that profiles are kept on the request"""
+    profiler = profiling.RequestProfiler('profiles', 1)
+    req = _request()
+    profile = profiler.start(req)
+    assert isinstance(profile, cProfile.Profile)
+    assert req.context[profiling.PROFILE_KEY] is profile
+
+    profiler = profiling.RequestProfiler('profiles')
+    req = _request()
+    assert profiler.start(req) is None
+    assert profiling.PROFILE_KEY not in req.context
+
+
+def test_enabled():
+    """Test that only one profile is enabled at a time"""
+    profiler = profiling.RequestProfiler('profiles', 1)
+    first, second = _request(), _request()
+    first_profile = profiler.start(first)
+    second_profile = profiler.start(second)
+    with profiler.enabled(first, first_profile):
+        with profiler.enabled(second, second_profile):
+            pass
+    assert first.context[profiling.PROFILE_KEY] is first_profile
+    assert profiling.PROFILE_KEY not in second.context
+
+    # Once the first is disabled, others may be enabled
+    third = _request()
+    with profiler.enabled(third, profiler.start(third)):
+        pass
+    assert profiling.PROFILE_KEY in third.context
+
+
+def test_enabled_other_tool():
+    """Test that requests are not profiled alongside other tools"""
+    profiler = profiling.RequestProfiler('profiles', 1)
+    req = _request()
+    profile = mock.Mock(enable=mock.Mock(side_effect=ValueError(
+        'Another profiling tool is already active'
+    )))
+    with profiler.enabled(req, profile):
+        pass
+    profile.disable.assert_not_called()
+    assert profiling.PROFILE_KEY not in req.context
+
+    # The failure does not keep other requests from being profiled
+    req = _request()
+    with profiler.enabled(req, profiler.start(req)):
+        pass
+    assert profiling.PROFILE_KEY in req.context
+
+
+@pytest.mark.parametrize('uri_template, exp_name', [
+    ('/philosophers/{id}', 'philosophers_id'),
+    ('/', 'root'),
+    (None, 'Resource'),
+])
+def test_write(tmpdir, uri_template, exp_name):
+    # type: (object, Optional[str], str) -> None
+    """Test writing stats named after the route"""
+    directory = os.path.join(str(tmpdir), 'profiles')
+    profiler = profiling.RequestProfiler(directory, 1)
+    req = _request(uri_template=uri_template)
+    profile = profiler.start(req)
+    profile.enable()
+    sorted(range(10))
+    profile.disable()
+
+    path = profiler.write(req, Resource(), profile)
+    assert os.path.dirname(path) == directory
+    assert os.path.basename(path).startswith('%s.GET.' % exp_name)
+    assert path.endswith('.prof')
+    assert pstats.Stats(path).total_calls > 0
+    assert profiling.PROFILE_KEY not in req.context
+    # Later profiles do not overwrite earlier ones
+    assert profiler.write(req, Resource(), profile) != path
+
+
+def test_write_error(tmpdir):
+    # type: (object) -> None
+    """Test that profiles which cannot be written are dropped"""
+    path = os.path.join(str(tmpdir), 'file')
+    with open(path, 'w'):
+        pass
+    profiler = profiling.RequestProfiler(path, 1)
+    req = _request()
+    assert profiler.write(req, Resource(), profiler.start(req)) is None
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.routes
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+
+# Third party
+import pytest
+from falcon import API
+
+# Local
+from falcon_marshmallow import routes
+
+
+class Collection:
+    """A resource with responders for a collection and its items"""
+
+    def on_get(self, req, resp):
+        """List items"""
+
+    def on_post(self, req, resp):
+        """Add an item"""
+
+    def on_get_item(self, req, resp, item_id):
+        """Get an item"""
+
+
+class Item:
+    """A resource with a single responder"""
+
+    def on_delete(self, req, resp, item_id):
+        """Delete an item"""
+
+
+def test_iter_routes():
+    """Test that every route and responder is found"""
+    collection, item = Collection(), Item()
+    app = API()
+    app.add_route('/items', collection)
+    app.add_route('/items/{item_id}', item)
+    app.add_route('/items/{item_id}/full', collection, suffix='item')
+
+    found = sorted(routes.iter_routes(app), key=lambda route: route[0])
+
+    assert found == [
+        ('/items', collection, ['GET', 'POST']),
+        ('/items/{item_id}', item, ['DELETE']),
+        ('/items/{item_id}/full', collection, ['GET']),
+    ]
+    assert list(routes.iter_routes(app._router)) == list(
+        routes.iter_routes(app)
+    )
+
+
+def test_iter_routes_unsupported_router():
+    """Test that routers which cannot be walked are rejected"""
+    with pytest.raises(TypeError):
+        routes.iter_routes(object())
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.streaming
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import io
+import json as std_json
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+# Third party
+import pytest
+import simplejson as json
+
+# Local
+from falcon_marshmallow import streaming
+
+
+class TestLoadJSONStream:
+    """Test incremental parsing of request bodies"""
+
+    @pytest.mark.parametrize('doc', [
+        '[]',
+        ' [ ] ',
+        '[1e5, 1.25, -3, "a\\u00e9", {"x": [1, {"y": null}]}, true, null]',
+        '[ "é", 1 ]  ',
+        '{"foo": "bar"}',
+        '"foo"',
+        '12345',
+        json.dumps([{'id': i, 'name': 'ü' * i} for i in range(100)]),
+    ])
+    @pytest.mark.parametrize('chunk_size', [1, 3, 64, 1024 * 1024])
+    @pytest.mark.parametrize('json_module', [json, std_json])
+    def test_parses_like_loads(self, doc, chunk_size, json_module):
+        # type: (str, int, object) -> None
+        """Test that results match those of ``json.loads``"""
+        stream = io.BytesIO(doc.encode('utf-8'))
+        parsed = streaming.load_json_stream(stream, json_module, chunk_size)
+        assert parsed == json.loads(doc)
+
+    @pytest.mark.parametrize('doc', [
+        '', '[', '[1', '[1,]', '[,1]', '[1 2]', '[tru]', '[1] x', '{"a":',
+    ])
+    @pytest.mark.parametrize('chunk_size', [1, 3, 1024])
+    def test_invalid_json(self, doc, chunk_size):
+        # type: (str, int) -> None
+        """Test that invalid documents raise JSONDecodeError"""
+        stream = io.BytesIO(doc.encode('utf-8'))
+        with pytest.raises(json.JSONDecodeError):
+            streaming.load_json_stream(stream, json, chunk_size)
+
+    @pytest.mark.parametrize('body', [b'["\xe7"]', b'["\xc3'])
+    def test_invalid_unicode(self, body):
+        # type: (bytes) -> None
+        """Test that invalid UTF-8 raises UnicodeDecodeError"""
+        with pytest.raises(UnicodeDecodeError):
+            streaming.load_json_stream(io.BytesIO(body), json, 1)
+
+    def test_reads_in_chunks(self):
+        """Test that the stream is never read in one go"""
+        doc = json.dumps([{'id': i} for i in range(1000)]).encode('utf-8')
+        stream = io.BytesIO(doc)
+
+        sizes = []
+        orig_read = stream.read
+
+        def read(size=-1):
+            sizes.append(size)
+            return orig_read(size)
+
+        stream.read = read
+        streaming.load_json_stream(stream, json, 128)
+        assert sizes
+        assert all(0 < size < len(doc) for size in sizes)
+
+
+class TestDumpJSONStream:
+    """Test batched serialization of iterable results"""
+
+    @pytest.mark.parametrize('count', [0, 1, 5, 6, 17])
+    @pytest.mark.parametrize('batch_size', [1, 5, 100])
+    def test_output(self, count, batch_size):
+        # type: (int, int) -> None
+        """Test that the chunks make up a valid JSON array"""
+        items = ({'id': i, 'name': 'é'} for i in range(count))
+        chunks = list(
+            streaming.dump_json_stream(items, json.dumps, batch_size)
+        )
+        assert all(isinstance(chunk, bytes) for chunk in chunks)
+        parsed = json.loads(b''.join(chunks).decode('utf-8'))
+        assert parsed == [{'id': i, 'name': 'é'} for i in range(count)]
+
+    def test_batches(self):
+        """Test that items are pulled and dumped batch by batch"""
+        batches = []
+
+        def dump_batch(batch):
+            batches.append(batch)
+            return json.dumps(batch)
+
+        chunks = streaming.dump_json_stream(iter(range(7)), dump_batch, 3)
+        # The first batch is dumped eagerly
+        assert batches == [[0, 1, 2]]
+        list(chunks)
+        assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+    def test_first_batch_error_raised_eagerly(self):
+        """Test that errors dumping the first batch are raised early"""
+        with pytest.raises(TypeError):
+            streaming.dump_json_stream(iter([set()]), json.dumps, 10)
+
+
+class TestLoadNDJSONStream:
+    """Test lazy loading of newline-delimited JSON bodies"""
+
+    @pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+    def test_iter_lines(self, chunk_size):
+        # type: (int) -> None
+        """Test that non-blank lines are numbered from 1"""
+        stream = io.BytesIO(b'{"a": 1}\n\n  \n{"b": 2}\r\n{"c": 3}')
+        assert list(streaming.iter_lines(stream, chunk_size)) == [
+            (1, b'{"a": 1}'), (4, b'{"b": 2}\r'), (5, b'{"c": 3}'),
+        ]
+
+    def test_load(self):
+        """Test that records are loaded or reported as errors"""
+        stream = io.BytesIO(
+            '{"id": 1}\n{"id": "é"}\n{::\n\n{"id": 4}\n'.encode('utf-8')
+        )
+
+        def load(record):
+            """Load records with integer ids"""
+            if isinstance(record['id'], int):
+                return record['id'], {}
+            return None, {'id': ['Not a valid integer.']}
+
+        records = list(streaming.load_ndjson_stream(stream, load, json.loads))
+        assert records[0] == 1
+        assert records[1] == streaming.RecordError(
+            2, {'id': ['Not a valid integer.']}
+        )
+        assert isinstance(records[2], streaming.RecordError)
+        assert records[2].line == 3
+        assert list(records[2].errors) == ['_schema']
+        assert records[3] == 4
+
+    def test_lazy(self):
+        """Test that the stream is only read as records are consumed"""
+        stream = mock.Mock()
+        stream.read.side_effect = [b'{"a": 1}\n', b'{"a": 2}\n', b'']
+        records = streaming.load_ndjson_stream(
+            stream, lambda record: (record, {}), json.loads
+        )
+        stream.read.assert_not_called()
+        assert next(records) == {'a': 1}
+        assert stream.read.call_count == 1
+        assert list(records) == [{'a': 2}]
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for falcon_marshmallow.validation
+"""
+
+# Std lib
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals
+)
+import json
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from typing import Optional
+
+# Third party
+import pytest
+from marshmallow import fields, Schema, validates_schema, ValidationError
+
+# Local
+from falcon_marshmallow import validation
+
+
+class Item(Schema):
+    """A schema for collection items"""
+    id = fields.Integer(required=True)
+
+
+class Items(Item):
+    """A schema rejecting collections with duplicate items"""
+
+    @validates_schema(pass_many=True)
+    def unique(self, data, many):
+        if many and len(set(item['id'] for item in data)) < len(data):
+            raise ValidationError('Duplicate items')
+
+
+class TestLoadFailFast:
+    """Test loading collections until enough errors are found"""
+
+    @staticmethod
+    def _data(size, invalid=()):
+        # type: (int, tuple) -> list
+        return [
+            {'id': 'x' if index in invalid else index}
+            for index in range(size)
+        ]
+
+    def test_valid(self):
+        """Test that valid collections are loaded in full"""
+        data = self._data(250)
+        loaded, errors, stopped = validation.load_fail_fast(
+            lambda items: Item().load(items, many=True), data, 5
+        )
+        assert loaded == data
+        assert errors == {}
+        assert not stopped
+
+    def test_stops_after_batch(self):
+        """Test that batches after the one reaching the limit are skipped"""
+        load = mock.Mock(
+            side_effect=lambda items: Item().load(items, many=True)
+        )
+        data = self._data(500, invalid=(3, 150, 160, 170, 400))
+        loaded, errors, stopped = validation.load_fail_fast(load, data, 3)
+        assert stopped
+        assert sorted(errors) == [3, 150, 160, 170]
+        assert len(loaded) == 200
+        assert load.call_count == 2
+
+    def test_errors_in_last_batch(self):
+        """Test reaching the limit in the last batch"""
+        data = self._data(150, invalid=(120, 130))
+        loaded, errors, stopped = validation.load_fail_fast(
+            lambda items: Item().load(items, many=True), data, 2
+        )
+        assert not stopped
+        assert sorted(errors) == [120, 130]
+
+    def test_batch_size(self):
+        """Test that batches are no smaller than the limit"""
+        load = mock.Mock(return_value=([], {}))
+        validation.load_fail_fast(load, self._data(20), 10, batch_size=1)
+        assert load.call_count == 2
+
+    def test_schema_errors(self):
+        """Test that errors of a whole batch stop loading"""
+        data = self._data(300)
+        data[1]['id'] = 0
+        loaded, errors, stopped = validation.load_fail_fast(
+            lambda items: Items().load(items, many=True), data, 10
+        )
+        assert stopped
+        assert list(errors) == ['_schema']
+
+
+@pytest.mark.parametrize('max_errors, exp, truncated', [
+    (None, ['b', 'a', '_schema'], False),
+    (3, ['b', 'a', '_schema'], False),
+    (2, ['_schema', 'a'], True),
+])
+def test_truncate_errors(max_errors, exp, truncated):
+    # type: (Optional[int], list, bool) -> None
+    """Test keeping the first errors"""
+    errors = {'b': ['Bad'], 'a': ['Bad'], '_schema': ['Bad']}
+    kept, was_truncated = validation.truncate_errors(errors, max_errors)
+    assert sorted(kept) == sorted(exp)
+    assert was_truncated == truncated
+    if truncated:
+        assert list(kept) == exp
+
+
+def test_truncate_item_errors():
+    """Test that item errors are kept in order of position"""
+    errors = dict((index, ['Bad']) for index in (12, 2, 30, 100))
+    kept, truncated = validation.truncate_errors(errors, 3)
+    assert list(kept) == [2, 12, 30]
+    assert truncated
+
+
+class TestDumpErrors:
+    """Test serializing errors within a size"""
+
+    errors = dict((index, ['Not a valid integer.']) for index in range(50))
+
+    def test_unbounded(self):
+        """Test that errors are dumped as is without a limit"""
+        dumped = validation.dump_errors(self.errors, json.dumps)
+        assert dumped == json.dumps(self.errors)
+
+    def test_truncated(self):
+        """Test flagging errors which were already truncated"""
+        dumped = json.loads(validation.dump_errors(
+            {'id': ['Bad']}, json.dumps, truncated=True
+        ))
+        assert dumped == {'id': ['Bad'], validation.TRUNCATED_KEY: True}
+
+    @pytest.mark.parametrize('max_size', [20, 100, 500, 1000])
+    def test_max_size(self, max_size):
+        # type: (int) -> None
+        """Test that as many errors as fit are kept"""
+        dumped = validation.dump_errors(self.errors, json.dumps, max_size)
+        assert len(dumped) <= max_size
+        loaded = json.loads(dumped)
+        assert loaded.pop(validation.TRUNCATED_KEY) is True
+        kept = sorted(int(key) for key in loaded)
+        assert kept == list(range(len(kept)))
+        # One more error would not have fit
+        more = dict((index, self.errors[index]) for index in kept)
+        more[len(kept)] = self.errors[len(kept)]
+        more[validation.TRUNCATED_KEY] = True
+        assert len(json.dumps(more)) > max_size
+
+    def test_fits(self):
+        """Test that errors which fit are not truncated"""
+        dumped = validation.dump_errors(self.errors, json.dumps, 10000)
+        assert dumped == json.dumps(self.errors)